@@ -21,7 +21,8 @@ from retriever.lib.defaults import sample_script, CITATION, ENCODING, SCRIPT_SEA
 from retriever.lib.get_opts import parser
 from retriever.lib.repository import check_for_updates
 from retriever.lib.scripts import SCRIPT_LIST
-from retriever.lib.engine_tools import name_matches, reset_retriever
+from retriever.lib.blob_store import parse_size
+from retriever.lib.engine_tools import manage_cache, name_matches, reset_retriever
 
 encoding = ENCODING.lower()
 # sys removes the setdefaultencoding method at startup; reload to get it back
@@ -101,6 +102,10 @@ def main():
 
             return
 
+        elif args.command == 'cache':
+            manage_cache(args.action, args.entries, args.max_size)
+            return
+
         elif args.command == 'reset':
             reset_retriever(args.scope)
             return
@@ -171,6 +176,48 @@ def main():
         else:
             engine.use_cache = True
 
+        if hasattr(args, 'resume'):
+            engine.resume = args.resume
+
+        if hasattr(args, 'parallel'):
+            engine.parallel_workers = args.parallel
+
+        if hasattr(args, 'batch_size'):
+            engine.batch_size = args.batch_size
+            engine.batch_bytes = args.batch_bytes
+
+        if hasattr(args, 'binary_copy'):
+            engine.binary_copy = args.binary_copy
+
+        if hasattr(args, 'load_profile'):
+            engine.load_profile = args.load_profile
+
+        if hasattr(args, 'copy_workers'):
+            engine.copy_workers = args.copy_workers
+
+        if hasattr(args, 'max_statement_bytes') and args.max_statement_bytes:
+            engine.max_statement_bytes = args.max_statement_bytes
+
+        if hasattr(args, 'commit_rows'):
+            engine.commit_rows = args.commit_rows
+            engine.commit_bytes = args.commit_bytes
+            engine.commit_seconds = args.commit_seconds
+
+        if hasattr(args, 'infer_types'):
+            engine.infer_strategy = args.infer_types
+
+        if hasattr(args, 'revalidate'):
+            engine.revalidate = args.revalidate
+
+        if hasattr(args, 'cache_size') and args.cache_size:
+            engine.cache_size = parse_size(args.cache_size)
+
+        if hasattr(args, 'download_workers'):
+            engine.download_workers = args.download_workers
+
+        if hasattr(args, 'stream'):
+            engine.stream = args.stream
+
         if args.dataset is not None:
             scripts = name_matches(script_list, args.dataset)
         else:
@@ -1,7 +1,9 @@
 import os
 
 from retriever.lib.defaults import DATA_DIR
+from retriever.lib.converters import cell_converter
 from retriever.lib.dummy import DummyConnection
+from retriever.lib.load_plan import TableLoadPlan
 from retriever.lib.models import Engine
 from retriever.lib.tools import open_fw, open_csvw
 from retriever.lib.engine_tools import sort_csv
@@ -37,7 +39,8 @@ class engine(Engine):
         self.auto_column_number = 1
         self.file = open_fw(self.table_name())
         self.output_file = open_csvw(self.file)
-        self.output_file.writerow([u'{}'.format(val) for val in self.table.get_insert_columns(join=False, create=True)])
+        self.load_plan = TableLoadPlan(self, self.table)
+        self.output_file.writerow([u'{}'.format(val) for val in self.load_plan.header])
         self.table_names.append((self.file, self.table_name()))
 
     def disconnect(self):
@@ -65,12 +68,18 @@ class engine(Engine):
             pass
         return v
 
+    def get_column_converter(self, datatype):
+        """Text is re-quoted by format_insert_value so it is converted per value"""
+        if datatype.split('-')[-1] == "char":
+            return cell_converter(self.format_insert_value, datatype)
+        return Engine.get_column_converter(self, datatype)
+
     def insert_statement(self, values):
         """Returns a comma delimited row of values"""
         if not hasattr(self, 'auto_column_number'):
             self.auto_column_number = 1
 
-        if self.table.columns[0][1][0][3:] == 'auto':
+        if self.get_load_plan().auto_pk:
             newrows = []
             for rows in values:
                 insert_stmt = [self.auto_column_number] + rows
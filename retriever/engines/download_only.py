@@ -4,6 +4,7 @@ import inspect
 import os
 import shutil
 
+from retriever.lib.blob_store import prune_blobs
 from retriever.lib.defaults import DATA_DIR
 from retriever.lib.dummy import DummyConnection
 from retriever.lib.engine import filename_from_url
@@ -14,6 +15,8 @@ class engine(Engine):
     """Engine instance for writing data to a CSV file."""
     name = "Download Only"
     abbreviation = "download"
+    # The extracted files are what gets copied to the destination
+    extract_archives = True
     required_opts = [("path",
                       "File path to copy data files",
                       "./"),
@@ -42,6 +45,7 @@ class engine(Engine):
         name already exist in the directory.
 
         """
+        self.stop_downloads()
         if hasattr(self, "all_files"):
             for file_name in self.all_files:
                 file_path, file_name_nopath = os.path.split(file_name)
@@ -68,6 +72,8 @@ class engine(Engine):
                         except:
                             print("Couldn't create directory %s" % dest_path)
         self.all_files = set()
+        if self.cache_size is not None:
+            prune_blobs(self.cache_size)
 
     def auto_create_table(self, table, url=None, filename=None, pk=None):
         """Download the file if it doesn't exist"""
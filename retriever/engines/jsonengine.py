@@ -5,7 +5,9 @@ from builtins import zip
 from collections import OrderedDict
 
 from retriever.lib.defaults import DATA_DIR
+from retriever.lib.converters import cell_converter
 from retriever.lib.dummy import DummyConnection
+from retriever.lib.load_plan import TableLoadPlan
 from retriever.lib.models import Engine
 from retriever.lib.tools import open_fr, open_fw
 from retriever.lib.engine_tools import json2csv, sort_csv
@@ -42,6 +44,7 @@ class engine(Engine):
         self.output_file.write("[")
         self.table_names.append((self.output_file, self.table_name()))
         self.auto_column_number = 1
+        self.load_plan = TableLoadPlan(self, self.table)
 
     def disconnect(self):
         """Close out the JSON with a `\\n]}` and close the file.
@@ -82,12 +85,19 @@ class engine(Engine):
             pass
         return v
 
+    def get_column_converter(self, datatype):
+        """Text is re-quoted by format_insert_value so it is converted per value"""
+        if datatype.split('-')[-1] == "char":
+            return cell_converter(self.format_insert_value, datatype)
+        return Engine.get_column_converter(self, datatype)
+
     def insert_statement(self, values):
         if not hasattr(self, 'auto_column_number'):
             self.auto_column_number = 1
 
-        keys = self.table.get_insert_columns(join=False, create=True)
-        if self.table.columns[0][1][0][3:] == 'auto':
+        plan = self.get_load_plan()
+        keys = plan.header
+        if plan.auto_pk:
             newrows = []
             for rows in values:
                 insert_stmt = [self.auto_column_number] + rows
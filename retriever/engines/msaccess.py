@@ -4,6 +4,7 @@ import os
 import platform
 from builtins import str
 
+from retriever.lib.archives import is_stream_source
 from retriever.lib.defaults import DATA_DIR
 from retriever.lib.models import Engine, no_cleanup
 
@@ -24,6 +25,8 @@ class engine(Engine):
         "bool": "BIT",
     }
     insert_limit = 1000
+    # Bulk inserts read the data file by its path
+    extract_archives = True
     required_opts = [("file",
                       "Enter the filename of your Access database",
                       os.path.join(DATA_DIR, "access.mdb"),
@@ -59,10 +62,14 @@ class engine(Engine):
 
     def insert_data_from_file(self, filename):
         """Perform a bulk insert."""
+        if self.resume:
+            # Loads to resume are checkpointed one data file at a time
+            return Engine.insert_data_from_file(self, filename)
         self.get_cursor()
         ct = len([True for c in self.table.columns if c[1][0][:3] == "ct-"]) != 0
         if ((self.table.cleanup.function == no_cleanup and not self.table.fixed_width and
                      self.table.header_rows < 2)
+            and not is_stream_source(filename)
             and (self.table.delimiter in ["\t", ","])
             and not ct
             and (not hasattr(self.table, "do_not_bulk_insert") or not self.table.do_not_bulk_insert)
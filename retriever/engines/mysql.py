@@ -3,6 +3,7 @@ from __future__ import print_function
 import os
 from builtins import str
 
+from retriever.lib.archives import is_stream_source
 from retriever.lib.defaults import ENCODING
 from retriever.lib.models import Engine, no_cleanup
 
@@ -24,6 +25,8 @@ class engine(Engine):
     max_int = 4294967295
     placeholder = "%s"
     insert_limit = 1000
+    # LOAD DATA LOCAL INFILE reads the data file by its path
+    extract_archives = True
     required_opts = [("user",
                       "Enter your MySQL username",
                       "root"),
@@ -44,13 +47,38 @@ class engine(Engine):
                       "{db}.{table}"),
                      ]
 
+    def bulk_session_settings(self):
+        """Skip unique and foreign key checks while loading."""
+        return [("SET @old_unique_checks = @@unique_checks, unique_checks = 0",
+                 "SET unique_checks = @old_unique_checks"),
+                ("SET @old_foreign_key_checks = @@foreign_key_checks, foreign_key_checks = 0",
+                 "SET foreign_key_checks = @old_foreign_key_checks")]
+
+    def bulk_table_settings(self, table_name):
+        """Build the non-unique indexes of MyISAM tables once they are loaded."""
+        return [("ALTER TABLE " + table_name + " DISABLE KEYS",
+                 "ALTER TABLE " + table_name + " ENABLE KEYS")]
+
     def create_db_statement(self):
         """Return SQL statement to create a database."""
         createstatement = "CREATE DATABASE IF NOT EXISTS " + self.database_name()
         return createstatement
 
+    def executemany(self, statement, values, commit=True):
+        """Insert rows with multi-row "INSERT ... VALUES" statements.
+
+        pymysql rewrites an INSERT run with executemany into statements
+        holding as many rows as fit in `max_stmt_length` bytes, which is
+        set from `max_statement_bytes`.
+        """
+        self.cursor.max_stmt_length = self.max_statement_bytes
+        Engine.executemany(self, statement, values, commit)
+
     def insert_data_from_file(self, filename):
         """Call MySQL "LOAD DATA LOCAL INFILE" statement to perform a bulk insert."""
+        if self.resume:
+            # Loads to resume are checkpointed one data file at a time
+            return Engine.insert_data_from_file(self, filename)
 
         mysql_set_autocommit_off = """SET autocommit=0;"""
         mysql_set_autocommit_on = """SET autocommit=1;"""
@@ -58,13 +86,14 @@ class engine(Engine):
         self.get_cursor()
         ct = len([True for c in self.table.columns if c[1][0][:3] == "ct-"]) != 0
         if (self.table.cleanup.function == no_cleanup and
+                not is_stream_source(filename) and
                 not self.table.fixed_width and
                 not ct and
                 (not hasattr(self.table, "do_not_bulk_insert") or not self.table.do_not_bulk_insert)):
 
             print("Inserting data from " + os.path.basename(filename) + "...")
 
-            columns = self.table.get_insert_columns()
+            columns = self.get_load_plan().column_names
             statement = """
 BEGIN;
 LOAD DATA LOCAL INFILE '""" + filename.replace("\\", "\\\\") + """'
@@ -1,7 +1,20 @@
+from future import standard_library
+
+standard_library.install_aliases()
+import io
 import os
+import queue
+import threading
+from itertools import chain
 
+from retriever.lib.archives import is_stream_source
+from retriever.lib.batching import statement_pages
+from retriever.lib.binary_copy import BinaryRowStream, column_encoders
+from retriever.lib.converters import cell_converter
 from retriever.lib.defaults import ENCODING
-from retriever.lib.models import Engine, no_cleanup
+from retriever.lib.models import Engine, no_cleanup, skip_rows
+from retriever.lib.parallel import can_fork, map_chunks, record_chunks
+from retriever.lib.tools import CSVRowStream, open_fr
 
 
 class engine(Engine):
@@ -21,6 +34,9 @@ class engine(Engine):
     max_int = 2147483647
     placeholder = "%s"
     insert_limit = 1000
+    binary_copy = False
+    copy_workers = 1
+    unlogged_skipped = False
     required_opts = [("user",
                       "Enter your PostgreSQL username",
                       "postgres"),
@@ -44,6 +60,26 @@ class engine(Engine):
                       "{db}.{table}"),
                      ]
 
+    def bulk_session_settings(self):
+        """Commit without waiting for the WAL to be flushed and give index
+        builds more memory."""
+        return [("SET synchronous_commit = off", "RESET synchronous_commit"),
+                ("SET maintenance_work_mem = '1GB'", "RESET maintenance_work_mem")]
+
+    def bulk_table_settings(self, table_name):
+        """Load tables unlogged and write them to the WAL once loaded.
+
+        Tables can only be switched between logged and unlogged since
+        PostgreSQL 9.5.
+        """
+        if self.connection.server_version < 90500:
+            if not self.unlogged_skipped:
+                print("Tables are loaded logged, UNLOGGED tables need PostgreSQL 9.5")
+                self.unlogged_skipped = True
+            return []
+        return [("ALTER TABLE " + table_name + " SET UNLOGGED",
+                 "ALTER TABLE " + table_name + " SET LOGGED")]
+
     def create_db_statement(self):
         """In PostgreSQL, the equivalent of a SQL database is a schema."""
         return Engine.create_db_statement(self).replace("DATABASE", "SCHEMA")
@@ -67,31 +103,300 @@ class engine(Engine):
         statement += " CASCADE;"
         return statement.replace(" DATABASE ", " SCHEMA ")
 
+    def copy_chunks_from_file(self, filename, encoders=None, plain=False):
+        """COPY a large data file over `copy_workers` connections at once.
+
+        The file is split into chunks of whole records that are copied by a
+        pool of threads, each with its own connection and staging table, so
+        the server parses them on several cores. Chunks of plain CSV files
+        are sent as they are. Other chunks are parsed, cleaned and
+        converted by `load_chunk` first, in `parallel_workers` processes
+        when more than one is set, and sent as CSV or binary rows.
+
+        The staging tables are merged into the table by a single
+        "INSERT ... SELECT" once every chunk has been copied, so the load
+        is committed at once. If any chunk fails, nothing is added to the
+        table and the file is loaded over the main connection instead.
+        """
+        if not self.table.delimiter:
+            self.set_table_delimiter(filename)
+        columns = self.get_load_plan().column_names
+        quotechar = None if self.table.fixed_width else '"'
+        chunks = record_chunks(filename, self.parallel_chunk_size,
+                               self.table.header_rows, quotechar)
+        parsed = None
+        if plain:
+            results = chunks
+        elif self.parallel_workers > 1 and can_fork():
+            results = parsed = map_chunks(self, filename, chunks, self.parallel_workers)
+        else:
+            results = (self.load_chunk(filename, begin, end) for begin, end in chunks)
+
+        stages = [self.table_name() + "_copy{}".format(i) for i in range(self.copy_workers)]
+        connections = []
+        tasks = queue.Queue(self.copy_workers * 2)
+        errors = []
+
+        def work(connection, stage):
+            statement = self.copy_statement(encoders, plain, stage)
+            try:
+                cursor = connection.cursor()
+                if self.load_profile == "fast":
+                    for setting, _ in self.bulk_session_settings():
+                        cursor.execute(setting)
+            except Exception as e:
+                errors.append(e)
+            while True:
+                data_file = tasks.get()
+                if data_file is None:
+                    return
+                if errors:
+                    # Keep taking chunks so the reader is never blocked
+                    continue
+                try:
+                    cursor.copy_expert(statement, data_file)
+                except Exception as e:
+                    errors.append(e)
+
+        record_id = self.table.record_id
+        warning_count = len(self.warnings)
+        threads = []
+        try:
+            if parsed is not None:
+                # Fork the parsing processes before the copy connections and
+                # threads are started
+                results = chain([next(parsed, None)], parsed)
+            for stage in stages:
+                self.execute(self.drop_statement("TABLE", stage))
+                self.execute("CREATE UNLOGGED TABLE " + stage + " AS SELECT " + columns +
+                             " FROM " + self.table_name() + " WITH NO DATA")
+            for stage in stages:
+                connection = self.get_connection()
+                connections.append(connection)
+                thread = threading.Thread(target=work, args=(connection, stage))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+            for result in results:
+                if errors:
+                    break
+                if result is None:
+                    # The file has no records
+                    continue
+                if plain:
+                    begin, end = result
+                    with open(filename, 'rb') as data_file:
+                        data_file.seek(begin)
+                        tasks.put(io.BytesIO(data_file.read(end - begin)))
+                    continue
+                count, rows, warnings = result
+                for offset, message in warnings:
+                    self.warning('Exception in line %s: %s' % (self.table.record_id + offset, message))
+                self.table.record_id += count
+                tasks.put(self.copy_source(rows, encoders))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            if parsed is not None:
+                parsed.close()
+            for thread in threads:
+                tasks.put(None)
+            for thread in threads:
+                thread.join()
+        try:
+            for connection in connections:
+                if errors:
+                    connection.rollback()
+                else:
+                    connection.commit()
+                connection.close()
+            if not errors:
+                self.execute("INSERT INTO " + self.table_name() + " (" + columns + ") " +
+                             " UNION ALL ".join("SELECT " + columns + " FROM " + stage
+                                                for stage in stages), commit=False)
+                self.connection.commit()
+        except Exception as e:
+            errors.append(e)
+            self.connection.rollback()
+        for stage in stages:
+            self.execute_settings([self.drop_statement("TABLE", stage)])
+        if errors:
+            print("Parallel COPY failed ({}), loading {} over one connection".format(
+                errors[0], self.table_name()))
+            self.table.record_id = record_id
+            del self.warnings[warning_count:]
+            return Engine.insert_data_from_file(self, filename)
+
+    def copy_chunks_with_commits(self, filename, encoders=None, plain=False):
+        """COPY a data file one chunk at a time, committing as it goes.
+
+        This is the COPY counterpart of `add_to_table_in_chunks`, used with
+        `resume` or a commit policy. Chunks are committed as set by
+        `get_commit_policy`, or one by one when no limit is set, and each
+        commit is followed by a checkpoint so an interrupted load continues
+        after the last chunk committed. If a chunk fails, the chunks not
+        committed yet are rolled back and the rest of the file is loaded row
+        by row from the last checkpoint.
+        """
+        if not self.table.delimiter:
+            self.set_table_delimiter(filename)
+        statement = self.copy_statement(encoders, plain)
+        start = self.get_resume_offset(filename)
+        quotechar = None if self.table.fixed_width else '"'
+        chunks = record_chunks(filename, self.parallel_chunk_size,
+                               self.table.header_rows, quotechar, start)
+        policy = self.get_commit_policy()
+        record_id = self.table.record_id
+        warning_count = len(self.warnings)
+        try:
+            for begin, end in chunks:
+                if plain:
+                    with open(filename, 'rb') as data_file:
+                        data_file.seek(begin)
+                        data = data_file.read(end - begin)
+                    count = data.count(b'\n')
+                    self.cursor.copy_expert(statement, io.BytesIO(data))
+                else:
+                    count, rows, warnings = self.load_chunk(filename, begin, end)
+                    for offset, message in warnings:
+                        self.warning('Exception in line %s: %s' % (self.table.record_id + offset, message))
+                    self.table.record_id += count
+                    self.cursor.copy_expert(statement, self.copy_source(rows, encoders))
+                policy.add(count, end - begin)
+                if policy.due() or not policy.limited():
+                    policy.commit(self.connection)
+                    self.checkpoint_chunk(filename, end)
+                    record_id = self.table.record_id
+                    warning_count = len(self.warnings)
+            policy.commit(self.connection)
+        except Exception as e:
+            self.connection.rollback()
+            self.table.record_id = record_id
+            del self.warnings[warning_count:]
+            print("COPY failed ({}), loading the rest of {} row by row".format(
+                e, self.table_name()))
+            return self.add_to_table_in_chunks(filename)
+        self.checkpoint_file(filename)
+        self.report_commits()
+
+    def copy_csv_from_file(self, filename, columns):
+        """Send a CSV data file as it is to the server with "COPY FROM STDIN"."""
+        statement = "COPY " + self.table_name() + " (" + columns + \
+                    ") FROM STDIN WITH DELIMITER ',' CSV HEADER"
+        try:
+            with open_fr(filename) as data_file:
+                self.cursor.copy_expert(statement, data_file)
+            self.connection.commit()
+        except:
+            self.connection.rollback()
+            return Engine.insert_data_from_file(self, filename)
+
+    def copy_rows_from_file(self, filename, encoders=None):
+        """Stream the rows of a data file into "COPY FROM STDIN".
+
+        The file is split, cleaned, unpivoted and converted as in
+        `add_to_table`, and the rows are encoded as CSV while the server
+        reads them, so any table can be copied from the client side. Given
+        the `encoders` of the columns, rows are sent in binary format.
+        """
+        data_source = (skip_rows,
+                       (self.table.header_rows,
+                        (self.load_data, (filename,))))
+        batches = self.read_batches(data_source, self.get_batch_sizer())
+        rows = (row for raw_rows, record_ids in batches
+                for row in self.convert_batch(raw_rows, record_ids))
+        record_id = self.table.record_id
+        warning_count = len(self.warnings)
+        try:
+            self.cursor.copy_expert(self.copy_statement(encoders),
+                                    self.copy_source(rows, encoders))
+            self.connection.commit()
+        except:
+            self.connection.rollback()
+            # The rows are read again, with their warnings
+            self.table.record_id = record_id
+            del self.warnings[warning_count:]
+            return Engine.insert_data_from_file(self, filename)
+
+    def copy_source(self, rows, encoders=None):
+        """Return a file-like object sending rows to "COPY FROM STDIN"."""
+        if encoders:
+            return BinaryRowStream(rows, encoders)
+        return CSVRowStream(rows)
+
+    def copy_statement(self, encoders=None, plain=False, table_name=None):
+        """Return the "COPY FROM STDIN" statement of the current table.
+
+        `plain` is for CSV data sent as it was read, without its header.
+        `table_name` is that of a staging table to copy to instead.
+        """
+        statement = "COPY " + (table_name or self.table_name()) + " (" + \
+                    self.get_load_plan().column_names + ") FROM STDIN WITH "
+        if plain:
+            return statement + "DELIMITER ',' CSV"
+        if encoders:
+            return statement + "(FORMAT binary)"
+        return statement + "CSV"
+
+    def get_binary_encoders(self):
+        """Return the binary COPY encoders of the table columns.
+
+        Returns None if a column type has no binary encoder.
+        """
+        column_types = [self.datatypes.get(datatype.split('-')[-1])
+                        for datatype in self.get_load_plan().datatypes]
+        return column_encoders(column_types, self.script.encoding or ENCODING)
+
+    def executemany(self, statement, values, commit=True):
+        """Insert rows with multi-row "INSERT ... VALUES" statements.
+
+        psycopg2's executemany sends one statement per row. The rows are
+        sent with execute_values instead, in statements of at most
+        `max_statement_bytes`.
+        """
+        from psycopg2.extras import execute_values
+        head, separator, _ = statement.rpartition(" VALUES ")
+        if not separator:
+            return Engine.executemany(self, statement, values, commit)
+        for page in statement_pages(values, self.max_statement_bytes):
+            execute_values(self.cursor, head + " VALUES %s", page, page_size=len(page))
+        if commit:
+            self.connection.commit()
+
     def insert_data_from_file(self, filename):
-        """Use PostgreSQL's "COPY FROM" statement to perform a bulk insert."""
+        """Use PostgreSQL's "COPY FROM STDIN" statement to perform a bulk insert.
+
+        The data is sent from the client, so the server does not need access
+        to the file. Plain CSV files are sent as they are; other tables are
+        parsed and cleaned in Python on the way (see `copy_rows_from_file`).
+        With `binary_copy` set, all tables whose column types allow it are
+        sent in binary format. Files larger than `parallel_chunk_size` are
+        copied over `copy_workers` connections when more than one is set
+        (see `copy_chunks_from_file`). With `resume` or a commit policy,
+        files are copied one chunk at a time with commits and checkpoints
+        in between (see `copy_chunks_with_commits`).
+        """
+        if hasattr(self.table, "do_not_bulk_insert") and self.table.do_not_bulk_insert:
+            return Engine.insert_data_from_file(self, filename)
         self.get_cursor()
-        ct = len([True for c in self.table.columns if c[1][0][:3] == "ct-"]) != 0
-        if (([self.table.cleanup.function, self.table.delimiter,
-              self.table.header_rows] == [no_cleanup, ",", 1])
-            and not self.table.fixed_width
-            and not ct
-            and (not hasattr(self.table, "do_not_bulk_insert") or not self.table.do_not_bulk_insert)):
-            columns = self.table.get_insert_columns()
-            filename = os.path.abspath(filename)
-            statement = """
-COPY """ + self.table_name() + " (" + columns + """)
-FROM '""" + filename.replace("\\", "\\\\") + """'
-WITH DELIMITER ','
-CSV HEADER;"""
-            try:
-                self.execute("BEGIN")
-                self.execute(statement)
-                self.execute("COMMIT")
-            except:
-                self.connection.rollback()
+        plan = self.get_load_plan()
+        encoders = self.get_binary_encoders() if self.binary_copy else None
+        plain = (([self.table.cleanup.function, self.table.delimiter,
+                   self.table.header_rows] == [no_cleanup, ",", 1])
+                 and not self.table.fixed_width
+                 and not plan.crosstab
+                 and not encoders)
+        if self.resume or self.get_commit_policy().limited():
+            if is_stream_source(filename):
+                # Streams are committed as they are read by the row path
                 return Engine.insert_data_from_file(self, filename)
-        else:
-            return Engine.insert_data_from_file(self, filename)
+            return self.copy_chunks_with_commits(filename, encoders, plain)
+        if (self.copy_workers > 1 and not is_stream_source(filename) and
+                os.path.getsize(filename) > self.parallel_chunk_size):
+            return self.copy_chunks_from_file(filename, encoders, plain)
+        if plain:
+            return self.copy_csv_from_file(filename, plan.column_names)
+        return self.copy_rows_from_file(filename, encoders)
 
     def insert_statement(self, values):
         """Return SQL statement to insert a set of values."""
@@ -122,6 +427,12 @@ CSV HEADER;"""
                 pass
         return Engine.format_insert_value(self, value, datatype)
 
+    def get_column_converter(self, datatype):
+        """Booleans are written as TRUE/FALSE so they use format_insert_value."""
+        if datatype.split('-')[-1] == "bool":
+            return cell_converter(self.format_insert_value, datatype)
+        return Engine.get_column_converter(self, datatype)
+
     def get_connection(self):
         """Gets the db connection.
 
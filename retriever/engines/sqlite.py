@@ -1,8 +1,9 @@
 import os
-from builtins import range
 
+from retriever.lib.archives import is_stream_source
 from retriever.lib.defaults import DATA_DIR
 from retriever.lib.models import Engine, no_cleanup
+from retriever.lib.tools import open_fr
 
 
 class engine(Engine):
@@ -30,6 +31,20 @@ class engine(Engine):
                       "{db}_{table}"),
                      ]
 
+    def bulk_session_settings(self):
+        """Keep the rollback journal and temporary data in memory, skip
+        syncing to disk and use a larger page cache while loading."""
+        settings = []
+        for pragma, value in (("journal_mode", "MEMORY"),
+                              ("synchronous", "OFF"),
+                              ("cache_size", "-262144"),
+                              ("temp_store", "MEMORY")):
+            self.cursor.execute("PRAGMA " + pragma)
+            current = self.cursor.fetchone()[0]
+            settings.append(("PRAGMA {} = {}".format(pragma, value),
+                             "PRAGMA {} = {}".format(pragma, current)))
+        return settings
+
     def create_db(self):
         """Don't create database for SQLite
 
@@ -44,46 +59,46 @@ class engine(Engine):
         This places ?'s instead of the actual values so that executemany() can
         operate as designed
         """
-        columns = self.table.get_insert_columns()
-        column_count = len(self.table.get_insert_columns(False))
-        insert_stmt = "INSERT INTO " + self.table_name()
-        insert_stmt += " (" + columns + ")"
-        insert_stmt += " VALUES ("
-        for i in range(0, column_count):
-            insert_stmt += "?, "
-        insert_stmt = insert_stmt.rstrip(", ") + ")"
-        return insert_stmt
+        return self.get_load_plan().insert_stmt
 
     def insert_data_from_file(self, filename):
         """Perform a high speed bulk insert
 
         Checks to see if a given file can be bulk inserted, and if so loads
         it in chunks and inserts those chunks into the database using
-        executemany.
+        executemany. Cross-tab data is unpivoted one chunk at a time.
         """
+        if self.resume:
+            # Loads to resume are checkpointed one data file at a time
+            return Engine.insert_data_from_file(self, filename)
         chunk_size = 1000000
         self.get_cursor()
-
-        # Determine if the dataset includes cross-tab data
-        crosstab = len([True for c in self.table.columns if c[1][0][:3] == "ct-"]) != 0
+        plan = self.get_load_plan()
 
         if (([self.table.cleanup.function, self.table.header_rows] == [no_cleanup, 1])
             and not self.table.fixed_width
-            and not crosstab
             and (not hasattr(self.table, "do_not_bulk_insert") or not self.table.do_not_bulk_insert)):
-            filename = os.path.abspath(filename)
+            if not is_stream_source(filename):
+                filename = os.path.abspath(filename)
             try:
                 bulk_insert_statement = self.get_bulk_insert_statement()
                 line_endings = set(['\n', '\r', '\r\n'])
-                with open(filename, 'r') as data_file:
+                if is_stream_source(filename):
+                    data_file = open_fr(filename, encoding=None)
+                else:
+                    data_file = open(filename, 'r')
+                with data_file:
                     data_chunk = data_file.readlines(chunk_size)
                     data_chunk = [line.rstrip('\r\n') for line in data_chunk if line not in line_endings]
                     del data_chunk[:self.table.header_rows]
                     while data_chunk:
                         data_chunk_split = [row.split(self.table.delimiter)
                                             for row in data_chunk]
+                        if plan.crosstab:
+                            data_chunk_split = list(plan.unpivot(data_chunk_split))
                         self.cursor.executemany(bulk_insert_statement, data_chunk_split)
                         data_chunk = data_file.readlines(chunk_size)
+                        data_chunk = [line.rstrip('\r\n') for line in data_chunk if line not in line_endings]
                 self.connection.commit()
             except:
                 self.connection.rollback()
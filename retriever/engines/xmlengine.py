@@ -1,7 +1,9 @@
 import os
 
 from retriever.lib.defaults import DATA_DIR
+from retriever.lib.converters import cell_converter
 from retriever.lib.dummy import DummyConnection
+from retriever.lib.load_plan import TableLoadPlan
 from retriever.lib.models import Engine
 from retriever.lib.tools import open_fr, open_fw
 from retriever.lib.engine_tools import xml2csv, sort_csv
@@ -40,6 +42,7 @@ class engine(Engine):
         self.output_file.write(u'\n<root>')
         self.table_names.append((self.output_file, self.table_name()))
         self.auto_column_number = 1
+        self.load_plan = TableLoadPlan(self, self.table)
 
     def disconnect(self):
         """Close out the xml files
@@ -80,12 +83,17 @@ class engine(Engine):
             pass
         return v
 
+    def get_column_converter(self, datatype):
+        """Convert values with format_insert_value so nulls are written as empty elements."""
+        return cell_converter(self.format_insert_value, datatype)
+
     def insert_statement(self, values):
         if not hasattr(self, 'auto_column_number'):
             self.auto_column_number = 1
 
-        keys = self.table.get_insert_columns(join=False, create=True)
-        if self.table.columns[0][1][0][3:] == 'auto':
+        plan = self.get_load_plan()
+        keys = plan.header
+        if plan.auto_pk:
             newrows = []
             for rows in values:
                 insert_stmt = [self.auto_column_number] + rows
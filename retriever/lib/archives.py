@@ -0,0 +1,220 @@
+"""Data Retriever Archive Members
+
+This module contains the sources that read a data file straight out of a
+downloaded archive instead of a copy extracted to the raw data directory.
+A member source is written `<filetype>://<archive path>!<member>`, for
+example `zip:///home/user/.retriever/raw_data/bbs/counts.zip!Alabama.csv`,
+and can be passed to `open_fr` and the `Engine` methods loading data files
+wherever a file path is accepted. When the archive path is a url, the
+member is decompressed as the archive is downloaded (see
+retriever.lib.streaming).
+
+Members that do need to be extracted are copied out by an ArchiveSession,
+which opens the archive once for all the members requested from it.
+
+"""
+from __future__ import print_function
+
+from future import standard_library
+
+standard_library.install_aliases()
+from builtins import object
+import gzip
+import io
+import os
+import queue
+import tarfile
+import threading
+import zipfile
+from hashlib import md5
+
+from retriever.lib.streaming import StreamReader, is_remote, open_remote_member
+
+ARCHIVE_TYPES = ('zip', 'gz', 'tar')
+BLOCK_SIZE = 1024 * 1024
+
+
+def member_source(archive, member, filetype='zip'):
+    """Return the source reading a member of an archive."""
+    if not is_remote(archive):
+        archive = os.path.abspath(archive)
+    return '{}://{}!{}'.format(filetype, archive, member)
+
+
+def split_member_source(source):
+    """Return the archive type, archive path and member of a source.
+
+    Returns None for sources that are not archive members.
+    """
+    try:
+        filetype, separator, rest = source.partition('://')
+    except AttributeError:
+        return None
+    if not separator or filetype not in ARCHIVE_TYPES or '!' not in rest:
+        return None
+    archive, member = rest.rsplit('!', 1)
+    return filetype, archive, member
+
+
+def is_member_source(source):
+    """Check if a source is a member of an archive."""
+    return split_member_source(source) is not None
+
+
+def is_stream_source(source):
+    """Check if a source is read as a stream rather than a file on disk."""
+    return is_member_source(source) or is_remote(source)
+
+
+def is_remote_source(source):
+    """Check if a source is read from the network."""
+    return is_remote(source_path(source))
+
+
+def source_path(source):
+    """Return the file on disk holding a source."""
+    parts = split_member_source(source)
+    return parts[1] if parts else source
+
+
+def open_member(source):
+    """Open a member of an archive for reading bytes."""
+    filetype, archive, member = split_member_source(source)
+    if is_remote(archive):
+        return open_remote_member(filetype, archive, member)
+    if filetype == 'zip':
+        # The member keeps its own handle on the archive once it is open
+        with zipfile.ZipFile(archive) as zip_file:
+            return zip_file.open(member, 'r')
+    if filetype == 'gz':
+        # gzip archives can only contain a single file
+        return gzip.open(archive, 'rb')
+    tar_file = tarfile.open(archive, 'r')
+    try:
+        member_file = tar_file.extractfile(member)
+        if member_file is None:
+            raise IOError("{} is not a file in {}".format(member, archive))
+    except Exception:
+        tar_file.close()
+        raise
+    # Closing the member closes the archive
+    return io.BufferedReader(StreamReader(member_file, tar_file))
+
+
+def open_member_text(source, encoding=None, newline=None):
+    """Open a member of an archive for reading text."""
+    return io.TextIOWrapper(open_member(source), encoding=encoding, newline=newline)
+
+
+def copy_member(member_file, path):
+    """Copy an open member to a file in blocks and return its MD5 hash."""
+    digest = md5()
+    with open(path, 'wb') as out_file:
+        for block in iter(lambda: member_file.read(BLOCK_SIZE), b''):
+            out_file.write(block)
+            digest.update(block)
+    member_file.close()
+    return digest.hexdigest()
+
+
+class ArchiveSession(object):
+    """An archive opened once to extract several members.
+
+    With `verify`, the CRCs of a zip archive are checked once when it is
+    opened. Zip members are extracted by up to `workers` threads at once, as
+    decompression runs without the GIL. Tar archives are extracted in a
+    single pass over the archive and gzip archives hold a single member.
+    """
+
+    def __init__(self, archive, filetype='zip', verify=False, workers=4):
+        self.archive = archive
+        self.filetype = filetype
+        self.workers = max(1, workers)
+        self.zip_file = None
+        self.damaged = False
+        if filetype == 'zip':
+            self.zip_file = zipfile.ZipFile(archive)
+            if verify and self.zip_file.testzip():
+                self.damaged = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Close the archive."""
+        if self.zip_file is not None:
+            self.zip_file.close()
+            self.zip_file = None
+
+    def extract(self, members, paths):
+        """Extract members to paths and return the MD5 hash of each file."""
+        if self.filetype == 'zip':
+            return self.extract_zip(members, paths)
+        if self.filetype == 'gz':
+            # gzip archives can only contain a single file
+            return [copy_member(gzip.open(self.archive, 'rb'), path) for path in paths]
+        if self.filetype == 'tar':
+            return self.extract_tar(members, paths)
+        raise ValueError("Unknown archive type: {}".format(self.filetype))
+
+    def open_zip_member(self, member):
+        """Open a member of the zip archive."""
+        if self.damaged:
+            # This fixes an issue with the zip files that was causing errors on
+            # Python 3. testzip() returns the names of any files with issues so if
+            # it exists there is a problem. For details of the issue and the fix see:
+            # see """https://stackoverflow.com/questions/41492984/
+            # zipfile-testzip-returning-different-results-on-python-2-and-python-3"""
+            self.zip_file.getinfo(member).file_size += (2 ** 64) - 1
+        return self.zip_file.open(member, 'r')
+
+    def extract_zip(self, members, paths):
+        """Extract zip members, several at a time."""
+        digests = [None] * len(members)
+        errors = []
+        tasks = queue.Queue()
+        for task in enumerate(zip(members, paths)):
+            tasks.put(task)
+
+        def work():
+            while not errors:
+                try:
+                    i, (member, path) = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    digests[i] = copy_member(self.open_zip_member(member), path)
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=work)
+                   for _ in range(min(self.workers, len(members)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return digests
+
+    def extract_tar(self, members, paths):
+        """Extract tar members in a single pass over the archive."""
+        wanted = dict(zip(members, paths))
+        digests = {}
+        tar_file = tarfile.open(self.archive, 'r|*')
+        try:
+            for info in tar_file:
+                if info.name in wanted and info.isfile():
+                    digests[info.name] = copy_member(tar_file.extractfile(info),
+                                                     wanted[info.name])
+                    if len(digests) == len(wanted):
+                        break
+        finally:
+            tar_file.close()
+        missing = [member for member in members if member not in digests]
+        if missing:
+            raise KeyError("{} not found in {}".format(', '.join(missing), self.archive))
+        return [digests[member] for member in members]
@@ -0,0 +1,139 @@
+"""Data Retriever Batch Sizing
+
+This module contains the sizing of the batches of rows that are converted
+and inserted together when loading a table row by row, and of the
+transactions they are committed in, and of the multi-row statements a
+batch is sent in.
+
+"""
+from __future__ import division
+
+import time
+from builtins import object, str
+
+
+class BatchSizer(object):
+    """Number of rows to insert per batch.
+
+    A fixed number of rows (`rows`) or bytes (`batch_bytes`) per batch can be
+    given. Otherwise the size is tuned while loading: it keeps doubling (or
+    halving) while that raises the measured rows per second and turns around
+    when throughput drops by more than `tolerance`. The size always stays
+    between `min_rows` and `max_rows` and below the number of rows that fit
+    in `max_bytes` at the measured bytes per row.
+    """
+
+    def __init__(self, initial, rows=None, batch_bytes=None, min_rows=100,
+                 max_rows=100000, max_bytes=16 * 1024 * 1024, tolerance=0.1):
+        self.rows = rows
+        self.batch_bytes = batch_bytes
+        self.min_rows = min(min_rows, initial)
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.tolerance = tolerance
+        self.size = rows or initial
+        self.row_bytes = None
+        self.throughput = None
+        self.growing = True
+
+    def limit(self):
+        """Return the largest batch allowed by the memory bounds."""
+        if self.row_bytes:
+            return max(1, min(self.max_rows, int(self.max_bytes / self.row_bytes)))
+        return self.max_rows
+
+    def record(self, rows, nbytes, seconds):
+        """Update the size after a batch of `rows` rows and `nbytes` bytes
+        took `seconds` seconds to convert and insert."""
+        if not rows:
+            return
+        if nbytes > 0:
+            self.row_bytes = nbytes / rows
+        if self.rows:
+            return
+        if self.batch_bytes:
+            if self.row_bytes:
+                self.size = max(1, min(self.limit(), int(self.batch_bytes / self.row_bytes)))
+            return
+        if rows < self.size:
+            # A partial batch says nothing about the current size
+            return
+
+        throughput = rows / max(seconds, 1e-6)
+        if (self.throughput is not None and
+                throughput < self.throughput * (1 - self.tolerance)):
+            self.growing = not self.growing
+        self.throughput = throughput
+        size = self.size * 2 if self.growing else self.size // 2
+        self.size = max(self.min_rows, min(self.limit(), size))
+
+
+class CommitPolicy(object):
+    """When to commit the rows inserted into a table.
+
+    A commit is due once `rows` rows, `nbytes` bytes or `seconds` seconds
+    have been inserted since the last one, whichever comes first. The time
+    each commit takes is kept in `latencies`.
+    """
+
+    def __init__(self, rows=None, nbytes=None, seconds=None):
+        self.rows = rows
+        self.nbytes = nbytes
+        self.seconds = seconds
+        self.latencies = []
+        self.pending_rows = 0
+        self.pending_bytes = 0
+        self.started = time.time()
+
+    def limited(self):
+        """Check if any limit is set."""
+        return bool(self.rows or self.nbytes or self.seconds)
+
+    def add(self, rows, nbytes):
+        """Count rows inserted since the last commit."""
+        self.pending_rows += rows
+        self.pending_bytes += nbytes
+
+    def due(self):
+        """Check if the rows inserted so far should be committed."""
+        return bool((self.rows and self.pending_rows >= self.rows) or
+                    (self.nbytes and self.pending_bytes >= self.nbytes) or
+                    (self.seconds and time.time() - self.started >= self.seconds))
+
+    def commit(self, connection):
+        """Commit a connection and record how long it took."""
+        start = time.time()
+        connection.commit()
+        self.latencies.append(time.time() - start)
+        self.pending_rows = 0
+        self.pending_bytes = 0
+        self.started = time.time()
+
+    def summary(self):
+        """Return a description of the commit latencies."""
+        if not self.latencies:
+            return "no commits"
+        return "{} commits, {:.3f}s mean and {:.3f}s max latency".format(
+            len(self.latencies), sum(self.latencies) / len(self.latencies),
+            max(self.latencies))
+
+
+def statement_pages(rows, max_bytes):
+    """Split a batch into pages of rows fitting in statements of about `max_bytes`.
+
+    The size of a row is estimated from the text of its values, plus the
+    quotes and separators around each one. A row larger than `max_bytes`
+    gets a page of its own.
+    """
+    page = []
+    size = 0
+    for row in rows:
+        row_bytes = sum(len(str(value)) + 3 for value in row)
+        if page and size + row_bytes > max_bytes:
+            yield page
+            page = []
+            size = 0
+        page.append(row)
+        size += row_bytes
+    if page:
+        yield page
@@ -0,0 +1,202 @@
+"""Data Retriever Blob Store
+
+This module contains the content addressed store of raw data files. Files
+downloaded or extracted by the Retriever are moved into
+HOME_DIR/raw_data/.blobs under their MD5 hash and linked back into the
+dataset directories with hard links, or symbolic links where hard links
+are not supported, so identical files used by several datasets are only
+stored once. Each blob has a JSON record of its size, the paths linked to
+it, when it was last used and whether it is pinned. Blobs are evicted
+least recently used first to keep the store below a size limit, pinned
+blobs excepted. `retriever cache` lists, prunes and pins blobs.
+
+"""
+import json
+import os
+import threading
+import time
+
+from retriever.lib.cache_manifest import load_entry, manifest_path
+from retriever.lib.defaults import HOME_DIR
+from retriever.lib.tools import write_json
+
+BLOB_DIR = os.path.join(HOME_DIR, 'raw_data', '.blobs')
+
+# Background downloads may add the same blob from several threads
+lock = threading.RLock()
+
+
+def blob_path(digest):
+    """Return the path of the blob holding content with a given hash."""
+    return os.path.join(BLOB_DIR, digest[:2], digest)
+
+
+def info_path(digest):
+    """Return the path of the record of a blob."""
+    return blob_path(digest) + '.json'
+
+
+def load_info(digest):
+    """Return the record of a blob, or None."""
+    try:
+        with open(info_path(digest)) as info_file:
+            return json.load(info_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def same_file(path, other):
+    """Check if two paths are links to the same file."""
+    try:
+        return os.path.samefile(path, other)
+    except (AttributeError, OSError):
+        return False
+
+
+def link_file(source, link_name):
+    """Link a file to a new name, returning False if links are not supported."""
+    for link in ('link', 'symlink'):
+        try:
+            getattr(os, link)(source, link_name)
+            return True
+        except (AttributeError, NotImplementedError, OSError):
+            pass
+    return False
+
+
+def add_blob(file_path, digest):
+    """Store a raw data file in the blob store and link it back in place.
+
+    If the store already holds the same content, the file is replaced by a
+    link to it. Returns False if the file could not be linked, in which case
+    it is left untouched.
+    """
+    file_path = os.path.abspath(file_path)
+    blob = blob_path(digest)
+    with lock:
+        if os.path.exists(blob):
+            if not same_file(blob, file_path):
+                temp_name = file_path + '.link'
+                if not link_file(blob, temp_name):
+                    return False
+                os.remove(file_path)
+                os.rename(temp_name, file_path)
+        else:
+            if not os.path.exists(os.path.dirname(blob)):
+                os.makedirs(os.path.dirname(blob))
+            try:
+                os.rename(file_path, blob)
+            except OSError:
+                return False
+            if not link_file(blob, file_path):
+                os.rename(blob, file_path)
+                return False
+        info = load_info(digest) or {'size': os.path.getsize(blob), 'paths': [], 'pinned': False}
+        if file_path not in info['paths']:
+            info['paths'].append(file_path)
+        info['last_used'] = time.time()
+        write_json(info_path(digest), info)
+    return True
+
+
+def touch_file(file_path):
+    """Record that a cached raw data file was used."""
+    entry = load_entry(file_path)
+    if entry and entry.get('md5'):
+        with lock:
+            info = load_info(entry['md5'])
+            if info is not None:
+                info['last_used'] = time.time()
+                write_json(info_path(entry['md5']), info)
+
+
+def list_blobs():
+    """Return the hash and record of every blob, least recently used first."""
+    blobs = []
+    if os.path.isdir(BLOB_DIR):
+        for prefix in os.listdir(BLOB_DIR):
+            for name in os.listdir(os.path.join(BLOB_DIR, prefix)):
+                if name.endswith('.json'):
+                    digest = name[:-len('.json')]
+                    info = load_info(digest)
+                    if info is not None:
+                        blobs.append((digest, info))
+    return sorted(blobs, key=lambda blob: blob[1].get('last_used', 0))
+
+
+def linked_paths(digest, info):
+    """Return the paths that are still links to a blob."""
+    blob = blob_path(digest)
+    return [path for path in info['paths'] if same_file(path, blob)]
+
+
+def remove_blob(digest):
+    """Remove a blob and the raw data files linked to it."""
+    with lock:
+        info = load_info(digest) or {'paths': []}
+        for path in linked_paths(digest, info):
+            os.remove(path)
+            try:
+                os.remove(manifest_path(path))
+            except OSError:
+                pass
+        for path in (blob_path(digest), info_path(digest)):
+            if os.path.exists(path):
+                os.remove(path)
+        try:
+            os.rmdir(os.path.dirname(blob_path(digest)))
+        except OSError:
+            pass
+
+
+def pin_blob(digest, pinned=True):
+    """Keep a blob from being evicted, or allow it again."""
+    with lock:
+        info = load_info(digest)
+        if info is not None:
+            info['pinned'] = pinned
+            write_json(info_path(digest), info)
+
+
+def find_blobs(reference):
+    """Return the hashes of the blobs matching a file path or hash prefix."""
+    if os.path.exists(reference):
+        entry = load_entry(reference)
+        return [entry['md5']] if entry and load_info(entry['md5']) else []
+    return [digest for digest, info in list_blobs() if digest.startswith(reference)]
+
+
+def prune_blobs(max_bytes=None):
+    """Evict blobs and return the hashes of the evicted blobs.
+
+    Blobs no longer linked from any dataset are always removed. If
+    `max_bytes` is given, unpinned blobs are then evicted least recently
+    used first until the store is no larger than `max_bytes`.
+    """
+    removed = []
+    blobs = []
+    for digest, info in list_blobs():
+        if not info.get('pinned') and not linked_paths(digest, info):
+            remove_blob(digest)
+            removed.append(digest)
+        else:
+            blobs.append((digest, info))
+    if max_bytes is not None:
+        total = sum(info['size'] for digest, info in blobs)
+        for digest, info in blobs:
+            if total <= max_bytes:
+                break
+            if not info.get('pinned'):
+                remove_blob(digest)
+                removed.append(digest)
+                total -= info['size']
+    return removed
+
+
+def parse_size(size):
+    """Return the number of bytes in a size such as 500m or 20g."""
+    size = size.strip().lower().rstrip('b')
+    units = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
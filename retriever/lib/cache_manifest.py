@@ -0,0 +1,94 @@
+"""Data Retriever Cache Manifest
+
+This module contains the manifest of the raw data files downloaded by the
+Retriever. Each downloaded file gets a JSON entry under
+HOME_DIR/raw_data/.manifest recording the url it was downloaded from, the
+ETag and Last-Modified headers sent by the server, its size, its MD5 hash
+and the declared checksum it matched, if any. With `--revalidate`, cached
+files are checked with conditional requests built from these entries and
+only downloaded again when the upstream file changed.
+
+"""
+import json
+import os
+import threading
+from email.utils import formatdate
+from hashlib import sha1
+
+from retriever.lib.defaults import HOME_DIR
+from retriever.lib.tools import file_digest, write_json
+
+MANIFEST_DIR = os.path.join(HOME_DIR, 'raw_data', '.manifest')
+
+# Background downloads record their files from several threads
+lock = threading.RLock()
+
+
+def manifest_path(file_path):
+    """Return the path of the manifest entry of a raw data file."""
+    key = os.path.abspath(file_path)
+    return os.path.join(MANIFEST_DIR, sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+
+def load_entry(file_path):
+    """Return the manifest entry of a raw data file, or None."""
+    try:
+        with lock, open(manifest_path(file_path)) as entry_file:
+            return json.load(entry_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def save_entry(file_path, url, headers, digest=None, verified=None):
+    """Record where a raw data file was downloaded from and return the entry.
+
+    `headers` are the response headers of the download. The MD5 hash of
+    the file is computed unless given as `digest`. `verified` is the
+    declared checksum the file matched.
+    """
+    entry = {
+        'url': url,
+        'etag': headers.get('ETag'),
+        'last_modified': headers.get('Last-Modified'),
+        'size': os.path.getsize(file_path),
+        'mtime': os.path.getmtime(file_path),
+        'md5': digest or file_digest(file_path),
+        'verified': verified,
+    }
+    with lock:
+        write_json(manifest_path(file_path), entry)
+    return entry
+
+
+def mark_verified(file_path, url, digest, verified):
+    """Record that a cached raw data file matched its declared checksum."""
+    with lock:
+        entry = load_entry(file_path) or {'url': url, 'etag': None, 'last_modified': None}
+        entry.update({
+            'size': os.path.getsize(file_path),
+            'mtime': os.path.getmtime(file_path),
+            'md5': digest,
+            'verified': verified,
+        })
+        write_json(manifest_path(file_path), entry)
+    return entry
+
+
+def conditional_headers(url, file_path):
+    """Return the request headers asking for a file only if it changed.
+
+    The validators of the manifest entry are used when the entry matches
+    the url and the cached file. Otherwise the modification time of the
+    cached file stands for the time it was downloaded.
+    """
+    entry = load_entry(file_path)
+    if (entry and entry.get('url') == url and
+            entry.get('size') == os.path.getsize(file_path)):
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        if headers:
+            return headers
+    return {'If-Modified-Since': formatdate(os.path.getmtime(file_path), usegmt=True)}
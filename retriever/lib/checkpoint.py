@@ -0,0 +1,74 @@
+"""Data Retriever Checkpoints
+
+This module contains the checkpoints written while data files are loaded
+into a table. A checkpoint is a JSON file under HOME_DIR per table,
+recording the data files completely loaded, in order, and for the file
+being loaded the byte offset of the first record not yet committed and the
+record_id reached, so that an interrupted load can be resumed with
+`--resume` instead of reloading the table from the first row.
+
+"""
+import json
+import os
+from hashlib import sha1
+
+from retriever.lib.defaults import HOME_DIR
+from retriever.lib.tools import write_json
+
+CHECKPOINT_DIR = os.path.join(HOME_DIR, 'checkpoints')
+
+
+def checkpoint_path(key):
+    """Return the path of the checkpoint for a key describing a table."""
+    key = json.dumps(key, sort_keys=True, default=str)
+    return os.path.join(CHECKPOINT_DIR, sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+
+def source_fingerprint(filename):
+    """Return what identifies the content of a data file."""
+    stat = os.stat(filename)
+    return {'source': os.path.abspath(filename),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime}
+
+
+def same_source(fingerprint, other):
+    """Check if two fingerprints identify the same data file content."""
+    return all(other.get(key) == value for key, value in fingerprint.items())
+
+
+def new_checkpoint(columns):
+    """Return the checkpoint of a table with no data committed yet."""
+    return {'columns': columns,
+            'loaded': [],
+            'file': None,
+            'offset': None,
+            'record_id': 0}
+
+
+def load_checkpoint(key, columns):
+    """Return the checkpoint of a table, or None.
+
+    Checkpoints written for a different table definition are ignored.
+    """
+    try:
+        with open(checkpoint_path(key)) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except (IOError, OSError, ValueError):
+        return None
+    if checkpoint.get('columns') != json.loads(json.dumps(columns)):
+        return None
+    return checkpoint
+
+
+def save_checkpoint(key, checkpoint):
+    """Write the checkpoint of a table."""
+    write_json(checkpoint_path(key), checkpoint)
+
+
+def remove_checkpoint(key):
+    """Remove the checkpoint of a table once it is completely loaded."""
+    try:
+        os.remove(checkpoint_path(key))
+    except OSError:
+        pass
@@ -0,0 +1,110 @@
+"""Data Retriever Checksums
+
+This module contains the verification of downloaded raw data files against
+the checksums declared by scripts. JSON scripts declare them with the
+frictionless `hash` and `bytes` fields of a resource, and Python scripts by
+wrapping the values of `Script.urls` in `Url`. A hash is written
+`<algorithm>:<hex digest>`, or as a bare MD5 hex digest, and applies to the
+file downloaded from the url, i.e. the archive for archived resources.
+
+"""
+from builtins import str
+import hashlib
+import os
+
+BLOCK_SIZE = 1024 * 1024
+
+
+class ChecksumError(IOError):
+    """A downloaded file does not match its declared checksum."""
+
+
+def parse_hash(value):
+    """Return the algorithm and hex digest of a declared hash."""
+    algorithm, separator, digest = value.strip().rpartition(':')
+    algorithm = algorithm.lower() if separator else 'md5'
+    if algorithm not in hashlib.algorithms_available:
+        raise ValueError("Unknown hash algorithm: {}".format(algorithm))
+    return algorithm, digest.lower()
+
+
+class Url(str):
+    """The url of a raw data file, with its declared hash and size.
+
+    Behaves as the url string everywhere, e.g.
+    `self.urls = {"data": Url("https://example.org/data.zip", hash="sha256:...")}`
+    """
+
+    def __new__(cls, url, hash=None, bytes=None):
+        url_obj = str.__new__(cls, url)
+        url_obj.hash = hash
+        url_obj.bytes = bytes
+        return url_obj
+
+
+class Checksum(object):
+    """Hashes of a file computed as it is written.
+
+    The MD5 hash recorded in the cache manifest is always computed, along
+    with the algorithm of the declared `expected_hash`, if any.
+    `expected_size` is the declared size in bytes.
+    """
+
+    def __init__(self, expected_hash=None, expected_size=None):
+        self.expected_hash = expected_hash
+        self.expected_size = None if expected_size is None else int(expected_size)
+        self.algorithm = None
+        self.expected_digest = None
+        if expected_hash:
+            self.algorithm, self.expected_digest = parse_hash(expected_hash)
+        self.reset()
+
+    def declared(self):
+        """Check if a hash or size was declared for the file."""
+        return bool(self.expected_hash) or self.expected_size is not None
+
+    def reset(self):
+        """Forget the data hashed so far."""
+        self.size = 0
+        self.hashes = {'md5': hashlib.md5()}
+        if self.algorithm and self.algorithm not in self.hashes:
+            self.hashes[self.algorithm] = hashlib.new(self.algorithm)
+
+    def update(self, block):
+        """Hash a block of data."""
+        self.size += len(block)
+        for file_hash in self.hashes.values():
+            file_hash.update(block)
+
+    def update_file(self, path):
+        """Hash the content of a file."""
+        with open(path, 'rb') as data_file:
+            for block in iter(lambda: data_file.read(BLOCK_SIZE), b''):
+                self.update(block)
+
+    def sync(self, path):
+        """Hash a partial file again unless all of it was hashed already.
+
+        A download resumed in the same run has hashed every byte of its
+        partial file; one left by an earlier run has to be read once.
+        """
+        if self.size != os.path.getsize(path):
+            self.reset()
+            self.update_file(path)
+
+    def hexdigest(self, algorithm='md5'):
+        """Return the hex digest of the data hashed so far."""
+        return self.hashes[algorithm].hexdigest()
+
+    def verify(self, name=''):
+        """Raise ChecksumError if the data hashed does not match the declaration."""
+        if self.expected_size is not None and self.size != self.expected_size:
+            raise ChecksumError("{} has {} bytes, expected {}".format(
+                name, self.size, self.expected_size))
+        if self.expected_digest and self.hexdigest(self.algorithm) != self.expected_digest:
+            raise ChecksumError("{} has {} hash {}, expected {}".format(
+                name, self.algorithm, self.hexdigest(self.algorithm), self.expected_digest))
+
+    def declaration(self):
+        """Return the declared checksum, as recorded for a verified file."""
+        return [self.algorithm, self.expected_digest, self.expected_size]
@@ -0,0 +1,150 @@
+"""Data Retriever Converters
+
+This module contains the functions used to turn raw values into typed insert
+values. Column converters work on a whole column of a batch at once and only
+fall back to checking values one by one when the column is not clean.
+
+"""
+from builtins import str
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MISSING_VALUES = ("null", "none")
+
+
+def clean_value(value):
+    """Return a value as a stripped string without enclosing quotes."""
+    strvalue = str(value).strip()
+    if len(strvalue) > 1 and strvalue[0] == strvalue[-1] and strvalue[0] in ("'", '"'):
+        strvalue = strvalue[1:-1]
+    return strvalue
+
+
+def to_int(value):
+    """Convert a value to an integer, truncating any decimal part."""
+    if value is None:
+        return None
+    strvalue = clean_value(value)
+    if not strvalue or strvalue.lower() in MISSING_VALUES:
+        return None
+    intvalue = strvalue.split('.')[0]
+    if intvalue:
+        return int(intvalue)
+    return None
+
+
+def to_float(value):
+    """Convert a value to a float, returning None if it is not a number."""
+    if value is None:
+        return None
+    strvalue = clean_value(value)
+    if strvalue.lower() in MISSING_VALUES or not strvalue.strip():
+        return None
+    try:
+        return float(strvalue)
+    except:
+        return None
+
+
+def to_char(value):
+    """Convert a value to a string."""
+    strvalue = clean_value(value)
+    if strvalue.lower() in MISSING_VALUES:
+        return None
+    return strvalue
+
+
+def to_none(value):
+    """Values of unknown data types are not inserted."""
+    return None
+
+
+SCALAR_CONVERTERS = {
+    "int": to_int,
+    "bigint": to_int,
+    "bool": to_int,
+    "double": to_float,
+    "decimal": to_float,
+    "char": to_char,
+}
+
+
+def format_value(value, datatype):
+    """Format a single value for an insert statement based on data type."""
+    return SCALAR_CONVERTERS.get(datatype.split('-')[-1], to_none)(value)
+
+
+def convert_cells(convert, values, errors):
+    """Convert values one at a time, recording the rows that fail."""
+    converted = []
+    for index, value in enumerate(values):
+        try:
+            converted.append(convert(value))
+        except Exception as e:
+            errors[index] = e
+            converted.append(None)
+    return converted
+
+
+def integer_column(values):
+    """Convert a clean column of integers in a single call."""
+    if numpy is not None:
+        return numpy.fromiter(values, dtype=numpy.int64, count=len(values)).tolist()
+    return list(map(int, values))
+
+
+def float_column(values):
+    """Convert a clean column of floats in a single call."""
+    return list(map(float, values))
+
+
+def column_converter(datatype):
+    """Return a function converting a column of raw values of a data type.
+
+    The returned function takes a sequence of values and a dictionary. It
+    returns the converted values and adds the index of every value that could
+    not be converted to the dictionary, mapped to the exception raised.
+
+    Columns are first converted in bulk with `int`/`float` (through NumPy
+    for integers when it is installed). Only if that fails, because of
+    missing values, quotes or decimals in integer columns, are the values
+    converted one by one with the same rules as `format_value`.
+    """
+    datatype = datatype.split('-')[-1]
+    convert = SCALAR_CONVERTERS.get(datatype, to_none)
+    if datatype in ("int", "bigint"):
+        bulk = integer_column
+    elif datatype in ("double", "decimal"):
+        bulk = float_column
+    else:
+        bulk = None
+
+    def convert_column(values, errors):
+        if bulk is not None:
+            try:
+                return bulk(values)
+            except (TypeError, ValueError, OverflowError):
+                pass
+        try:
+            return [convert(value) for value in values]
+        except Exception:
+            return convert_cells(convert, values, errors)
+
+    return convert_column
+
+
+def cell_converter(format_insert_value, datatype):
+    """Return a column converter that calls an engine's formatter per value.
+
+    Used by engines that format some data types differently from the
+    generic converters.
+    """
+
+    def convert_column(values, errors):
+        return convert_cells(lambda value: format_insert_value(value, datatype),
+                             values, errors)
+
+    return convert_column
@@ -0,0 +1,514 @@
+"""Data Retriever Download Manager
+
+This module contains the pool of threads that download the raw data files
+of a script in the background. Scripts submit all the files they are going
+to need up front through `Engine.download_files` and only block when a file
+is actually used, so many small archives are fetched over several
+connections at once instead of one after another. The number of downloads
+running against a single host is bounded so that data providers are not
+flooded with connections.
+
+Every file is downloaded by `fetch_url` into a `.part` file next to its
+final path. After a failure the download is resumed from the end of the
+`.part` file, with an HTTP Range request or an FTP REST command, and the
+file is only renamed into place once its size matches the size announced
+by the server. Conditional request headers can be passed to only download
+a file that changed since it was cached. A Checksum passed to `fetch_url`
+hashes the file as it is written and a file not matching its declared
+checksum is downloaded again.
+
+Connections are kept open in a ConnectionPool between downloads: HTTP(S)
+connections are kept alive and FTP sessions stay logged in, so fetching
+many small files from one host does not pay for a TCP, TLS or FTP login
+handshake per file.
+
+"""
+from __future__ import print_function
+
+from future import standard_library
+
+standard_library.install_aliases()
+from builtins import object
+import ftplib
+import os
+import re
+import socket
+import sys
+import threading
+import time
+from collections import deque
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from urllib.error import HTTPError, URLError
+from urllib.parse import unquote, urljoin, urlparse
+from urllib.request import Request, getproxies, urlopen
+
+from retriever.lib.checksums import ChecksumError
+
+BLOCK_SIZE = 8192
+TIMEOUT = 60
+MAX_REDIRECTS = 10
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+USER_AGENT = "Python-urllib/{}.{}".format(*sys.version_info[:2])
+
+
+def fetch_url(url, path, reporthook=None, retries=5, backoff=1, headers=None,
+              checksum=None, pool=None):
+    """Download a url to a path, resuming and retrying after failures.
+
+    Up to `retries` failed attempts are retried, waiting `backoff` seconds
+    before the first and twice as long before each following one. `headers`
+    are added to HTTP requests. The file is hashed by `checksum` as it is
+    written, and downloaded again if it does not match. Connections are
+    reused from `pool` when one is given. Returns the response headers, or
+    None if the server answered that the file was not modified.
+    """
+    part_path = path + ".part"
+    scheme = urlparse(url).scheme
+    if scheme == "file":
+        # Local files do not drop connections
+        retries = 0
+    delay = backoff
+    attempt = 0
+    while True:
+        try:
+            if scheme == "ftp":
+                total, response_headers = fetch_ftp(url, part_path, reporthook, checksum,
+                                                    pool)
+            else:
+                total, response_headers = fetch_http(url, part_path, reporthook, headers,
+                                                     checksum, pool)
+            if response_headers is None:
+                return None
+            size = os.path.getsize(part_path)
+            if total is not None and size != total:
+                if size > total:
+                    os.remove(part_path)
+                raise IOError("received {} of {} bytes".format(size, total))
+            if checksum is not None:
+                checksum.sync(part_path)
+                try:
+                    checksum.verify(os.path.basename(path))
+                except ChecksumError:
+                    os.remove(part_path)
+                    raise
+            break
+        except (IOError, OSError, EOFError, socket.error, ftplib.Error, HTTPException) as e:
+            attempt += 1
+            if attempt > retries or not retryable(e):
+                raise
+            print("\nDownload of {} failed ({}), retrying in {} seconds...".format(url, e, delay))
+            time.sleep(delay)
+            delay *= 2
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(part_path, path)
+    return response_headers
+
+
+def fetch_http(url, part_path, reporthook=None, headers=None, checksum=None, pool=None):
+    """Download or resume a url into a partial file.
+
+    Returns the size of the complete file, or None if it is not known, and
+    the response headers, or None if the file was not modified.
+    """
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    request_headers = {}
+    if offset:
+        request_headers["Range"] = "bytes={}-".format(offset)
+    elif headers:
+        request_headers.update(headers)
+    try:
+        response, release = open_http(url, request_headers, pool)
+    except HTTPError as e:
+        if e.code == 304:
+            return None, None
+        if e.code == 416:
+            # The partial file may already hold the whole file
+            total = content_range_total(e.info().get("Content-Range"))
+            if total == offset:
+                return total, e.info()
+            os.remove(part_path)
+        raise
+    complete = False
+    try:
+        total = None
+        if offset and response.getcode() == 206:
+            total = content_range_total(response.info().get("Content-Range"))
+            mode = "ab"
+            if checksum is not None:
+                checksum.sync(part_path)
+        else:
+            offset = 0
+            length = response.info().get("Content-Length")
+            if length is not None:
+                total = int(length)
+            mode = "wb"
+            if checksum is not None:
+                checksum.reset()
+        with open(part_path, mode) as part_file:
+            copy_blocks(response.read, part_file, offset, total, reporthook, checksum)
+        complete = True
+    finally:
+        release(complete)
+    return total, response.info()
+
+
+def open_http(url, headers, pool=None):
+    """Send a GET request for a url and return the response and its release.
+
+    Redirects are followed. Call `release(complete)` once done with the
+    response: the connection goes back to `pool` if the response was read
+    to the end. Requests go through urllib when there is no pool or a
+    proxy is configured. Error responses raise HTTPError.
+    """
+    scheme = urlparse(url).scheme
+    if pool is None or scheme not in ("http", "https") or getproxies().get(scheme):
+        response = urlopen(Request(url, headers=headers), timeout=TIMEOUT)
+        return response, lambda complete: response.close()
+    for _ in range(MAX_REDIRECTS + 1):
+        key, connection, response = pool.request(url, headers)
+        release = pool.releaser(key, connection, response)
+        if response.status in REDIRECT_CODES and response.getheader("Location"):
+            response.read()
+            release(True)
+            url = urljoin(url, response.getheader("Location"))
+            continue
+        if response.status >= 300:
+            response.read()
+            release(True)
+            raise HTTPError(url, response.status, response.reason, response.msg, None)
+        return response, release
+    raise HTTPError(url, response.status, "Too many redirects", response.msg, None)
+
+
+def fetch_ftp(url, part_path, reporthook=None, checksum=None, pool=None):
+    """Download or resume an FTP url into a partial file.
+
+    Returns the size of the complete file, or None if it is not known, and
+    an empty dictionary as FTP has no response headers.
+    """
+    parsed = urlparse(url)
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    key = ("ftp", parsed.hostname, parsed.port or 21, parsed.username)
+    ftp = pool.get(key) if pool is not None else None
+    if ftp is None:
+        ftp = open_ftp(parsed)
+    complete = False
+    try:
+        file_path = unquote(parsed.path)
+        try:
+            total = ftp.size(file_path)
+        except ftplib.error_perm:
+            total = None
+        if offset and total is not None and offset >= total:
+            complete = True
+            return total, {}
+        if checksum is not None:
+            if offset:
+                checksum.sync(part_path)
+            else:
+                checksum.reset()
+        with open(part_path, "ab" if offset else "wb") as part_file:
+            progress = [offset]
+
+            def write(block):
+                part_file.write(block)
+                if checksum is not None:
+                    checksum.update(block)
+                progress[0] += len(block)
+                if reporthook:
+                    reporthook(progress[0] // BLOCK_SIZE, BLOCK_SIZE, total or -1)
+
+            if reporthook:
+                reporthook(0, BLOCK_SIZE, total or -1)
+            ftp.retrbinary("RETR " + file_path, write, BLOCK_SIZE, rest=offset or None)
+        complete = True
+    finally:
+        if complete and pool is not None:
+            pool.put(key, ftp)
+        else:
+            ftp.close()
+    return total, {}
+
+
+def open_ftp(parsed):
+    """Connect and log in to the FTP server of a parsed url."""
+    ftp = ftplib.FTP(timeout=TIMEOUT)
+    try:
+        ftp.connect(parsed.hostname, parsed.port or 21)
+        ftp.login(unquote(parsed.username or "anonymous"), unquote(parsed.password or ""))
+        ftp.voidcmd("TYPE I")
+    except Exception:
+        ftp.close()
+        raise
+    return ftp
+
+
+def content_range_total(content_range):
+    """Return the complete size from a Content-Range header, or None."""
+    match = re.search(r"/(\d+)\s*$", content_range or "")
+    return int(match.group(1)) if match else None
+
+
+def retryable(error):
+    """Check if a failed download may succeed when tried again."""
+    if isinstance(error, HTTPError):
+        return error.code >= 500 or error.code in (408, 416, 429)
+    if isinstance(error, URLError):
+        # The server could not be reached at all
+        return isinstance(error.reason, socket.timeout)
+    if isinstance(error, ftplib.error_perm):
+        return False
+    return True
+
+
+def copy_blocks(read, out_file, offset=0, total=None, reporthook=None, checksum=None):
+    """Copy blocks from a read function to a file, reporting progress.
+
+    Like urlretrieve, the report hook is first called with a count of 0,
+    also when resuming after `offset` bytes, so it can start its clock.
+    """
+    count = offset // BLOCK_SIZE
+    if reporthook:
+        reporthook(0, BLOCK_SIZE, total or -1)
+        if count:
+            reporthook(count, BLOCK_SIZE, total or -1)
+    while True:
+        block = read(BLOCK_SIZE)
+        if not block:
+            break
+        out_file.write(block)
+        if checksum is not None:
+            checksum.update(block)
+        count += 1
+        if reporthook:
+            reporthook(count, BLOCK_SIZE, total or -1)
+
+
+class ConnectionPool(object):
+    """Open connections kept for reuse, per host.
+
+    At most `per_host` idle connections are kept for each host. HTTP(S)
+    connections are kept alive by the server until it closes them, and
+    FTP sessions stay logged in, so a connection found closed when it is
+    reused is replaced by a new one.
+    """
+
+    def __init__(self, per_host=4):
+        self.per_host = max(1, per_host)
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Take an idle connection to a host, or return None."""
+        while True:
+            with self.lock:
+                connections = self.idle.get(key)
+                if not connections:
+                    return None
+                connection = connections.pop()
+            if key[0] != "ftp":
+                return connection
+            try:
+                connection.voidcmd("NOOP")
+                return connection
+            except (IOError, OSError, EOFError, ftplib.Error):
+                connection.close()
+
+    def put(self, key, connection):
+        """Keep a connection to a host for reuse."""
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.per_host:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def request(self, url, headers):
+        """Send a GET request for a url over a pooled HTTP(S) connection.
+
+        Returns the key of the host, the connection and the response. A
+        reused connection the server already closed is replaced once.
+        """
+        parsed = urlparse(url)
+        key = (parsed.scheme, parsed.hostname, parsed.port)
+        path = parsed.path or "/"
+        if parsed.query:
+            path += "?" + parsed.query
+        connection = self.get(key)
+        while True:
+            reused = connection is not None
+            if not reused:
+                connection_class = HTTPSConnection if parsed.scheme == "https" else HTTPConnection
+                connection = connection_class(parsed.hostname, parsed.port, timeout=TIMEOUT)
+                try:
+                    connection.connect()
+                except socket.error as e:
+                    # Fail like urllib when the server can not be reached
+                    connection.close()
+                    raise URLError(e)
+            try:
+                request_headers = {"User-Agent": USER_AGENT}
+                request_headers.update(headers)
+                connection.request("GET", path, headers=request_headers)
+                return key, connection, connection.getresponse()
+            except (HTTPException, socket.error):
+                connection.close()
+                if not reused:
+                    raise
+                connection = None
+
+    def releaser(self, key, connection, response):
+        """Return the function giving a connection back once its response is done."""
+
+        def release(complete):
+            if complete and not response.will_close:
+                self.put(key, connection)
+            else:
+                connection.close()
+
+        return release
+
+    def close(self):
+        """Close all the idle connections."""
+        with self.lock:
+            connections = [connection for idle in self.idle.values() for connection in idle]
+            self.idle = {}
+        for connection in connections:
+            try:
+                if isinstance(connection, ftplib.FTP):
+                    connection.quit()
+                else:
+                    connection.close()
+            except (IOError, OSError, EOFError, ftplib.Error):
+                connection.close()
+
+
+class Download(object):
+    """A file submitted to the download manager."""
+
+    def __init__(self, url, path):
+        self.url = url
+        self.path = path
+        self.host = urlparse(url).netloc
+        self.result = None
+        self.error = None
+        self.finished = threading.Event()
+
+    def done(self):
+        """Check if the download has finished, successfully or not."""
+        return self.finished.is_set()
+
+    def wait(self):
+        """Block until the file is downloaded and return what fetch returned.
+
+        Errors raised while downloading are raised again.
+        """
+        self.finished.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class DownloadManager(object):
+    """Bounded pool of threads downloading files in the background.
+
+    `fetch(url, path)` is called from up to `workers` threads at once, with
+    no more than `per_host` of them downloading from the same host.
+    Downloads start in the order they are submitted, skipping over files
+    from hosts that are already at their limit.
+    """
+
+    def __init__(self, fetch, workers=4, per_host=2):
+        self.fetch = fetch
+        self.workers = max(1, workers)
+        self.per_host = max(1, per_host)
+        self.downloads = {}
+        self.queue = deque()
+        self.active = {}
+        self.threads = []
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def submit(self, url, path):
+        """Queue a file for download and return its Download.
+
+        A file that is already queued, downloading or downloaded is not
+        submitted twice. Failed downloads are forgotten, so they can be
+        submitted again.
+        """
+        with self.condition:
+            self.closed = False
+            download = self.downloads.get(path)
+            if download is not None:
+                return download
+            download = Download(url, path)
+            self.downloads[path] = download
+            self.queue.append(download)
+            if len(self.threads) < self.workers:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+            self.condition.notify_all()
+            return download
+
+    def submitted(self, path):
+        """Check if a file was submitted for download."""
+        with self.condition:
+            return path in self.downloads
+
+    def wait(self, path):
+        """Block until a submitted file is downloaded and return its Download.
+
+        Returns None if the file was never submitted.
+        """
+        with self.condition:
+            download = self.downloads.get(path)
+        if download is not None:
+            download.wait()
+        return download
+
+    def close(self):
+        """Drop the queued downloads and wait for the running ones."""
+        with self.condition:
+            self.closed = True
+            while self.queue:
+                download = self.queue.popleft()
+                del self.downloads[download.path]
+                download.finished.set()
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def _next(self):
+        """Take the first queued download whose host is below its limit."""
+        with self.condition:
+            while True:
+                if self.closed:
+                    return None
+                for download in self.queue:
+                    if self.active.get(download.host, 0) < self.per_host:
+                        self.queue.remove(download)
+                        self.active[download.host] = self.active.get(download.host, 0) + 1
+                        return download
+                self.condition.wait()
+
+    def _work(self):
+        """Download files until the manager is closed."""
+        while True:
+            download = self._next()
+            if download is None:
+                return
+            try:
+                download.result = self.fetch(download.url, download.path)
+            except Exception as e:
+                download.error = e
+            finally:
+                with self.condition:
+                    self.active[download.host] -= 1
+                    if download.error is not None and self.downloads.get(download.path) is download:
+                        del self.downloads[download.path]
+                    self.condition.notify_all()
+                download.finished.set()
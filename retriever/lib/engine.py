@@ -12,19 +12,40 @@ from builtins import next
 from builtins import str
 import sys
 import os
+import io
 import getpass
 import zipfile
-import gzip
-import tarfile
 import csv
 import re
+import threading
 import time
-from urllib.request import urlretrieve
+from collections import deque
+from http.client import HTTPException
+from itertools import islice
 from retriever.lib.tools import open_fr, open_fw, open_csvw
-from retriever.lib.defaults import DATA_SEARCH_PATHS, DATA_WRITE_PATH
+from retriever.lib.defaults import DATA_SEARCH_PATHS, DATA_WRITE_PATH, ENCODING, VERSION
+from retriever.lib.archives import (ARCHIVE_TYPES, ArchiveSession, is_remote_source,
+                                    is_stream_source, member_source, source_path)
+from retriever.lib.batching import BatchSizer, CommitPolicy
+from retriever.lib.blob_store import add_blob, prune_blobs, touch_file
+from retriever.lib.cache_manifest import (conditional_headers, load_entry, mark_verified,
+                                          save_entry)
+from retriever.lib.checksums import Checksum, ChecksumError
+from retriever.lib.checkpoint import (load_checkpoint, new_checkpoint, remove_checkpoint,
+                                      same_source, save_checkpoint, source_fingerprint)
 from retriever.lib.cleanup import no_cleanup
+from retriever.lib.converters import column_converter, format_value
+from retriever.lib.downloader import ConnectionPool, DownloadManager, fetch_url
+from retriever.lib.inference import ColumnTypes
+from retriever.lib.load_plan import TableLoadPlan
+from retriever.lib.parallel import can_fork, map_chunks, record_chunks
+from retriever.lib.remote_zip import RangeNotSupported, RemoteZip
+from retriever.lib.schema_cache import load_schema, save_schema
 from retriever.lib.warning import Warning
 
+# Downloads running in background threads share the engine's pool
+download_lock = threading.Lock()
+
 
 class Engine(object):
     """A generic database system. Specific database platforms will inherit
@@ -41,8 +62,45 @@ class Engine(object):
     pkformat = "%s PRIMARY KEY %s "
     script = None
     use_cache = True
+    stream = False
+    revalidate = False
+    use_schema_cache = True
+    use_blob_store = True
+    extract_archives = False
+    extract_workers = 4
+    verify_archives = True
+    fetch_archive_members = True
+    cache_size = None
     debug = False
     warnings = []
+    data_file = None
+    load_plan = None
+    parallel_workers = 1
+    parallel_chunk_size = 4 * 1024 * 1024
+    infer_strategy = "sample"
+    infer_sample_size = 10000
+    batch_size = None
+    batch_bytes = None
+    max_batch_bytes = 16 * 1024 * 1024
+    max_statement_bytes = 1024 * 1024
+    load_profile = "safe"
+    bulk_connection = None
+    bulk_session_restore = []
+    bulk_table_restore = []
+    commit_rows = None
+    commit_bytes = None
+    commit_seconds = None
+    commit_policy = None
+    resume = False
+    resume_checkpoint = None
+    files_loaded = 0
+    checkpoint_keys = []
+    chunk_position = None
+    download_workers = 4
+    download_host_limit = 2
+    download_retries = 5
+    download_manager = None
+    download_pool = None
 
     def connect(self, force_reconnect=False):
         if force_reconnect:
@@ -68,100 +126,141 @@ class Engine(object):
 
     def add_to_table(self, data_source):
         """This function adds data to a table from one or more lines specified
-        in engine.table.source."""
-        if self.table.columns[-1][1][0][:3] == "ct-":
-            # cross-tab data
-            real_line_length = self.get_ct_line_length(gen_from_source(data_source))
-            real_lines = self.get_ct_data(gen_from_source(data_source))
-        else:
-            real_lines = gen_from_source(data_source)
-            len_source = gen_from_source(data_source)
-            real_line_length = sum(1 for _ in len_source)
-
-        total = self.table.record_id + real_line_length
-        count_iter = 1
-        insert_limit = self.insert_limit
-        types = self.table.get_column_datatypes()
-        multiple_values = []
-        for line in real_lines:
-            if line:
-                # Only process non empty lines
-                self.table.record_id += 1
-                linevalues = self.table.values_from_line(line)
-                # Build insert statement with the correct number of values
-                try:
-                    cleanvalues = [self.format_insert_value(self.table.cleanup.function
-                                                            (linevalues[n],
-                                                             self.table.cleanup.args),
-                                                            types[n])
-                                   for n in range(len(linevalues))]
-                except Exception as e:
-                    self.warning('Exception in line %s: %s' % (self.table.record_id, e))
-                    continue
+        in engine.table.source.
 
-            if line or count_iter == real_line_length:
-                if count_iter % insert_limit == 0 or count_iter == real_line_length:
-                    # Add values to the list multiple_values
-                    # if multiple_values list is full or we reached the last value in real_line_length
-                    # execute the values in multiple_values
-                    multiple_values.append(cleanvalues)
-                    try:
-                        insert_stmt = self.insert_statement(multiple_values)
-                    except:
-                        if self.debug:
-                            print(types)
-                        if self.debug:
-                            print(linevalues)
-                        if self.debug:
-                            print(cleanvalues)
-                        raise
-                    try:
-                        self.executemany(insert_stmt, multiple_values, commit=False)
-                        prompt = "Progress: {}/{} rows inserted into {} totaling {}:".format(
-                            count_iter, real_line_length, self.table_name(), total)
-                        sys.stdout.write(prompt + "\b" * len(prompt))
-                        sys.stdout.flush()
-                    except:
-                        print(insert_stmt)
-                        raise
-                    multiple_values = []
-                else:
-                    multiple_values.append(cleanvalues)
-            count_iter += 1
-        self.connection.commit()
+        The source is read in a single pass. Rows are inserted in batches
+        sized by `get_batch_sizer` and whatever is left is flushed once the
+        source is exhausted, so the number of rows does not need to be known
+        up front. Rows are committed as set by `get_commit_policy`, and at
+        the end.
+        """
+        # There is no data file to skip or continue
+        self.get_resume_offset()
+        sizer = self.get_batch_sizer()
+        policy = self.get_commit_policy()
+        self.rows_inserted = 0
+        self.data_file = None
+        bytes_read = None
+        for raw_rows, record_ids in self.read_batches(data_source, sizer):
+            if len(raw_rows) < sizer.size:
+                # The rows left once the source is exhausted
+                self.insert_batch(self.convert_batch(raw_rows, record_ids))
+                continue
+            start = time.time()
+            self.insert_batch(self.convert_batch(raw_rows, record_ids))
+            position = self.get_bytes_read()
+            if position is None or bytes_read is None:
+                nbytes = estimate_bytes(raw_rows)
+            else:
+                nbytes = position - bytes_read
+            bytes_read = position
+            sizer.record(len(raw_rows), nbytes, time.time() - start)
+            policy.add(len(raw_rows), nbytes)
+            if policy.due():
+                policy.commit(self.connection)
+        policy.commit(self.connection)
+        self.report_commits()
         print("\n")
 
-    def get_ct_line_length(self, lines):
-        """Returns the number of real lines for cross-tab data"""
-        real_line_length = 0
-        for values in lines:
-            initial_cols = len(self.table.columns) - \
-                           (3 if hasattr(self.table, "ct_names") else 2)
-            # add one if auto increment is not set to get the right initial columns
-            if not self.table.columns[0][1][0] == "pk-auto":
-                initial_cols += 1
-            rest = values[initial_cols:]
-            real_line_length = real_line_length + len(rest)
-
-        return real_line_length
+    def add_to_table_in_chunks(self, filename):
+        """Add the rows of a data file to the table one chunk at a time.
+
+        The file is split into chunks of whole records that are parsed,
+        cleaned and converted with `load_chunk`, by a pool of
+        `parallel_workers` processes when more than one worker is set.
+        Converted rows are inserted in file order, so record_ids and
+        auto-increment keys are assigned exactly as in a serial load.
+
+        Commits happen between chunks: after every chunk, or once the
+        limits of `get_commit_policy` are reached if any are set. Each commit
+        is followed by a checkpoint with the byte offset and record_id
+        reached, so an interrupted load can be continued by running again
+        with `resume`. Once the file is loaded it is recorded in the
+        checkpoint of the table, so it is skipped by a resumed load.
+        """
+        if not self.table.delimiter:
+            self.set_table_delimiter(filename)
+        # Compile the plan before the workers are forked so they share it
+        self.get_load_plan()
+        self.data_file = None
+        start = self.get_resume_offset(filename)
+        quotechar = None if self.table.fixed_width else '"'
+        chunks = record_chunks(filename, self.parallel_chunk_size,
+                               self.table.header_rows, quotechar, start)
+
+        # Offsets of the chunks handed out, in file order
+        bounds = deque()
+
+        def track(chunks):
+            for begin, end in chunks:
+                bounds.append((begin, end))
+                yield begin, end
+
+        if self.parallel_workers > 1 and can_fork():
+            results = map_chunks(self, filename, track(chunks),
+                                 self.parallel_workers)
+        else:
+            results = (self.load_chunk(filename, begin, end)
+                       for begin, end in track(chunks))
+
+        size = os.path.getsize(filename)
+        sizer = self.get_batch_sizer()
+        policy = self.get_commit_policy()
+        self.rows_inserted = 0
+        for count, rows, warnings in results:
+            chunk_begin, end = bounds.popleft()
+            self.chunk_position = (end, size)
+            for offset, message in warnings:
+                self.warning('Exception in line %s: %s' % (self.table.record_id + offset, message))
+            self.table.record_id += count
+            begin = 0
+            while begin < len(rows):
+                batch = rows[begin:begin + sizer.size]
+                begin += len(batch)
+                start = time.time()
+                self.insert_batch(batch)
+                sizer.record(len(batch), estimate_bytes(batch), time.time() - start)
+            policy.add(len(rows), end - chunk_begin)
+            if policy.due() or not policy.limited():
+                policy.commit(self.connection)
+                self.checkpoint_chunk(filename, end)
+        policy.commit(self.connection)
+        self.checkpoint_file(filename)
+        self.chunk_position = None
+        self.report_commits()
+        print("\n")
 
     def get_ct_data(self, lines):
         """Create cross tab data."""
-        for values in lines:
-            initial_cols = len(self.table.columns) - (3 if hasattr(self.table, "ct_names") else 2)
-            # add one if auto increment is not set to get the right initial columns
-            if not self.table.columns[0][1][0] == "pk-auto":
-                initial_cols += 1
-            begin = values[:initial_cols]
-            rest = values[initial_cols:]
-            n = 0
-            for item in rest:
-                if hasattr(self.table, "ct_names"):
-                    name = [self.table.ct_names[n]]
-                    n += 1
-                else:
-                    name = []
-                yield (begin + name + [item])
+        return self.get_load_plan().unpivot(lines)
+
+    def archive_member(self, url, filename, filetype="zip", archivename=None):
+        """Return the source of a data file located in an online archive.
+
+        A copy of the file already in the raw data directory is used as is.
+        With `stream` set, the file is read from the archive as it is
+        downloaded, unless the archive is already cached. Otherwise the
+        archive is downloaded and the file is read straight from it, unless
+        `extract_archives` is set for engines that need a real file, in
+        which case it is extracted first. Either way, a member of a zip
+        archive is fetched on its own where possible (see `fetch_members`).
+        """
+        file_path = self.find_file(filename)
+        archivename = archivename or filename_from_url(url)
+        if (self.stream and not file_path and filetype in ARCHIVE_TYPES and
+                not self.find_file(archivename)):
+            return member_source(url, filename, filetype)
+        if not file_path and filetype == "zip" and not self.extract_archives:
+            self.create_raw_data_dir()
+            if self.fetch_members(url, self.format_filename(archivename), [filename],
+                                  [self.format_filename(filename)]):
+                return self.find_file(filename)
+        if file_path or self.extract_archives or filetype not in ARCHIVE_TYPES:
+            self.download_files_from_archive(url, [filename], filetype,
+                                             archivename=archivename)
+            return self.find_file(filename)
+        self.download_file(url, archivename)
+        return member_source(self.format_filename(archivename), filename, filetype)
 
     def auto_create_table(self, table, url=None, filename=None, pk=None):
         """Create table automatically by analyzing a data source and
@@ -171,29 +270,38 @@ class Engine(object):
         self.table = table
 
         if url and not self.find_file(filename):
-            # If the file doesn't exist, download it
-            self.download_file(url, filename)
-        file_path = self.find_file(filename)
+            if self.stream:
+                # Read the file as it is downloaded
+                filename = url
+            else:
+                # If the file doesn't exist, download it
+                self.download_file(url, filename)
+        if is_stream_source(filename):
+            file_path = filename
+        else:
+            file_path = self.find_file(filename)
 
         if not self.table.delimiter:
             self.set_table_delimiter(file_path)
 
         if self.table.header_rows > 0 and not self.table.columns:
-            source = (skip_rows,
-                      (self.table.header_rows - 1, self.load_data(file_path)))
-
-            lines = gen_from_source(source)
-            header = next(lines)
-            lines.close()
-
-            source = (skip_rows,
-                      (self.table.header_rows, self.load_data(file_path)))
-
-            lines = gen_from_source(source)
-
-            columns, column_values = self.table.auto_get_columns(header)
-
-            self.auto_get_datatypes(pk, lines, columns, column_values)
+            schema_key = self.schema_cache_key(file_path, pk)
+            schema = None
+            # Streamed data has no file to check the cached schema against
+            use_schema_cache = self.use_schema_cache and not is_remote_source(file_path)
+            if use_schema_cache:
+                schema = load_schema(schema_key, source_path(file_path))
+            if schema:
+                self.table.delimiter, self.table.columns, contains_pk = schema
+                if contains_pk:
+                    self.table.contains_pk = True
+                self.table.cleaned_columns = True
+            else:
+                self.auto_get_schema(file_path, pk)
+                if use_schema_cache:
+                    save_schema(schema_key, source_path(file_path),
+                                self.table.delimiter, self.table.columns,
+                                getattr(self.table, 'contains_pk', False))
 
         if self.table.columns[-1][1][0][:3] == "ct-" \
                 and hasattr(self.table, "ct_names") \
@@ -204,54 +312,60 @@ class Engine(object):
 
         self.create_table()
 
-    def auto_get_datatypes(self, pk, source, columns, column_values):
+    def auto_get_schema(self, file_path, pk=None):
+        """Infer the columns of the current table from its data file.
+
+        Data read from the network is only sampled, from its first
+        `infer_sample_size` rows, so it is not downloaded twice.
+        """
+        source = (skip_rows,
+                  (self.table.header_rows - 1, self.load_data(file_path)))
+
+        lines = gen_from_source(source)
+        header = next(lines)
+        lines.close()
+
+        source = (skip_rows,
+                  (self.table.header_rows, self.load_data(file_path)))
+
+        lines = gen_from_source(source)
+        if is_remote_source(file_path):
+            lines = islice(lines, self.infer_sample_size)
+
+        columns, column_values = self.table.auto_get_columns(header)
+
+        self.auto_get_datatypes(pk, lines, columns, column_values, file_path)
+
+    def auto_get_datatypes(self, pk, source, columns, column_values,
+                           filename=None):
         """Determine data types for each column.
 
         For string columns adds an additional 100 characters to the maximum
         observed value to provide extra space for cases where special characters
         are counted differently by different engines.
 
+        With the "full" `infer_strategy` every value is checked on its own.
+        With "sample" the types found in the first `infer_sample_size` rows
+        are validated against the rest of the file a batch at a time, and a
+        column is only checked value by value when a batch does not fit its
+        type. Files larger than `parallel_chunk_size` are scanned by a pool
+        of `parallel_workers` processes when more than one worker is set.
         """
-        # Get all values for each column
-        lines_to_scan = source
-        # set default column data types as int
-        column_types = [('int',)] * len(columns)
-        max_lengths = [0] * len(columns)
-
-        # Check the values for each column to determine data type
-        for values in lines_to_scan:
-            if values:
-                for i in range(len(columns)):
-                    try:
-                        val = u"{}".format(values[i])
-
-                        if self.table.cleanup.function != no_cleanup:
-                            val = self.table.cleanup.function(
-                                val, self.table.cleanup.args)
-
-                        if val is not None and val.strip() is not '':
-                            if len(str(val)) + 100 > max_lengths[i]:
-                                max_lengths[i] = len(str(val)) + 100
-
-                            if column_types[i][0] in ('int', 'bigint'):
-                                try:
-                                    val = int(val)
-                                    if column_types[i][0] == 'int' and hasattr(self, 'max_int') and val > self.max_int:
-                                        column_types[i] = ['bigint', ]
-                                except:
-                                    column_types[i] = ['double', ]
-                            if column_types[i][0] == 'double':
-                                try:
-                                    val = float(val)
-                                    if "e" in str(val) or ("." in str(val) and len(str(val).split(".")[1]) > 10):
-                                        column_types[i] = ["decimal", "50,30"]
-                                except:
-                                    column_types[i] = ['char', max_lengths[i]]
-                            if column_types[i][0] == 'char':
-                                if len(str(val)) + 100 > column_types[i][1]:
-                                    column_types[i][1] = max_lengths[i]
-                    except IndexError:
-                        pass
+        column_types = ColumnTypes(len(columns), getattr(self, 'max_int', None),
+                                   self.table.cleanup)
+        if (filename and self.parallel_workers > 1 and can_fork() and
+                not is_stream_source(filename) and
+                os.path.getsize(filename) > self.parallel_chunk_size):
+            quotechar = None if self.table.fixed_width else '"'
+            chunks = record_chunks(filename, self.parallel_chunk_size,
+                                   self.table.header_rows, quotechar)
+            for chunk_types in map_chunks(self, filename, chunks,
+                                          self.parallel_workers,
+                                          'infer_chunk', (len(columns),)):
+                column_types.merge(chunk_types)
+        else:
+            self.scan_column_types(column_types, source)
+        column_types = column_types.datatypes()
 
         for i in range(len(columns)):
             column = columns[i]
@@ -279,6 +393,18 @@ class Engine(object):
             if header.count(other_delimiter) > header.count(self.table.delimiter):
                 self.table.delimiter = other_delimiter
 
+    def bulk_session_settings(self):
+        """Return (setting, restore) statement pairs tuning a session for bulk loads.
+
+        Engines override this to trade durability for loading speed with
+        the "fast" `load_profile`.
+        """
+        return []
+
+    def bulk_table_settings(self, table_name):
+        """Return (setting, restore) statement pairs tuning a table while it is loaded."""
+        return []
+
     def convert_data_type(self, datatype):
         """Convert Retriever generic data types to database platform specific
         data types.
@@ -315,6 +441,17 @@ class Engine(object):
                 thistype = self.pkformat % (thistype, "")
         return thistype
 
+    def convert_batch(self, rows, record_ids):
+        """Convert a batch of raw rows to insert values a column at a time.
+
+        Rows that fail to convert are dropped with a warning naming their
+        record_id.
+        """
+        multiple_values, errors = self.get_load_plan().convert_rows(rows)
+        for index in sorted(errors):
+            self.warning('Exception in line %s: %s' % (record_ids[index], errors[index]))
+        return multiple_values
+
     def create_db(self):
         """Create a new database based on settings supplied in Database object
         engine.db."""
@@ -348,7 +485,24 @@ class Engine(object):
 
     def create_table(self):
         """Create new database table based on settings supplied in Table
-        object engine.table."""
+        object engine.table.
+
+        With `resume` set, a table with a checkpoint from an interrupted load
+        is kept instead, and the load continues from the checkpoint."""
+        self.resume_checkpoint = None
+        self.files_loaded = 0
+        key = self.checkpoint_key()
+        if self.resume:
+            self.resume_checkpoint = load_checkpoint(key, self.table.columns)
+            if self.resume_checkpoint:
+                print("Keeping table " + self.table_name() + " to resume loading...")
+                if key not in self.checkpoint_keys:
+                    self.checkpoint_keys = self.checkpoint_keys + [key]
+                self.load_plan = TableLoadPlan(self, self.table)
+                self.start_bulk_load()
+                return
+        remove_checkpoint(key)
+
         print("Creating table " + self.table_name() + "...")
 
         # Try to drop the table if it exists; this may cause an exception if it
@@ -369,6 +523,54 @@ class Engine(object):
             except:
                 pass
             print("Couldn't create table (%s). Trying to continue anyway." % e)
+        self.load_plan = TableLoadPlan(self, self.table)
+        self.start_bulk_load()
+
+    def checkpoint_key(self):
+        """Return what identifies the current table for its checkpoint."""
+        opts = getattr(self, 'opts', {})
+        return {
+            'engine': self.name,
+            'table': self.table_name(),
+            'opts': dict((opt[0], opts.get(opt[0])) for opt in self.required_opts
+                         if opt[0] != 'password'),
+        }
+
+    def checkpoint_chunk(self, filename, offset):
+        """Record that the records of a data file before `offset` are committed."""
+        checkpoint = self.resume_checkpoint or new_checkpoint(self.table.columns)
+        checkpoint.update({'file': source_fingerprint(filename),
+                           'offset': offset,
+                           'record_id': self.table.record_id})
+        self.write_checkpoint(checkpoint)
+
+    def checkpoint_file(self, filename):
+        """Record that a data file is completely loaded into the table.
+
+        Files skipped by a resumed load are already recorded.
+        """
+        checkpoint = self.resume_checkpoint or new_checkpoint(self.table.columns)
+        if self.files_loaded == len(checkpoint['loaded']):
+            loaded = source_fingerprint(filename)
+            loaded['record_id'] = self.table.record_id
+            checkpoint['loaded'].append(loaded)
+            checkpoint.update({'file': None,
+                               'offset': None,
+                               'record_id': self.table.record_id})
+            self.write_checkpoint(checkpoint)
+        self.files_loaded += 1
+
+    def write_checkpoint(self, checkpoint):
+        """Save the checkpoint of the current table.
+
+        Checkpoints are removed by `final_cleanup` once the dataset is
+        installed.
+        """
+        key = self.checkpoint_key()
+        save_checkpoint(key, checkpoint)
+        self.resume_checkpoint = checkpoint
+        if key not in self.checkpoint_keys:
+            self.checkpoint_keys = self.checkpoint_keys + [key]
 
     def create_table_statement(self):
         """Return SQL statement to create a table."""
@@ -405,26 +607,69 @@ class Engine(object):
         return db_name.replace('-', '_')
 
     def download_file(self, url, filename):
-        """Download file to the raw data directory."""
-        if not self.find_file(filename) or not self.use_cache:
-            path = self.format_filename(filename)
+        """Download file to the raw data directory.
+
+        If the file was submitted with `download_files`, wait for it instead.
+        A cached copy not matching the checksum declared for the url is
+        downloaded again. Returns True if the file was downloaded, False if
+        the cached copy was used.
+        """
+        path = self.format_filename(filename)
+        if self.download_manager is not None:
+            download = self.download_manager.wait(path)
+            if download is not None:
+                return download.result
+        found = self.find_file(filename)
+        corrupt = found and self.use_cache and not self.verify_cached_file(url, found)
+        if not found or corrupt or not self.use_cache or self.revalidate:
             self.create_raw_data_dir()
-            print("\nDownloading " + filename + "...")
+            if corrupt:
+                print("\n{} does not match its checksum, downloading it again...".format(filename))
+                os.remove(found)
+            elif file_exists(path) and self.use_cache:
+                print("\nChecking " + filename + " for updates...")
+            else:
+                print("\nDownloading " + filename + "...")
             try:
-                urlretrieve(url, path, reporthook=reporthook)
-            except ImportError:
-                # For some urls lacking filenames urlretrieve from the future
-                # package seems to fail. This issue occurred in the PlantTaxonomy
-                # script. If this happens, fall back to the standard Python 2 version.
-                from urllib import urlretrieve as py2urlretrieve
-                py2urlretrieve(url, path, reporthook=reporthook)
+                return self.fetch_file(url, path, reporthook=reporthook)
             finally:
                 # Download is complete, set to prevent repeated downloads
                 self.use_cache = True
+        touch_file(found)
+        return False
+
+    def download_files(self, urls):
+        """Start downloading files to the raw data directory in the background.
+
+        `urls` holds urls or (url, filename) pairs. Up to `download_workers`
+        files are downloaded at once, and no more than `download_host_limit`
+        from the same host. `download_file` and `download_files_from_archive`
+        block until the files they need are downloaded.
+        """
+        pending = []
+        for url in urls:
+            if isinstance(url, tuple):
+                url, filename = url
+            else:
+                filename = filename_from_url(url)
+            if not self.find_file(filename) or not self.use_cache or self.revalidate:
+                pending.append((url, self.format_filename(filename)))
+        if not pending:
+            return
+        self.create_raw_data_dir()
+        print("\nDownloading {} files in the background...".format(len(pending)))
+        manager = self.get_download_manager()
+        for url, path in pending:
+            manager.submit(url, path)
 
     def download_files_from_archive(self, url, filenames, filetype="zip",
                                     keep_in_dir=False, archivename=None):
-        """Download files from an archive into the raw data directory."""
+        """Download files from an archive into the raw data directory.
+
+        Members of zip archives that are not cached are fetched on their own
+        with HTTP range requests where the server supports them (see
+        `fetch_members`), instead of downloading the whole archive.
+        """
         print()
         downloaded = False
         if archivename:
@@ -440,52 +685,64 @@ class Engine(object):
                 os.makedirs(archivedir)
         else:
             archivebase = ''
+        if self.revalidate:
+            # Extract the files again if the archive changed
+            changed = self.download_file(url, archivename)
+            downloaded = True
+        else:
+            changed = False
+        members = []
         for filename in filenames:
-            if self.find_file(os.path.join(archivebase, filename)):
+            found = self.find_file(os.path.join(archivebase, filename))
+            if found and not changed:
                 # Use local copy
-                pass
+                touch_file(found)
             else:
-                self.create_raw_data_dir()
-                if not downloaded:
-                    self.download_file(url, archivename)
-                    downloaded = True
-
-                if filetype == 'zip':
-                    try:
-                        archive = zipfile.ZipFile(archivename)
-                        if archive.testzip():
-                            # This fixes an issue with the zip files that was causing errors on
-                            # Python 3. testzip() returns the names of any files with issues so if
-                            # it exists there is a problem. For details of the issue and the fix see:
-                            # see """https://stackoverflow.com/questions/41492984/
-                            # zipfile-testzip-returning-different-results-on-python-2-and-python-3"""
-                            archive.getinfo(filename).file_size += (2 ** 64) - 1
-                        open_archive_file = archive.open(filename, 'r')
-                    except zipfile.BadZipFile as e:
-                        print("\n{0} can't be extracted, may be corrupt \n{1}".format(filename, e))
-
-                elif filetype == 'gz':
-                    # gzip archives can only contain a single file
-                    open_archive_file = gzip.open(archivename, 'r')
-                elif filetype == 'tar':
-                    archive = tarfile.open(filename, 'r')
-                    open_archive_file = archive.extractfile(filename)
-
-                fileloc = self.format_filename(os.path.join(archivebase, filename))
-
-                unzipped_file = open(fileloc, 'wb')
-                for line in open_archive_file:
-                    unzipped_file.write(line)
-                open_archive_file.close()
-                unzipped_file.close()
-                if 'archive' in locals():
-                    archive.close()
+                members.append(filename)
+        if not members:
+            return
+
+        self.create_raw_data_dir()
+        paths = [self.format_filename(os.path.join(archivebase, filename))
+                 for filename in members]
+        for path in paths:
+            if os.path.exists(path):
+                # An older copy may be linked to the blob store
+                os.remove(path)
+        if (not downloaded and filetype == "zip" and
+                self.fetch_members(url, archivename, members, paths)):
+            return
+        if not downloaded:
+            self.download_file(url, archivename)
+        try:
+            with ArchiveSession(archivename, filetype, verify=self.verify_archives,
+                                workers=self.extract_workers) as session:
+                digests = session.extract(members, paths)
+        except zipfile.BadZipfile as e:
+            print("\n{0} can't be extracted, may be corrupt \n{1}".format(archivename, e))
+            raise
+        for path, digest in zip(paths, digests):
+            self.store_file(path, None, {}, digest)
 
     def drop_statement(self, objecttype, objectname):
         """Return drop table or database SQL statement."""
         dropstatement = "DROP %s IF EXISTS %s" % (objecttype, objectname)
         return dropstatement
 
+    def end_bulk_load(self, session=False):
+        """Restore the settings changed to load the last table.
+
+        With `session`, the settings of the connection are restored too.
+        """
+        restore = self.bulk_table_restore
+        self.bulk_table_restore = []
+        if session and self.bulk_connection is not None:
+            if self.bulk_connection is self._connection:
+                restore = restore + self.bulk_session_restore
+            self.bulk_session_restore = []
+            self.bulk_connection = None
+        self.execute_settings(restore)
+
     def execute(self, statement, commit=True):
         """Execute given statement."""
         self.cursor.execute(statement)
@@ -498,13 +755,95 @@ class Engine(object):
         if commit:
             self.connection.commit()
 
+    def execute_settings(self, statements):
+        """Execute setting statements, carrying on without those that fail."""
+        for statement in statements:
+            try:
+                self.execute(statement)
+            except Exception as e:
+                try:
+                    self.connection.rollback()
+                except:
+                    pass
+                print("Couldn't apply setting (%s): %s" % (statement, e))
+
     def exists(self, script):
         """Check to see if the given table exists."""
         return all([self.table_exists(script.name, key)
                     for key in list(script.urls.keys()) if key])
 
+    def fetch_file(self, url, path, reporthook=None):
+        """Download a url to a path and record it in the cache manifest.
+
+        The data is written next to the path and only moved into place once
+        complete, so an interrupted download never leaves a partial file.
+        Failed downloads are resumed up to `download_retries` times. When
+        revalidating, a cached file is only downloaded again if it changed.
+        The file is hashed as it is downloaded and checked against the
+        checksum declared for the url. Returns True if the file was
+        downloaded.
+        """
+        headers = None
+        if self.revalidate and self.use_cache and file_exists(path):
+            headers = conditional_headers(url, path)
+        checksum = self.get_checksum(url)
+        response_headers = fetch_url(url, path, reporthook=reporthook,
+                                     retries=self.download_retries, headers=headers,
+                                     checksum=checksum, pool=self.get_download_pool())
+        if response_headers is None:
+            print("\n{} is up to date".format(os.path.basename(path)))
+            touch_file(path)
+            return False
+        self.store_file(path, url, response_headers, checksum.hexdigest(),
+                        checksum.declaration() if checksum.declared() else None)
+        return True
+
+    def fetch_members(self, url, archivename, members, paths):
+        """Download members of a remote zip archive without the archive.
+
+        Only the central directory and the bytes of each member are
+        requested. Returns False, leaving the archive to be downloaded, if
+        the archive is not on an HTTP server, is cached or submitted for
+        download, or has a declared checksum, which only the whole archive
+        can be checked against. Also returns False if the server does not
+        answer range requests or the fetch fails.
+        """
+        if (not self.fetch_archive_members or
+                not url.lower().startswith(("http://", "https://")) or
+                file_exists(archivename) or self.get_checksum(url).declared() or
+                (self.download_manager is not None and
+                 self.download_manager.submitted(archivename))):
+            return False
+        try:
+            remote_zip = RemoteZip(url, self.get_download_pool())
+            digests = []
+            for member, path in zip(members, paths):
+                print("Downloading " + member + " from " + os.path.basename(archivename) + "...")
+                digests.append(remote_zip.extract(member, path))
+        except (IOError, OSError, EOFError, ValueError, HTTPException,
+                zipfile.BadZipfile, NotImplementedError) as e:
+            if not isinstance(e, RangeNotSupported):
+                print("\nCould not fetch members of {} on their own ({}), "
+                      "downloading the archive...".format(os.path.basename(archivename), e))
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+            return False
+        for path, digest in zip(paths, digests):
+            self.store_file(path, None, {}, digest)
+        return True
+
     def final_cleanup(self):
-        """Close the database connection."""
+        """Stop background downloads, restore bulk load settings, remove
+        the checkpoints of the loaded tables, evict cached raw data over the
+        cache size and close the database connection."""
+        self.stop_downloads()
+        self.end_bulk_load(session=True)
+        for key in self.checkpoint_keys:
+            remove_checkpoint(key)
+        self.checkpoint_keys = []
+        if self.cache_size is not None:
+            prune_blobs(self.cache_size)
         if self.warnings:
             print('\n'.join(str(w) for w in self.warnings))
 
@@ -539,42 +878,55 @@ class Engine(object):
         3. Cleaning up badly formatted integers
         4. Obtaining consistent float representations of decimals
         """
-        datatype = datatype.split('-')[-1]
-        strvalue = str(value).strip()
+        return format_value(value, datatype)
+
+    def get_column_converter(self, datatype):
+        """Return a function that converts a column of raw values.
+
+        Columns are converted a batch at a time with the converters in
+        `retriever.lib.converters`. Engines that format a data type
+        differently in `format_insert_value` override this method.
+        """
+        return column_converter(datatype)
+
+    def get_batch_sizer(self):
+        """Return the BatchSizer used to size the batches of a table.
+
+        Batches start at `insert_limit` rows and adapt to the measured
+        throughput unless `batch_size` (rows) or `batch_bytes` is set.
+        """
+        return BatchSizer(self.insert_limit, self.batch_size, self.batch_bytes,
+                          max_bytes=self.max_batch_bytes)
 
-        # Remove any quotes already surrounding the string
-        quotes = ["'", '"']
-        if len(strvalue) > 1 and strvalue[0] == strvalue[-1] and strvalue[0] in quotes:
-            strvalue = strvalue[1:-1]
-        missing_values = ("null", "none")
-        if strvalue.lower() in missing_values:
+    def get_bytes_read(self):
+        """Return the byte offset reached in the current data file, or None."""
+        if self.data_file is None or self.data_file.closed:
             return None
-        elif datatype in ("int", "bigint", "bool"):
-            if strvalue:
-                intvalue = strvalue.split('.')[0]
-                if intvalue:
-                    return int(intvalue)
-                else:
-                    return None
-            else:
-                return None
-        elif datatype in ("double", "decimal"):
-            if strvalue.strip():
-                try:
-                    decimals = float(str(strvalue))
-                    return decimals
-                except:
-                    return None
-            else:
-                return None
-        elif datatype == "char":
-            if strvalue.lower() in missing_values:
-                return None
-            else:
-                return strvalue
-        else:
+        try:
+            return self.data_file.buffer.tell()
+        except (AttributeError, IOError, OSError, ValueError):
             return None
 
+    def get_checksum(self, url):
+        """Return a Checksum for the file at a url, with what the script declares."""
+        expected = (None, None)
+        if self.script is not None and hasattr(self.script, 'url_checksum'):
+            expected = self.script.url_checksum(url)
+        return Checksum(*expected)
+
+    def get_commit_policy(self):
+        """Return the CommitPolicy for loading the current table.
+
+        The `commit_rows`, `commit_bytes` and `commit_seconds` limits of the
+        engine can be overridden per table by setting them in the table's
+        dialect. The policy is kept as `commit_policy` for its metrics.
+        """
+        self.commit_policy = CommitPolicy(
+            getattr(self.table, 'commit_rows', self.commit_rows),
+            getattr(self.table, 'commit_bytes', self.commit_bytes),
+            getattr(self.table, 'commit_seconds', self.commit_seconds))
+        return self.commit_policy
+
     def get_cursor(self):
         """Get db cursor."""
         if self._cursor is None:
@@ -600,13 +952,150 @@ class Engine(object):
             if self.opts[opt[0]] in ["", "default"]:
                 self.opts[opt[0]] = opt[2]
 
-    def insert_data_from_archive(self, url, filenames):
-        """Insert data from files located in an online archive. This function
-        extracts the file, inserts the data, and deletes the file if raw data
-        archiving is not set."""
-        self.download_files_from_archive(url, filenames)
+    def get_download_manager(self):
+        """Return the pool downloading files in the background."""
+        with download_lock:
+            if self.download_manager is None:
+                self.download_manager = DownloadManager(self.fetch_file,
+                                                        workers=self.download_workers,
+                                                        per_host=self.download_host_limit)
+        return self.download_manager
+
+    def get_download_pool(self):
+        """Return the connections kept open between downloads.
+
+        The pool is created by the first download that needs it, which may
+        run in any of the download threads.
+        """
+        with download_lock:
+            if self.download_pool is None:
+                self.download_pool = ConnectionPool(per_host=self.download_host_limit)
+        return self.download_pool
+
+    def get_load_plan(self):
+        """Return the load plan of the current table.
+
+        The plan is compiled when the table is created; it is only rebuilt
+        here if rows are loaded into a table that was not created by this
+        engine.
+        """
+        if self.load_plan is None or self.load_plan.table is not self.table:
+            self.load_plan = TableLoadPlan(self, self.table)
+        return self.load_plan
+
+    def get_progress(self):
+        """Return the percentage of the current data file read so far.
+
+        The position is taken from the byte offset of the underlying binary
+        stream (or of the last chunk loaded by `add_to_table_in_chunks`) so
+        it can be computed without counting lines. Returns None when the
+        data does not come from a file.
+        """
+        if self.data_file is None and self.chunk_position is not None:
+            position, size = self.chunk_position
+        else:
+            position = self.get_bytes_read()
+            if position is None:
+                return None
+            try:
+                size = os.fstat(self.data_file.fileno()).st_size
+            except (AttributeError, IOError, OSError, ValueError):
+                return None
+        if not size:
+            return None
+        return min(100, int(position * 100 / size))
+
+    def get_resume_offset(self, filename=None):
+        """Return the byte offset to continue loading a data file from.
+
+        The data files of a table kept by `create_table` are matched, in
+        order, with those recorded in its checkpoint: files already loaded
+        are skipped, and the file being loaded when the load was interrupted
+        continues after its last commit. The record_id of the table is set
+        to the one reached. Data without a filename, such as members of
+        archives and urls, cannot be skipped or continued, so the table is
+        not checkpointed any further once it is loaded.
+
+        If the data changed, the kept table is created again, or, when files
+        of the table were already skipped, an error is raised. Returns None
+        to load the file from its first record.
+        """
+        checkpoint = self.resume_checkpoint
+        if checkpoint is None:
+            return None
+        loaded = checkpoint['loaded']
+        position = self.files_loaded
+        if position < len(loaded):
+            if filename is not None:
+                fingerprint = source_fingerprint(filename)
+                if same_source(fingerprint, loaded[position]):
+                    self.table.record_id = loaded[position]['record_id']
+                    print("Skipping " + filename + ", already loaded into " +
+                          self.table_name())
+                    return fingerprint['size']
+        elif checkpoint['file'] is None:
+            # The files before this one are loaded
+            self.table.record_id = checkpoint['record_id']
+            if filename is None:
+                remove_checkpoint(self.checkpoint_key())
+                self.resume_checkpoint = None
+                self.files_loaded = 0
+            return None
+        elif filename is not None and same_source(checkpoint['file'],
+                                                  source_fingerprint(filename)):
+            self.table.record_id = checkpoint['record_id']
+            print("Resuming " + self.table_name() +
+                  " after record {}".format(self.table.record_id))
+            return checkpoint['offset']
+        if position:
+            raise Exception("The data of {} changed since its checkpoint, "
+                            "install it again without --resume".format(self.table_name()))
+        if filename is None:
+            print("Only data files can be resumed, reloading " + self.table_name())
+        else:
+            print("The data changed since the checkpoint, reloading " + self.table_name())
+        resume, self.resume = self.resume, False
+        try:
+            self.create_table()
+        finally:
+            self.resume = resume
+        return None
+
+    def insert_batch(self, multiple_values):
+        """Insert a batch of cleaned rows and report progress."""
+        if not multiple_values:
+            return
+        try:
+            insert_stmt = self.insert_statement(multiple_values)
+        except:
+            if self.debug:
+                print(self.get_load_plan().datatypes)
+            if self.debug:
+                print(multiple_values[-1])
+            raise
+        try:
+            self.executemany(insert_stmt, multiple_values, commit=False)
+        except:
+            print(insert_stmt)
+            raise
+        self.rows_inserted += len(multiple_values)
+        progress = self.get_progress()
+        if progress is None:
+            prompt = "Progress: {} rows inserted into {}:".format(
+                self.rows_inserted, self.table_name())
+        else:
+            prompt = "Progress: {}% read, {} rows inserted into {}:".format(
+                progress, self.rows_inserted, self.table_name())
+        sys.stdout.write(prompt + "\b" * len(prompt))
+        sys.stdout.flush()
+
+    def insert_data_from_archive(self, url, filenames, filetype="zip", archivename=None):
+        """Insert data from files located in an online archive.
+
+        The files are read from the archive in place unless
+        `extract_archives` is set (see `archive_member`)."""
         for filename in filenames:
-            file_path = self.find_file(filename)
+            file_path = self.archive_member(url, filename, filetype, archivename)
             if file_path:
                 self.insert_data_from_file(file_path)
             else:
@@ -615,19 +1104,35 @@ class Engine(object):
     def insert_data_from_file(self, filename):
         """The default function to insert data from a file. This function
         simply inserts the data row by row. Database platforms with support
-        for inserting bulk data from files can override this function."""
+        for inserting bulk data from files can override this function.
+
+        With `resume`, and for files larger than `parallel_chunk_size` when
+        `load_in_chunks` is set, data files are loaded one chunk at a time
+        by `add_to_table_in_chunks`. Members of archives and urls are always
+        read as a stream."""
+        if not is_stream_source(filename) and (
+                self.resume or
+                (self.load_in_chunks() and
+                 os.path.getsize(filename) > self.parallel_chunk_size)):
+            return self.add_to_table_in_chunks(filename)
         data_source = (skip_rows,
                        (self.table.header_rows,
                         (self.load_data, (filename,))))
         self.add_to_table(data_source)
 
     def insert_data_from_url(self, url):
-        """Insert data from a web resource, such as a text file."""
+        """Insert data from a web resource, such as a text file.
+
+        With `stream` set, data that is not cached is inserted as it is
+        downloaded and no copy is saved.
+        """
         filename = filename_from_url(url)
         find = self.find_file(filename)
         if find and self.use_cache:
             # Use local copy
             self.insert_data_from_file(find)
+        elif self.stream:
+            self.insert_data_from_file(url)
         else:
             # Save a copy of the file locally, then load from that file
             self.create_raw_data_dir()
@@ -637,25 +1142,53 @@ class Engine(object):
 
     def insert_statement(self, values):
         """Return SQL statement to insert a set of values."""
-        columns = self.table.get_insert_columns()
-        types = self.table.get_column_datatypes()
-        columncount = len(self.table.get_insert_columns(join=False, create=False))
+        plan = self.get_load_plan()
         for row in values:
-            row_length = len(row)
-            # Add None with appropriate value type for empty cells
-            for i in range(columncount - row_length):
-                row.append(self.format_insert_value(None, types[row_length + i]))
-
-        insert_stmt = "INSERT INTO " + self.table_name()
-        insert_stmt += " (" + columns + ")"
-        insert_stmt += " VALUES ("
-        for i in range(0, columncount):
-            insert_stmt += "{}, ".format(self.placeholder)
-        insert_stmt = insert_stmt.rstrip(", ") + ")"
+            # Add None for empty cells
+            if len(row) < plan.width:
+                row.extend([None] * (plan.width - len(row)))
 
         if self.debug:
-            print(insert_stmt)
-        return insert_stmt
+            print(plan.insert_stmt)
+        return plan.insert_stmt
+
+    def scan_column_types(self, column_types, source):
+        """Add the rows of a data source to a ColumnTypes lattice."""
+        source = iter(source)
+        if self.infer_strategy == "full":
+            for values in source:
+                if values:
+                    column_types.add_row(values)
+            return
+        while True:
+            rows = list(islice(source, self.infer_sample_size))
+            if not rows:
+                break
+            column_types.add_rows(rows)
+
+    def schema_cache_key(self, file_path, pk=None):
+        """Return what the schema inferred from a data file depends on."""
+        cleanup = self.table.cleanup
+        return {
+            'version': VERSION,
+            'script': getattr(self.script, 'name', None),
+            'script_version': getattr(self.script, 'version', None),
+            'table': self.table.name,
+            'file': file_path if is_stream_source(file_path) else os.path.abspath(file_path),
+            'pk': pk,
+            'max_int': getattr(self, 'max_int', None),
+            'delimiter': self.table.delimiter,
+            'header_rows': self.table.header_rows,
+            'fixed_width': self.table.fixed_width,
+            'replace_columns': self.table.replace_columns,
+            'cleanup': [cleanup.function.__name__, cleanup.args],
+        }
+
+    def report_commits(self):
+        """Print the commit latencies of the last table in debug mode."""
+        if self.debug and self.commit_policy is not None:
+            print("\nCommits to " + self.table_name() + ": " +
+                  self.commit_policy.summary())
 
     def set_engine_encoding(self):
         pass
@@ -665,6 +1198,42 @@ class Engine(object):
         self.auto_get_delimiter(dataset_file.readline())
         dataset_file.close()
 
+    def start_bulk_load(self):
+        """Apply the settings of the "fast" `load_profile` to a new table.
+
+        The settings of the previous table are restored first. Session
+        settings are applied once per connection and restored by
+        `final_cleanup`.
+        """
+        if self.load_profile != "fast":
+            return
+        self.end_bulk_load()
+        if self.bulk_connection is not self._connection:
+            settings = self.bulk_session_settings()
+            self.execute_settings([setting for setting, _ in settings])
+            self.bulk_session_restore = [restore for _, restore in settings]
+            self.bulk_connection = self._connection
+        settings = self.bulk_table_settings(self.table_name())
+        self.execute_settings([setting for setting, _ in settings])
+        self.bulk_table_restore = [restore for _, restore in settings]
+
+    def stop_downloads(self):
+        """Stop background downloads and close the connections kept open."""
+        if self.download_manager is not None:
+            self.download_manager.close()
+        if self.download_pool is not None:
+            self.download_pool.close()
+
+    def store_file(self, path, url, headers, digest=None, verified=None):
+        """Record a raw data file in the cache manifest and the blob store.
+
+        Files with the same content as a stored blob are replaced by a link
+        to it.
+        """
+        entry = save_entry(path, url, headers, digest, verified)
+        if self.use_blob_store:
+            add_blob(path, entry['md5'])
+
     def table_exists(self, dbname, tablename):
         """This can be overridden to return True if a table exists. It
         returns False by default."""
@@ -701,6 +1270,29 @@ class Engine(object):
             sort_csv(csv_file_output)
         self.disconnect()
 
+    def verify_cached_file(self, url, path):
+        """Check a cached raw data file against the checksum declared for its url.
+
+        A file recorded as matching the same checksum is not read again,
+        unless its size or modification time changed since. Files without a
+        declared checksum are not checked.
+        """
+        checksum = self.get_checksum(url)
+        if not checksum.declared():
+            return True
+        entry = load_entry(path)
+        if (entry and entry.get('verified') == checksum.declaration() and
+                entry.get('size') == os.path.getsize(path) and
+                entry.get('mtime') == os.path.getmtime(path)):
+            return True
+        checksum.update_file(path)
+        try:
+            checksum.verify(os.path.basename(path))
+        except ChecksumError:
+            return False
+        mark_verified(path, url, checksum.hexdigest(), checksum.declaration())
+        return True
+
     def warning(self, warning):
         new_warning = Warning('%s:%s' % (self.script.name, self.table.name), warning)
         self.warnings.append(new_warning)
@@ -718,7 +1310,116 @@ class Engine(object):
             self.set_table_delimiter(filename)
 
         dataset_file = open_fr(filename)
+        self.data_file = dataset_file
+        for row in self.load_rows(dataset_file):
+            yield row
+
+    def load_in_chunks(self):
+        """Check if large files are loaded one chunk at a time.
+
+        Chunks are only used when they are needed: to checkpoint the load
+        with `resume`, to parse with several `parallel_workers`, or to
+        commit as set by `get_commit_policy`.
+        """
+        return bool(self.resume or self.parallel_workers > 1 or
+                    self.get_commit_policy().limited())
 
+    def load_chunk(self, filename, begin, end):
+        """Parse, clean and convert the records between two byte offsets.
+
+        This runs in the worker processes started by `map_chunks` for
+        `add_to_table_in_chunks`, or in the loading process itself. It
+        returns the number of records read, the converted rows and a list of
+        (record offset, message) pairs for the rows that had to be dropped.
+        """
+        plan = self.get_load_plan()
+        lines = self.read_chunk(filename, begin, end)
+        if plan.crosstab:
+            lines = plan.unpivot(lines)
+
+        cleanup = self.table.cleanup
+        count = 0
+        raw_rows = []
+        record_offsets = []
+        warnings = []
+        for line in lines:
+            if not line:
+                continue
+            count += 1
+            linevalues = plan.values_from_line(line)
+            if cleanup.function is not no_cleanup:
+                try:
+                    linevalues = [cleanup.function(value, cleanup.args)
+                                  for value in linevalues]
+                except Exception as e:
+                    warnings.append((count, str(e)))
+                    continue
+            raw_rows.append(linevalues)
+            record_offsets.append(count)
+
+        rows, errors = plan.convert_rows(raw_rows)
+        warnings.extend((record_offsets[index], str(e)) for index, e in errors.items())
+        return count, rows, sorted(warnings)
+
+    def infer_chunk(self, filename, begin, end, width):
+        """Detect the column types of the records between two byte offsets.
+
+        This runs in the worker processes of `auto_get_datatypes` and returns
+        a ColumnTypes lattice for the first `width` columns.
+        """
+        column_types = ColumnTypes(width, getattr(self, 'max_int', None),
+                                   self.table.cleanup)
+        self.scan_column_types(column_types, self.read_chunk(filename, begin, end))
+        return column_types
+
+    def read_batches(self, data_source, sizer):
+        """Generator returning batches of cleaned rows and their record_ids.
+
+        Cross-tab data is unpivoted and every line is split and cleaned,
+        skipping lines that fail cleanup with a warning. A batch is returned
+        each time `sizer.size` rows are read and with the rows left at the
+        end.
+        """
+        plan = self.get_load_plan()
+        if plan.crosstab:
+            # cross-tab data
+            real_lines = plan.unpivot(gen_from_source(data_source))
+        else:
+            real_lines = gen_from_source(data_source)
+        cleanup = self.table.cleanup
+        raw_rows = []
+        record_ids = []
+        for line in real_lines:
+            if not line:
+                # Only process non empty lines
+                continue
+            self.table.record_id += 1
+            linevalues = plan.values_from_line(line)
+            if cleanup.function is not no_cleanup:
+                try:
+                    linevalues = [cleanup.function(value, cleanup.args)
+                                  for value in linevalues]
+                except Exception as e:
+                    self.warning('Exception in line %s: %s' % (self.table.record_id, e))
+                    continue
+            raw_rows.append(linevalues)
+            record_ids.append(self.table.record_id)
+            if len(raw_rows) >= sizer.size:
+                yield raw_rows, record_ids
+                raw_rows = []
+                record_ids = []
+        if raw_rows:
+            yield raw_rows, record_ids
+
+    def read_chunk(self, filename, begin, end):
+        """Return a generator of the rows between two byte offsets of a file."""
+        with open(filename, 'rb') as data_file:
+            data_file.seek(begin)
+            data = data_file.read(end - begin)
+        return self.load_rows(io.StringIO(data.decode(ENCODING), newline=None))
+
+    def load_rows(self, dataset_file):
+        """Generator returning lists of values from an open data file."""
         if self.table.fixed_width:
             for row in dataset_file:
                 yield self.extract_fixed_width(row)
@@ -737,6 +1438,13 @@ class Engine(object):
         return values
 
 
+def estimate_bytes(rows):
+    """Estimate the size of a batch of rows from its last row."""
+    if not rows:
+        return 0
+    return len(rows) * sum(len(str(value)) for value in rows[-1] if value is not None)
+
+
 def skip_rows(rows, source):
     """Skip over the header lines by reading them before processing."""
     lines = gen_from_source(source)
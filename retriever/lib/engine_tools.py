@@ -14,10 +14,12 @@ import difflib
 import json
 import platform
 import shutil
+import time
 import warnings
 
 from hashlib import md5
 from io import StringIO as newfile
+from retriever.lib.blob_store import find_blobs, list_blobs, linked_paths, parse_size, pin_blob, prune_blobs
 from retriever.lib.defaults import HOME_DIR, ENCODING
 
 from retriever.lib.models import *
@@ -94,13 +96,13 @@ def reset_retriever(scope="all", ask_permission=True):
     """Remove stored information on scripts, data, and connections."""
     warning_messages = {
         'all': "\nThis will remove existing scripts, cached data, and information on database connections." 
-               +"\nSpecifically it will remove the scripts and raw_data folders and the connections.config file in {}."
+               +"\nSpecifically it will remove the scripts, raw_data, schema_cache and checkpoints folders and the connections.config file in {}."
                +"\nDo you want to proceed? (y/N)\n",
         'scripts': "\nThis will remove existing scripts."
                    +"\nSpecifically it will remove the scripts folder in {}." 
                    +"\nDo you want to proceed? (y/N)\n",
         'data': "\nThis will remove raw data cached by the Retriever." 
-                +"\nSpecifically it will remove the raw_data folder in {}."
+                +"\nSpecifically it will remove the raw_data, schema_cache and checkpoints folders in {}."
                 +"\nDo you want to proceed? (y/N)\n"
     }
 
@@ -117,11 +119,41 @@ def reset_retriever(scope="all", ask_permission=True):
         if scope in ['data', 'all']:
             if os.path.exists(os.path.join(path, 'raw_data')):
                 shutil.rmtree(os.path.join(path, 'raw_data'))
+            if os.path.exists(os.path.join(path, 'schema_cache')):
+                shutil.rmtree(os.path.join(path, 'schema_cache'))
+            if os.path.exists(os.path.join(path, 'checkpoints')):
+                shutil.rmtree(os.path.join(path, 'checkpoints'))
         if scope in ['scripts', 'all']:
             if os.path.exists(os.path.join(path, 'scripts')):
                 shutil.rmtree(os.path.join(path, 'scripts'))
 
 
+def manage_cache(action, entries=None, max_size=None):
+    """List, prune, pin or unpin the raw data files in the blob store."""
+    if action == 'list':
+        blobs = list_blobs()
+        total = 0
+        for digest, info in reversed(blobs):
+            total += info['size']
+            print("{} {:>12} {} {}".format(
+                digest[:12], info['size'],
+                time.strftime('%Y-%m-%d %H:%M', time.localtime(info.get('last_used', 0))),
+                'pinned' if info.get('pinned') else ''))
+            for path in linked_paths(digest, info):
+                print("    " + path)
+        print("{} files, {} bytes".format(len(blobs), total))
+    elif action == 'prune':
+        removed = prune_blobs(parse_size(max_size) if max_size else None)
+        print("Removed {} files.".format(len(removed)))
+    elif action in ('pin', 'unpin'):
+        for entry in entries or []:
+            digests = find_blobs(entry)
+            if not digests:
+                print("{} is not in the cache.".format(entry))
+            for digest in digests:
+                pin_blob(digest, action == 'pin')
+
+
 def json2csv(input_file, output_file=None, header_values=None):
     """Convert Json file to CSV.
 
@@ -47,6 +47,7 @@ delete_json_parser = subparsers.add_parser('delete_json', help='CLI to remove re
 ls_parser = subparsers.add_parser('ls', help='display a list all available dataset scripts')
 citation_parser = subparsers.add_parser('citation', help='view citation')
 license_parser = subparsers.add_parser('license', help='view dataset license')
+cache_parser = subparsers.add_parser('cache', help='inspect, prune and pin cached raw data files')
 reset_parser = subparsers.add_parser('reset',
                                      help='reset retriever: removes configation settings, scripts, and cached data')
 help_parser = subparsers.add_parser('help', help='')
@@ -61,10 +62,54 @@ new_parser.add_argument('filename', help='new script filename')
 edit_json_parser.add_argument('dataset', help='dataset name', choices=json_list)
 reset_parser.add_argument('scope', help='things to reset: all, scripts, data, or connections',
                           choices=['all', 'scripts', 'data', 'connections'])
+cache_parser.add_argument('action', help='list cached files, remove unused or least recently used ones, '
+                                          'or keep files from being removed',
+                          choices=['list', 'prune', 'pin', 'unpin'])
+cache_parser.add_argument('entries', help='hashes or paths of cached files to pin or unpin', nargs='*')
+cache_parser.add_argument('--max-size', help='remove least recently used files until the cache is smaller, e.g. 20g',
+                          default=None)
 install_parser.add_argument('--compile', help='force re-compile of script before downloading', action='store_true')
 install_parser.add_argument('--debug', help='run in debug mode', action='store_true')
 install_parser.add_argument('--not-cached', help='overwrites local cache of raw data', action='store_true')
+install_parser.add_argument('--resume', help='continue interrupted table loads from their last checkpoint',
+                            action='store_true')
+install_parser.add_argument('--parallel', help='number of processes used to parse large data files',
+                            type=int, default=1)
+install_parser.add_argument('--batch-size', help='number of rows inserted per batch (default: adapt to throughput)',
+                            type=int, default=None)
+install_parser.add_argument('--batch-bytes', help='approximate number of bytes inserted per batch',
+                            type=int, default=None)
+install_parser.add_argument('--max-statement-bytes',
+                            help='maximum size of the multi-row INSERT statements sent by PostgreSQL and MySQL',
+                            type=int, default=None)
+install_parser.add_argument('--binary-copy', help='send PostgreSQL COPY data in binary format',
+                            action='store_true')
+install_parser.add_argument('--copy-workers',
+                            help='number of connections PostgreSQL copies large files over', type=int,
+                            default=1)
+install_parser.add_argument('--load-profile', choices=['fast', 'safe'], default='safe',
+                            help='fast: trade durability for speed while loading tables (default: safe)')
+install_parser.add_argument('--commit-rows', help='commit after this many rows are inserted', type=int, default=None)
+install_parser.add_argument('--commit-bytes', help='commit after this many bytes are inserted', type=int, default=None)
+install_parser.add_argument('--commit-seconds', help='commit after inserting for this many seconds',
+                            type=float, default=None)
+install_parser.add_argument('--infer-types', help='check every value (full) or validate sampled types in batches (sample)',
+                            choices=['full', 'sample'], default='sample')
+install_parser.add_argument('--revalidate', help='download cached raw data files again only if they changed upstream',
+                            action='store_true')
+install_parser.add_argument('--cache-size', help='remove least recently used raw data files above this size, e.g. 20g',
+                            default=None)
+install_parser.add_argument('--download-workers', help='number of raw data files downloaded at once',
+                            type=int, default=4)
+install_parser.add_argument('--stream', help='load data as it is downloaded without saving raw data files',
+                            action='store_true')
 download_parser.add_argument('dataset', help='dataset name').completer = ChoicesCompleter(script_list)
+download_parser.add_argument('--revalidate', help='download cached raw data files again only if they changed upstream',
+                             action='store_true')
+download_parser.add_argument('--cache-size', help='remove least recently used raw data files above this size, e.g. 20g',
+                             default=None)
+download_parser.add_argument('--download-workers', help='number of raw data files downloaded at once',
+                             type=int, default=4)
 ls_parser.add_argument('-l', help='search datasets with specific license(s)',
                        nargs='+').completer = ChoicesCompleter(list(licenses_options))
 ls_parser.add_argument('-k', help='search datasets with keyword(s)',
@@ -0,0 +1,154 @@
+"""Data Retriever Type Inference
+
+This module contains the column type lattice used to detect the data types
+of a data file. Each column starts as int and is only ever promoted along
+
+    int -> bigint -> double -> decimal -> char
+
+so the types found for parts of a file can be merged in any order and give
+the same result as scanning the whole file row by row.
+
+"""
+import re
+from builtins import object
+from builtins import range
+from builtins import str
+from builtins import zip
+from operator import methodcaller
+
+from future.moves.itertools import zip_longest
+
+from retriever.lib.cleanup import no_cleanup
+
+INT, BIGINT, DOUBLE, DECIMAL, CHAR = range(5)
+TYPE_NAMES = ('int', 'bigint', 'double', 'decimal', 'char')
+# Formatted floats in exponent notation or with more than 10 decimals
+DECIMAL_PATTERN = re.compile(r"e|\.\d{11}")
+
+
+def is_decimal(text):
+    """Check if formatted floats need a fixed precision decimal type."""
+    return DECIMAL_PATTERN.search(text) is not None
+
+
+def promote(kind, value, max_int=None):
+    """Return the type of a column of type `kind` after seeing `value`."""
+    if kind <= BIGINT:
+        try:
+            number = int(value)
+        except (TypeError, ValueError):
+            kind = DOUBLE
+        else:
+            if kind == INT and max_int is not None and number > max_int:
+                return BIGINT
+            return kind
+    if kind <= DECIMAL:
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            return CHAR
+        if kind == DOUBLE and is_decimal(str(number)):
+            return DECIMAL
+    return kind
+
+
+class ColumnTypes(object):
+    """Data types and maximum value lengths seen in each column.
+
+    `add_row` checks every value on its own. `add_rows` checks a batch a
+    column at a time with `int`/`float` and only falls back to checking the
+    values of a column one by one when the batch does not fit the column's
+    current type, promoting it.
+    """
+
+    def __init__(self, width, max_int=None, cleanup=None):
+        self.width = width
+        self.max_int = max_int
+        self.cleanup = cleanup
+        self.kinds = [INT] * width
+        self.max_lengths = [0] * width
+
+    def clean(self, values):
+        """Return the distinct non-empty values of a column after cleanup.
+
+        Types and lengths only depend on which values occur, so repeated
+        values are checked (and cleaned) once.
+        """
+        values = set(values)
+        if self.cleanup is not None and self.cleanup.function is not no_cleanup:
+            values = set(self.cleanup.function(u"{}".format(value), self.cleanup.args)
+                         for value in values)
+            return [value for value in values
+                    if value is not None and value.strip()]
+        return list(filter(methodcaller('strip'), values))
+
+    def add_value(self, index, value):
+        """Update a column with a cleaned, non-empty value."""
+        length = len(str(value)) + 100
+        if length > self.max_lengths[index]:
+            self.max_lengths[index] = length
+        if self.kinds[index] != CHAR:
+            self.kinds[index] = promote(self.kinds[index], value, self.max_int)
+
+    def add_column(self, index, values):
+        """Update a column with a batch of raw values."""
+        try:
+            values = self.clean(values)
+        except AttributeError:
+            values = self.clean([u"{}".format(value) for value in values])
+        if not values:
+            return
+        kind = self.kinds[index]
+        try:
+            length = max(map(len, values)) + 100
+            if kind <= BIGINT:
+                largest = max(map(int, values))
+                if kind == INT and self.max_int is not None and largest > self.max_int:
+                    kind = BIGINT
+            elif kind <= DECIMAL:
+                numbers = list(map(float, values))
+                if kind == DOUBLE and is_decimal(" ".join(map(str, numbers))):
+                    kind = DECIMAL
+        except (TypeError, ValueError):
+            for value in values:
+                self.add_value(index, value)
+            return
+        self.kinds[index] = kind
+        if length > self.max_lengths[index]:
+            self.max_lengths[index] = length
+
+    def add_row(self, values):
+        """Update every column with the values of a single row."""
+        for index, value in zip(range(self.width), values):
+            value = u"{}".format(value)
+            if self.cleanup is not None and self.cleanup.function is not no_cleanup:
+                value = self.cleanup.function(value, self.cleanup.args)
+            if value is not None and value.strip():
+                self.add_value(index, value)
+
+    def add_rows(self, rows):
+        """Update every column with a batch of rows."""
+        rows = [row for row in rows if row]
+        if not rows:
+            return
+        columns = zip_longest(*rows, fillvalue='')
+        for index, values in zip(range(self.width), columns):
+            self.add_column(index, values)
+
+    def merge(self, other):
+        """Combine the types seen in another part of the same file."""
+        self.kinds = [max(pair) for pair in zip(self.kinds, other.kinds)]
+        self.max_lengths = [max(pair) for pair in
+                            zip(self.max_lengths, other.max_lengths)]
+
+    def datatypes(self):
+        """Return the detected data type of each column."""
+        datatypes = []
+        for kind, length in zip(self.kinds, self.max_lengths):
+            if kind == CHAR:
+                datatypes.append(['char', length])
+            elif kind == DECIMAL:
+                datatypes.append(['decimal', '50,30'])
+            else:
+                datatypes.append([TYPE_NAMES[kind]])
+        return datatypes
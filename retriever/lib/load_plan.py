@@ -0,0 +1,118 @@
+"""Data Retriever Load Plans
+
+This module contains the per-table load plan used when inserting rows.
+Everything that only depends on the table definition and the engine is
+worked out once, when the table is created, instead of for every row or
+every batch.
+
+"""
+from builtins import object
+from builtins import zip
+
+
+class TableLoadPlan(object):
+    """Compiled description of how raw rows are loaded into a table.
+
+    The plan holds:
+
+    1. The projection of raw values onto insert columns (skipped columns
+       are dropped and "combine" columns are appended to the previous value)
+    2. The number of insert columns rows are padded to
+    3. The cached INSERT statement for engines that use placeholders
+    4. One column converter per insert column
+    5. For cross-tab tables, how wide lines are unpivoted into rows
+    """
+
+    def __init__(self, engine, table):
+        self.table = table
+        self.columns = table.get_insert_columns(join=False, create=False)
+        self.column_names = ", ".join(self.columns)
+        self.header = table.get_insert_columns(join=False, create=True)
+        self.datatypes = table.get_column_datatypes()
+        self.width = len(self.columns)
+        self.auto_pk = table.columns[0][1][0] == 'pk-auto'
+
+        # Positions of the raw values that make up each insert column
+        offset = 1 if self.auto_pk else 0
+        groups = []
+        for position, column in enumerate(table.columns[offset:]):
+            kind = column[1][0]
+            if kind == "skip":
+                continue
+            elif kind == "combine":
+                if groups:
+                    groups[-1].append(position)
+                continue
+            groups.append([position])
+        self.identity = all(group == [i] for i, group in enumerate(groups))
+        self.combined = any(len(group) > 1 for group in groups)
+        self.groups = groups
+        self.keep = [group[0] for group in groups]
+
+        # Cross-tab values after the first `ct_split` values of a line each
+        # become a row, optionally labelled with the matching `ct_names` entry
+        self.crosstab = table.columns[-1][1][0][:3] == "ct-"
+        self.ct_names = table.ct_names if hasattr(table, "ct_names") else None
+        self.ct_split = len(table.columns) - (3 if hasattr(table, "ct_names") else 2)
+        if not self.auto_pk:
+            self.ct_split += 1
+
+        self.insert_stmt = None
+        placeholder = getattr(engine, 'placeholder', None)
+        if placeholder:
+            self.insert_stmt = "INSERT INTO " + engine.table_name()
+            self.insert_stmt += " (" + self.column_names + ")"
+            self.insert_stmt += " VALUES (" + ", ".join([placeholder] * self.width) + ")"
+
+        self.converters = [engine.get_column_converter(datatype)
+                           for datatype in self.datatypes]
+
+    def values_from_line(self, line):
+        """Return the insert values of a raw row, padded with None."""
+        if self.identity:
+            values = line[:self.width]
+        elif self.combined:
+            length = len(line)
+            values = [" ".join(line[i] for i in group if i < length)
+                      for group in self.groups if group[0] < length]
+        else:
+            length = len(line)
+            values = [line[i] for i in self.keep if i < length]
+
+        if len(values) < self.width:
+            values = list(values)
+            values.extend([None] * (self.width - len(values)))
+        return values
+
+    def unpivot(self, lines):
+        """Generator returning the long format rows of cross-tab lines.
+
+        The leading values of a line are sliced into a tuple once and shared
+        by every row produced from that line.
+        """
+        split = self.ct_split
+        names = self.ct_names
+        for values in lines:
+            prefix = tuple(values[:split])
+            if names is None:
+                for item in values[split:]:
+                    yield prefix + (item,)
+            else:
+                for n, item in enumerate(values[split:]):
+                    yield prefix + (names[n], item)
+
+    def convert_rows(self, rows):
+        """Convert a batch of rows column by column.
+
+        Returns the converted rows and a dictionary mapping the index of each
+        row that could not be converted to the exception it raised. Those rows
+        are left out of the returned batch.
+        """
+        errors = {}
+        columns = [convert(column, errors)
+                   for convert, column in zip(self.converters, zip(*rows))]
+        converted = [list(row) for row in zip(*columns)]
+        if errors:
+            converted = [row for index, row in enumerate(converted)
+                         if index not in errors]
+        return converted, errors
@@ -4,6 +4,7 @@ This module contains basic class definitions for the Retriever platform.
 
 """
 
+from retriever.lib.checksums import Url
 from retriever.lib.cleanup import *
 from retriever.lib.engine import *
 from retriever.lib.table import *
@@ -0,0 +1,108 @@
+"""Data Retriever Parallel Loading
+
+This module contains the helpers used to parse large data files with a pool
+of worker processes. The file is split into chunks that start and end on
+record boundaries, each worker parses, cleans and converts whole chunks, and
+the results are handed back to the loading process in file order.
+
+Record boundaries are found by tracking the parity of quote characters, so
+quotes are expected to appear only around quoted fields (and doubled inside
+them) as in RFC 4180 CSV files.
+
+"""
+import multiprocessing
+import os
+from collections import deque
+
+# The engine whose table is being loaded. It is set before the worker
+# processes are forked so they can use it without it being pickled.
+_engine = None
+
+
+def can_fork():
+    """Return True if worker processes can be started by forking."""
+    return hasattr(os, 'fork')
+
+
+def skip_records(data_file, records, quote=None):
+    """Read past a number of records and return the offset after them."""
+    inside = False
+    while records > 0:
+        line = data_file.readline()
+        if not line:
+            break
+        if quote and line.count(quote) % 2:
+            inside = not inside
+        if not inside:
+            records -= 1
+    return data_file.tell()
+
+
+def record_chunks(filename, chunk_size, skip=0, quotechar='"', start=None):
+    """Yield (begin, end) byte offsets of chunks of whole records.
+
+    Chunks are roughly `chunk_size` bytes long. The first `skip` records
+    (the header rows) are left out, unless `start`, the offset of a record
+    boundary to begin at, is given. A chunk only ends on a line ending that
+    is not inside a quoted field; pass `quotechar=None` for files without
+    quoting such as fixed width data.
+    """
+    quote = quotechar.encode('ascii') if quotechar else None
+    with open(filename, 'rb') as data_file:
+        if start is None:
+            begin = skip_records(data_file, skip, quote)
+        else:
+            data_file.seek(start)
+            begin = start
+        while True:
+            data = data_file.read(chunk_size)
+            if not data:
+                break
+            inside = bool(quote and data.count(quote) % 2)
+            if inside or not data.endswith(b'\n'):
+                # Finish the record the chunk stopped in
+                while True:
+                    line = data_file.readline()
+                    if not line:
+                        break
+                    if quote and line.count(quote) % 2:
+                        inside = not inside
+                    if not inside:
+                        break
+            end = data_file.tell()
+            yield begin, end
+            begin = end
+
+
+def _run_chunk(method, filename, begin, end, args):
+    """Worker entry point, see Engine.load_chunk and Engine.infer_chunk."""
+    return getattr(_engine, method)(filename, begin, end, *args)
+
+
+def map_chunks(engine, filename, chunks, workers, method='load_chunk', args=()):
+    """Yield the result of an engine method for each chunk, in order.
+
+    The method is called as `method(filename, begin, end, *args)`.
+
+    At most two chunks per worker are in flight at a time so results do not
+    pile up in memory when inserting is slower than parsing.
+    """
+    global _engine
+    _engine = engine
+    if hasattr(multiprocessing, 'get_context'):
+        pool = multiprocessing.get_context('fork').Pool(workers)
+    else:
+        pool = multiprocessing.Pool(workers)
+    try:
+        pending = deque()
+        for begin, end in chunks:
+            pending.append(pool.apply_async(
+                _run_chunk, (method, filename, begin, end, args)))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+        _engine = None
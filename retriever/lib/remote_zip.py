@@ -0,0 +1,196 @@
+"""Data Retriever Remote Zip Archives
+
+This module contains the extraction of single members of zip archives on
+HTTP servers supporting range requests, without downloading the whole
+archive. The end of the archive is fetched first to read its central
+directory, then only the bytes of each requested member.
+
+"""
+from __future__ import print_function
+
+from future import standard_library
+
+standard_library.install_aliases()
+from builtins import object
+import io
+import struct
+import zipfile
+import zlib
+from bisect import bisect_right
+from hashlib import md5
+
+from retriever.lib.downloader import content_range_total, open_http
+from retriever.lib.streaming import ZIP_LOCAL_HEADER, ZipMemberReader, read_exactly
+
+BLOCK_SIZE = 1024 * 1024
+
+END_RECORD = struct.Struct('<4sHHHHIIH')
+END_SIGNATURE = b'PK\x05\x06'
+ZIP64_LOCATOR = struct.Struct('<4sIQI')
+ZIP64_LOCATOR_SIGNATURE = b'PK\x06\x07'
+ZIP64_END_RECORD = struct.Struct('<4sQHHIIQQQQ')
+ZIP64_END_SIGNATURE = b'PK\x06\x06'
+CENTRAL_HEADER = struct.Struct('<4sHHHHHHIIIHHHHHII')
+CENTRAL_SIGNATURE = b'PK\x01\x02'
+ZIP64_EXTRA_ID = 0x0001
+
+# The end record, preceded by the largest comment allowed
+TAIL_SIZE = END_RECORD.size + 0xFFFF
+
+
+class RangeNotSupported(IOError):
+    """The server does not answer range requests."""
+
+
+class RemoteMember(object):
+    """A member listed in the central directory of a remote zip archive."""
+
+    def __init__(self, name, flags, method, crc, compressed_size, offset):
+        self.name = name
+        self.flags = flags
+        self.method = method
+        self.crc = crc
+        self.compressed_size = compressed_size
+        self.offset = offset
+
+
+def open_range(url, start, end=None, pool=None):
+    """Request a range of bytes of a url and return the response and its release.
+
+    `end` is the last byte included. A negative `start` requests the last
+    -start bytes. Raises RangeNotSupported if the server sends the whole file.
+    """
+    if start < 0:
+        byte_range = 'bytes={}'.format(start)
+    else:
+        byte_range = 'bytes={}-{}'.format(start, '' if end is None else end)
+    response, release = open_http(url, {'Range': byte_range}, pool)
+    if response.getcode() != 206:
+        release(False)
+        raise RangeNotSupported("{} does not support range requests".format(url))
+    return response, release
+
+
+def read_range(url, start, end=None, pool=None):
+    """Return a range of bytes of a url and the size of the whole file."""
+    response, release = open_range(url, start, end, pool)
+    complete = False
+    try:
+        data = response.read()
+        complete = True
+    finally:
+        release(complete)
+    return data, content_range_total(response.info().get('Content-Range'))
+
+
+class RemoteZip(object):
+    """The central directory of a zip archive read with range requests."""
+
+    def __init__(self, url, pool=None):
+        self.url = url
+        self.pool = pool
+        tail, size = read_range(url, -TAIL_SIZE, pool=pool)
+        if size is None:
+            raise RangeNotSupported("{} has no known size".format(url))
+        tail_offset = size - len(tail)
+        position = tail.rfind(END_SIGNATURE)
+        if position < 0:
+            raise zipfile.BadZipfile("{} is not a zip file".format(url))
+        (_, _, _, _, entries, directory_size, directory_offset,
+         _) = END_RECORD.unpack_from(tail, position)
+        if (entries == 0xFFFF or directory_size == 0xFFFFFFFF or
+                directory_offset == 0xFFFFFFFF):
+            locator = tail[position - ZIP64_LOCATOR.size:position]
+            signature, _, end_offset, _ = ZIP64_LOCATOR.unpack(locator)
+            if signature != ZIP64_LOCATOR_SIGNATURE:
+                raise zipfile.BadZipfile("{} has a corrupt zip64 end record".format(url))
+            record = self.read(tail, tail_offset, end_offset, ZIP64_END_RECORD.size)
+            (signature, _, _, _, _, _, _, entries, directory_size,
+             directory_offset) = ZIP64_END_RECORD.unpack(record)
+            if signature != ZIP64_END_SIGNATURE:
+                raise zipfile.BadZipfile("{} has a corrupt zip64 end record".format(url))
+        directory = self.read(tail, tail_offset, directory_offset, directory_size)
+        self.members = dict((member.name, member) for member in parse_directory(directory))
+        # A member ends where the next one, or the central directory, starts
+        self.offsets = sorted(set([member.offset for member in self.members.values()] +
+                                  [directory_offset]))
+
+    def read(self, tail, tail_offset, offset, size):
+        """Return bytes of the archive, from its tail if it holds them."""
+        if offset >= tail_offset:
+            return tail[offset - tail_offset:offset - tail_offset + size]
+        return read_range(self.url, offset, offset + size - 1, self.pool)[0]
+
+    def extract(self, name, path):
+        """Download and decompress a member to a path, returning its MD5 hash."""
+        member = self.members.get(name)
+        if member is None:
+            raise KeyError("There is no item named {} in {}".format(name, self.url))
+        if member.flags & 0x01:
+            raise IOError("{} is encrypted".format(name))
+        if member.method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise NotImplementedError("{} uses an unsupported compression method".format(name))
+        end = self.offsets[bisect_right(self.offsets, member.offset)] - 1
+        response, release = open_range(self.url, member.offset, end, self.pool)
+        complete = False
+        try:
+            stream = io.BufferedReader(response, BLOCK_SIZE)
+            header = ZIP_LOCAL_HEADER.unpack(read_exactly(stream, ZIP_LOCAL_HEADER.size))
+            read_exactly(stream, header[-2] + header[-1])
+            reader = ZipMemberReader(stream, member.method, member.compressed_size)
+            digest = md5()
+            crc = 0
+            with open(path, 'wb') as out_file:
+                for block in iter(lambda: reader.read(BLOCK_SIZE), b''):
+                    out_file.write(block)
+                    digest.update(block)
+                    crc = zlib.crc32(block, crc)
+            # Skip the data descriptor so the connection can be reused
+            stream.read()
+            complete = True
+        finally:
+            release(complete)
+        if crc & 0xFFFFFFFF != member.crc:
+            raise zipfile.BadZipfile("Bad CRC-32 for file {}".format(name))
+        return digest.hexdigest()
+
+
+def parse_directory(directory):
+    """Generate the members listed in the central directory of a zip archive."""
+    position = 0
+    while position + CENTRAL_HEADER.size <= len(directory):
+        (signature, _, _, flags, method, _, _, crc, compressed_size, size,
+         name_length, extra_length, comment_length, _, _, _,
+         offset) = CENTRAL_HEADER.unpack_from(directory, position)
+        if signature != CENTRAL_SIGNATURE:
+            break
+        position += CENTRAL_HEADER.size
+        name = directory[position:position + name_length]
+        name = name.decode('utf-8' if flags & 0x800 else 'cp437')
+        position += name_length
+        extra = directory[position:position + extra_length]
+        position += extra_length + comment_length
+        if 0xFFFFFFFF in (size, compressed_size, offset):
+            size, compressed_size, offset = zip64_values(extra, size, compressed_size, offset)
+        yield RemoteMember(name, flags, method, crc, compressed_size, offset)
+
+
+def zip64_values(extra, size, compressed_size, offset):
+    """Return the sizes and offset of a member, completed from its zip64 field.
+
+    The field only holds the values that do not fit in the central header,
+    in this order.
+    """
+    position = 0
+    while position + 4 <= len(extra):
+        field_id, field_size = struct.unpack_from('<HH', extra, position)
+        if field_id == ZIP64_EXTRA_ID:
+            values = [size, compressed_size, offset]
+            field = position + 4
+            for i, value in enumerate(values):
+                if value == 0xFFFFFFFF:
+                    values[i] = struct.unpack_from('<Q', extra, field)[0]
+                    field += 8
+            return values
+        position += 4 + field_size
+    raise zipfile.BadZipfile("Corrupt zip64 extra field")
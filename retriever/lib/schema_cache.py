@@ -0,0 +1,69 @@
+"""Data Retriever Schema Cache
+
+This module contains the cache of table definitions inferred from raw data
+files by `Engine.auto_create_table`. Each entry is a JSON file under
+HOME_DIR holding the inferred delimiter and columns, and whether an
+auto-increment primary key was added, together with the size,
+modification time and MD5 hash of the file they were inferred from, so
+entries are invalidated automatically when the file changes.
+
+"""
+import json
+import os
+from hashlib import sha1
+
+from retriever.lib.defaults import HOME_DIR
+from retriever.lib.tools import file_digest, write_json
+
+SCHEMA_CACHE_DIR = os.path.join(HOME_DIR, 'schema_cache')
+
+
+def schema_cache_path(key):
+    """Return the path of the cache entry for a key.
+
+    The key is any JSON serializable description of the inputs of the
+    inference, such as the script version and the table dialect.
+    """
+    key = json.dumps(key, sort_keys=True, default=str)
+    return os.path.join(SCHEMA_CACHE_DIR, sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+
+def load_schema(key, file_path):
+    """Return the cached delimiter, columns and contains_pk inferred from a file.
+
+    The entry is used as is when the size and modification time of the
+    file match. If only the modification time changed, for example when
+    the file was downloaded again, the content hash is compared instead.
+    Returns None when there is no valid entry.
+    """
+    entry_path = schema_cache_path(key)
+    try:
+        with open(entry_path) as entry_file:
+            entry = json.load(entry_file)
+        stat = os.stat(file_path)
+    except (IOError, OSError, ValueError):
+        return None
+    if entry.get('size') != stat.st_size or 'contains_pk' not in entry:
+        return None
+    if entry.get('mtime') != stat.st_mtime:
+        if entry.get('md5') != file_digest(file_path):
+            return None
+        entry['mtime'] = stat.st_mtime
+        write_json(entry_path, entry)
+    columns = [(name, tuple(datatype)) for name, datatype in entry['columns']]
+    return entry['delimiter'], columns, entry['contains_pk']
+
+
+def save_schema(key, file_path, delimiter, columns, contains_pk=False):
+    """Store the delimiter and columns inferred from a file."""
+    stat = os.stat(file_path)
+    entry = {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'md5': file_digest(file_path),
+        'delimiter': delimiter,
+        'columns': [[name, list(datatype)] for name, datatype in columns],
+        'contains_pk': contains_pk,
+    }
+    write_json(schema_cache_path(key), entry)
+
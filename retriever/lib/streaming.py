@@ -0,0 +1,270 @@
+"""Data Retriever Streaming Sources
+
+This module contains the readers used by `--stream` installs to load data
+straight from the network without writing raw data files to disk. The
+response of a url is read by a background thread into a bounded buffer, so
+downloading and inserting overlap, and the download waits for the database
+whenever the buffer is full instead of piling data up in memory. Members of
+remote zip, gzip and tar archives are decompressed as the archive streams
+by, in a single pass from its first byte.
+
+"""
+from __future__ import print_function
+
+from future import standard_library
+
+standard_library.install_aliases()
+import gzip
+import io
+import queue
+import struct
+import tarfile
+import threading
+import zlib
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
+
+from retriever.lib.downloader import TIMEOUT
+
+BLOCK_SIZE = 64 * 1024
+BUFFER_BLOCKS = 32
+REMOTE_SCHEMES = ('http', 'https', 'ftp')
+
+ZIP_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+ZIP_LOCAL_SIGNATURE = 0x04034b50
+ZIP_DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+ZIP64_EXTRA_ID = 0x0001
+
+
+def is_remote(path):
+    """Check if a path is the url of a file on a remote server."""
+    try:
+        return urlparse(path).scheme in REMOTE_SCHEMES
+    except (AttributeError, TypeError):
+        return False
+
+
+def open_remote(url, buffer_blocks=BUFFER_BLOCKS):
+    """Open a url for reading bytes through a bounded buffer."""
+    return io.BufferedReader(RemoteFile(url, buffer_blocks))
+
+
+def open_remote_member(filetype, url, member):
+    """Open a member of a remote archive for reading bytes as it streams."""
+    remote = open_remote(url)
+    try:
+        if filetype == 'zip':
+            member_file = open_zip_stream(remote, member)
+        elif filetype == 'gz':
+            # gzip archives can only contain a single file
+            member_file = gzip.GzipFile(fileobj=remote, mode='rb')
+        else:
+            member_file = open_tar_stream(remote, member)
+    except Exception:
+        remote.close()
+        raise
+    return io.BufferedReader(StreamReader(member_file, remote))
+
+
+def open_tar_stream(stream, member):
+    """Return a reader of a member of a tar archive read front to back."""
+    tar_file = tarfile.open(fileobj=stream, mode='r|*')
+    for info in tar_file:
+        if info.name == member and info.isfile():
+            return tar_file.extractfile(info)
+    raise KeyError("{} not found in the archive".format(member))
+
+
+def open_zip_stream(stream, member):
+    """Return a reader of a member of a zip archive read front to back.
+
+    The local headers preceding each member are read instead of the
+    central directory at the end of the archive. Members placed before the
+    one requested are decompressed and discarded.
+    """
+    while True:
+        header = read_exactly(stream, ZIP_LOCAL_HEADER.size)
+        (signature, _, flags, method, _, _, _, compressed_size, _,
+         name_length, extra_length) = ZIP_LOCAL_HEADER.unpack(header)
+        if signature != ZIP_LOCAL_SIGNATURE:
+            # The central directory follows the last member
+            raise KeyError("There is no item named {} in the archive".format(member))
+        name = read_exactly(stream, name_length).decode('utf-8' if flags & 0x800 else 'cp437')
+        extra = read_exactly(stream, extra_length)
+        zip64_size = zip64_compressed_size(extra)
+        if compressed_size == 0xFFFFFFFF:
+            compressed_size = zip64_size
+        if flags & 0x01:
+            raise IOError("{} is encrypted".format(name))
+        if flags & 0x08:
+            # The sizes are stored in a descriptor after the data
+            compressed_size = None
+        if method not in (0, 8) or (method == 0 and compressed_size is None):
+            raise IOError("{} can not be read as a stream".format(name))
+        member_file = ZipMemberReader(stream, method, compressed_size)
+        if name == member:
+            return member_file
+        while member_file.read(BLOCK_SIZE):
+            pass
+        if flags & 0x08:
+            skip_data_descriptor(stream, zip64_size is not None)
+
+
+def zip64_compressed_size(extra):
+    """Return the compressed size from the zip64 field of a header, or None."""
+    offset = 0
+    while offset + 4 <= len(extra):
+        field_id, size = struct.unpack('<HH', extra[offset:offset + 4])
+        if field_id == ZIP64_EXTRA_ID:
+            return struct.unpack('<QQ', extra[offset + 4:offset + 20])[1]
+        offset += 4 + size
+    return None
+
+
+def skip_data_descriptor(stream, zip64=False):
+    """Skip the descriptor following the data of a zip member."""
+    # The CRC and the two sizes, preceded by an optional signature
+    size = 20 if zip64 else 12
+    if stream.peek(4)[:4] == ZIP_DESCRIPTOR_SIGNATURE:
+        size += 4
+    read_exactly(stream, size)
+
+
+def read_exactly(stream, size):
+    """Read a number of bytes from a stream, failing if it ends first."""
+    data = stream.read(size)
+    if len(data) != size:
+        raise EOFError("Unexpected end of stream")
+    return data
+
+
+class RemoteFile(io.RawIOBase):
+    """A url read through a bounded buffer by a background thread.
+
+    The response is read into a queue of at most `buffer_blocks` blocks.
+    When the queue is full the thread stops reading from the connection
+    until the consumer catches up.
+    """
+
+    def __init__(self, url, buffer_blocks=BUFFER_BLOCKS):
+        self.url = url
+        self.blocks = queue.Queue(max(1, buffer_blocks))
+        self.block = memoryview(b'')
+        self.eof = False
+        self.stopped = threading.Event()
+        self.response = urlopen(Request(url), timeout=TIMEOUT)
+        self.thread = threading.Thread(target=self._fill)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not len(self.block) and not self.eof:
+            block = self.blocks.get()
+            if isinstance(block, Exception):
+                self.eof = True
+                raise block
+            self.eof = not block
+            self.block = memoryview(block)
+        size = min(len(buffer), len(self.block))
+        buffer[:size] = self.block[:size]
+        self.block = self.block[size:]
+        return size
+
+    def close(self):
+        """Stop reading the url."""
+        self.stopped.set()
+        super(RemoteFile, self).close()
+
+    def _fill(self):
+        """Read the response into the buffer until it ends or is closed."""
+        try:
+            while not self.stopped.is_set():
+                block = self.response.read(BLOCK_SIZE)
+                self._put(block)
+                if not block:
+                    break
+        except Exception as e:
+            self._put(e)
+        finally:
+            self.response.close()
+
+    def _put(self, item):
+        """Wait for room in the buffer, unless the file is closed meanwhile."""
+        while not self.stopped.is_set():
+            try:
+                self.blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+
+class ZipMemberReader(io.RawIOBase):
+    """The data of a zip member, decompressed from a stream of the archive.
+
+    Members stored with their sizes in a trailing descriptor are read until
+    the end of their deflate stream; data read past it is left in the
+    stream for the next header.
+    """
+
+    def __init__(self, stream, method, compressed_size=None):
+        self.stream = stream
+        self.remaining = compressed_size
+        self.decompressor = zlib.decompressobj(-15) if method == 8 else None
+        self.data = b''
+        self.ended = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.data and not self.finished():
+            size = BLOCK_SIZE if self.remaining is None else min(BLOCK_SIZE, self.remaining)
+            compressed = self.stream.peek(size)[:size]
+            if not compressed:
+                raise EOFError("Unexpected end of zip member")
+            if self.decompressor is None:
+                self.data = compressed
+                used = len(compressed)
+            else:
+                self.data = self.decompressor.decompress(compressed)
+                used = len(compressed) - len(self.decompressor.unused_data)
+                # Data past the end of the deflate stream is left unused;
+                # decompressobj has no eof attribute on Python 2.7
+                self.ended = bool(self.decompressor.unused_data)
+            self.stream.read(used)
+            if self.remaining is not None:
+                self.remaining -= used
+        size = min(len(buffer), len(self.data))
+        buffer[:size] = self.data[:size]
+        self.data = self.data[size:]
+        return size
+
+    def finished(self):
+        """Check if all the data of the member was read."""
+        return self.ended or self.remaining == 0
+
+
+class StreamReader(io.RawIOBase):
+    """A reader that also closes the streams it reads from."""
+
+    def __init__(self, reader, *streams):
+        self.reader = reader
+        self.streams = streams
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.reader.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.reader.close()
+            for stream in self.streams:
+                stream.close()
+        super(StreamReader, self).close()
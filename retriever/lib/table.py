@@ -247,13 +247,8 @@ class TabularDataset(Dataset):
 
     def get_column_datatypes(self):
         """Get set of column names for insert statements."""
-        columns = []
-        for item in self.get_insert_columns(False):
-            for column in self.columns:
-                if item == column[0]:
-                    columns.append(column[1][0])
-
-        return columns
+        return [column[1][0] for column in self.columns
+                if column[1][0] not in ('pk-auto', 'skip', 'combine')]
 
 
 class RasterDataset(Dataset):
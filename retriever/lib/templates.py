@@ -72,6 +72,20 @@ class Script(object):
         engine.script = self
         return engine
 
+    def url_checksum(self, url):
+        """Return the hash and size declared for the file at a url.
+
+        They are taken from the resources, i.e. tables, of JSON scripts and
+        from `Url` values of `urls`. Returns (None, None) if none are.
+        """
+        for item in list(self.urls.values()) + list(self.tables.values()):
+            if getattr(item, 'url', item) == url:
+                file_hash = getattr(item, 'hash', None)
+                size = getattr(item, 'bytes', None)
+                if file_hash or size is not None:
+                    return file_hash, size
+        return None, None
+
     def exists(self, engine=None):
         if engine:
             return engine.exists(self)
@@ -123,13 +137,20 @@ class BasicTextTemplate(Script):
                     keep_in_dir = self.keep_in_dir
                 if hasattr(self, "archivename"):
                     archivename = self.archivename
-                self.engine.download_files_from_archive(url=url,
-                                                        filenames=files,
-                                                        filetype=archive_type,
-                                                        keep_in_dir=keep_in_dir,
-                                                        archivename=archivename)
-                self.engine.auto_create_table(table_obj, filename=table_obj.path)
-                self.engine.insert_data_from_file(self.engine.format_filename(table_obj.path))
+                if keep_in_dir:
+                    self.engine.download_files_from_archive(url=url,
+                                                            filenames=files,
+                                                            filetype=archive_type,
+                                                            keep_in_dir=keep_in_dir,
+                                                            archivename=archivename)
+                    self.engine.auto_create_table(table_obj, filename=table_obj.path)
+                    self.engine.insert_data_from_file(self.engine.format_filename(table_obj.path))
+                else:
+                    # Read the table from the archive unless the engine needs it extracted
+                    file_path = self.engine.archive_member(url, table_obj.path,
+                                                           archive_type, archivename)
+                    self.engine.auto_create_table(table_obj, filename=file_path)
+                    self.engine.insert_data_from_file(file_path)
             else:
                 self.engine.auto_create_table(table_obj, url=url)
                 self.engine.insert_data_from_url(url)
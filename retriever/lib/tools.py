@@ -1,9 +1,16 @@
+from builtins import next
+from builtins import object
+from builtins import str
 import csv
 import imp
 import io
+import json
 import os
 import sys
+from hashlib import md5
 
+from retriever.lib.archives import is_member_source, open_member_text
+from retriever.lib.streaming import is_remote, open_remote
 from retriever.lib.defaults import  ENCODING
 
 
@@ -12,8 +19,17 @@ def open_fr(file_name, encoding=ENCODING, encode=True):
 
     Sets newline to Linux line endings on Windows and Python 3
     When encode=False does not set encoding on nix and Python 3 to keep as bytes
+    Members of archives are read in place (see retriever.lib.archives) and
+    urls are read as they are downloaded (see retriever.lib.streaming).
     """
-    if sys.version_info >= (3, 0, 0):
+    if is_member_source(file_name):
+        file_obj = open_member_text(file_name, encoding=encoding if encode else None,
+                                    newline='' if os.name == 'nt' else None)
+    elif is_remote(file_name):
+        file_obj = io.TextIOWrapper(open_remote(file_name),
+                                    encoding=encoding if encode else None,
+                                    newline='' if os.name == 'nt' else None)
+    elif sys.version_info >= (3, 0, 0):
         if os.name == 'nt':
             file_obj = io.open(file_name, 'r', newline='', encoding=encoding)
         else:
@@ -54,8 +70,86 @@ def open_csvw(csv_file, encode=True):
     return csv_writer
 
 
+def file_digest(file_path, block_size=1024 * 1024):
+    """Return the MD5 hash of the content of a file."""
+    digest = md5()
+    with open(file_path, 'rb') as data_file:
+        for block in iter(lambda: data_file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_json(file_name, data):
+    """Write data to a JSON file, replacing the file only once written.
+
+    Creates the directory if needed. Failures are ignored as this is used
+    for caches and checkpoints that can be rebuilt.
+    """
+    try:
+        directory = os.path.dirname(file_name)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        temp_name = file_name + '.%d.tmp' % os.getpid()
+        with open(temp_name, 'w') as json_file:
+            json.dump(data, json_file)
+        if hasattr(os, 'replace'):
+            os.replace(temp_name, file_name)
+        else:
+            # Python 2.7 only renames over an existing file on POSIX
+            if os.name == 'nt' and os.path.exists(file_name):
+                os.remove(file_name)
+            os.rename(temp_name, file_name)
+    except (IOError, OSError):
+        pass
+
+
 def to_str(object, object_encoding=sys.stdout):
     if sys.version_info >= (3, 0, 0):
         enc = object_encoding.encoding
         return str(object).encode(enc, errors='backslashreplace').decode("latin-1")
-    return object   
\ No newline at end of file
+    return object
+
+
+def csv_field(value):
+    """Format a value as a CSV field for "COPY ... WITH CSV".
+
+    None is written as an unquoted empty field, which COPY reads as NULL,
+    and an empty string as a quoted one, which COPY keeps as ''.
+    """
+    if value is None:
+        return u''
+    value = str(value)
+    if not value or value == u'\\.' or any(char in value for char in u',"\r\n'):
+        return u'"' + value.replace(u'"', u'""') + u'"'
+    return value
+
+
+class CSVRowStream(object):
+    """Read-only file-like object returning rows formatted as CSV text.
+
+    Rows are only formatted as they are read, so a generator of rows can be
+    streamed into a database's bulk loader (e.g. PostgreSQL's
+    "COPY ... FROM STDIN WITH CSV") without writing a file first. Fields
+    are written by `csv_field`, so NULLs and empty strings stay distinct.
+    """
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = io.StringIO()
+
+    def read(self, size=-1):
+        """Return up to `size` characters, or everything left if size < 0."""
+        while size < 0 or self.buffer.tell() < size:
+            try:
+                row = next(self.rows)
+            except StopIteration:
+                break
+            self.buffer.write(u','.join(csv_field(value) for value in row) + u'\n')
+        data = self.buffer.getvalue()
+        rest = u''
+        if 0 <= size < len(data):
+            data, rest = data[:size], data[size:]
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.buffer.write(rest)
+        return data
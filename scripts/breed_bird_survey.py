@@ -35,7 +35,7 @@ class main(Script):
         self.ref = "http://www.pwrc.usgs.gov/BBS/"
         self.keywords = ["birds", "continental-scale"]
         self.retriever_minimum_version = '2.0.dev'
-        self.version = '1.4.2'
+        self.version = '1.5.0'
         self.urls = {
                      "counts": "ftp://ftpext.usgs.gov/pub/er/md/laurel/BBS/DataFiles/States/",
                      "routes": "ftp://ftpext.usgs.gov/pub/er/md/laurel/BBS/DataFiles/Routes.zip",
@@ -176,6 +176,11 @@ class main(Script):
             engine.table = table
             engine.create_table()
 
+            shortstates = [state[0:7] if len(state) > 2 else state[1] for state in stateslist]
+            engine.download_files([self.urls["counts"] + shortstate + ".zip"
+                                   for shortstate in shortstates
+                                   if not engine.find_file(shortstate + ".csv")])
+
             for state in stateslist:
                 try:
                     if len(state) > 2:
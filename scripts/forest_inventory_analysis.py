@@ -27,7 +27,7 @@ class main(Script):
         self.title = "Forest Inventory and Analysis"
         self.name = "forest-inventory-analysis"
         self.retriever_minimum_version = '2.0.dev'
-        self.version = '1.4.2'
+        self.version = '1.5.0'
         self.ref = "http://fia.fs.fed.us/"
         self.urls = {"main": "https://apps.fs.usda.gov/fia/datamart/CSV/",
                      'species': 'https://apps.fs.usda.gov/fia/datamart/CSV/REF_SPECIES.csv'}
@@ -67,6 +67,9 @@ class main(Script):
 
         tablelist = ["SURVEY", "PLOT", "COND", "SUBPLOT", "SUBP_COND", "TREE", "SEEDLING"]
 
+        engine.download_files([self.urls["main"] + state + "_" + table + ".ZIP"
+                               for table in tablelist for state, year in stateslist
+                               if not engine.find_file(state + "_" + table + ".csv")])
         for table in tablelist:
             for state, year in stateslist:
                 engine.download_files_from_archive(self.urls["main"] + state + "_" + table + ".ZIP",
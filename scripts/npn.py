@@ -31,7 +31,7 @@ class main(Script):
         self.title = "USA National Phenology Network"
         self.name = "NPN"
         self.retriever_minimum_version = '2.0.dev'
-        self.version = '2.1.2'
+        self.version = '2.2.0'
         self.ref = "http://www.usanpn.org/results/data"
         self.keywords = ["Data Type > Phenology", "Spatial Scale > Continental"]
         self.description = "The data set was collected via Nature's Notebook phenology observation program (2009-present), and (2) Lilac and honeysuckle data (1955-present)"
@@ -99,6 +99,7 @@ class main(Script):
         start_date = datetime.date(2009, 1, 1)
         end_date = datetime.date.today()
 
+        windows = []
         while start_date < end_date:
             to_date = start_date + datetime.timedelta(90)
             if to_date >= end_date:
@@ -107,7 +108,12 @@ class main(Script):
             else:
                 data_url = base_url.format(startYear=str(start_date), endYear_date=str(to_date),
                                            request_src=request_src)
+            windows.append((data_url, start_date))
+            start_date = to_date + datetime.timedelta(1)
 
+        engine.download_files([(data_url, '{}'.format(start_date) + ".xml")
+                               for data_url, start_date in windows])
+        for data_url, start_date in windows:
             xml_file_name = '{}'.format(start_date) + ".xml"
             engine.download_file(data_url, xml_file_name)
 
@@ -133,7 +139,6 @@ class main(Script):
                 csv_writer.writerow([x[1] for x in diction])
 
             csv_buff.close()
-            start_date = to_date + datetime.timedelta(1)
 
         # Create table
         table = Table('obsercations', delimiter=',', pk='record_id', contains_pk=True)
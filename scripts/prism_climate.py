@@ -19,7 +19,7 @@ class main(Script):
         self.title = "PRISM Climate Data"
         self.name = "prism-climate"
         self.retriever_minimum_version = '2.0.dev'
-        self.version = '1.2.1'
+        self.version = '1.3.0'
         self.ref = "http://prism.oregonstate.edu/"
         self.urls = {"climate": "http://services.nacse.org/prism/data/public/4km/"}
         self.description = "The PRISM data set represents climate observations from a wide range of monitoring networks, applies sophisticated quality control measures, and develops spatial climate datasets to reveal short- and long-term climate patterns. "
@@ -52,6 +52,7 @@ class main(Script):
         clim_vars = ['ppt', 'tmax', 'tmean', 'tmin']
         years = list(range(1981, 2015))
         months = ["{:02d}".format(i) for i in range(1,13)]
+        archives = []
         for clim_var in clim_vars:
             mval = "M3" if clim_var == 'ppt' else "M2"
             for year in years:
@@ -59,7 +60,11 @@ class main(Script):
                     file_names = self.get_file_names(clim_var, mval, year, month)
                     file_url = urllib.parse.urljoin(self.urls["climate"], "{}/{}{}".format(clim_var, year, month))
                     archivename = "PRISM_{}_stable_4km{}_{}{}_bil.zip".format(clim_var, mval, year, month)
-                    self.engine.download_files_from_archive(file_url, file_names, archivename=archivename, keep_in_dir=True)
-                    self.engine.register_files(file_names)
+                    archives.append((file_url, file_names, archivename))
+
+        self.engine.download_files([(file_url, archivename) for file_url, _, archivename in archives])
+        for file_url, file_names, archivename in archives:
+            self.engine.download_files_from_archive(file_url, file_names, archivename=archivename, keep_in_dir=True)
+            self.engine.register_files(file_names)
 
 SCRIPT = main()
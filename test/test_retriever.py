@@ -3,10 +3,19 @@
 from future import standard_library
 
 standard_library.install_aliases()
+import gzip
+import hashlib
+import io
 import os
 import sys
 import shutil
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
 from imp import reload
+import pytest
 from retriever.lib.defaults import ENCODING
 
 encoding = ENCODING.lower()
@@ -17,8 +26,24 @@ if hasattr(sys, 'setdefaultencoding'):
 from retriever.lib.engine import Engine
 from retriever.lib.table import TabularDataset
 from retriever.lib.templates import BasicTextTemplate
+from retriever.lib.archives import ArchiveSession, member_source, open_member, source_path
+from retriever.lib.batching import BatchSizer, CommitPolicy, statement_pages
+from retriever.lib.binary_copy import BinaryRowStream, column_encoders
+from retriever.lib.blob_store import add_blob, blob_path, list_blobs, pin_blob, prune_blobs, remove_blob
+from retriever.lib.cache_manifest import load_entry, manifest_path
+from retriever.lib.checkpoint import (load_checkpoint, new_checkpoint, remove_checkpoint,
+                                      save_checkpoint, source_fingerprint)
+from retriever.lib.checksums import Url
 from retriever.lib.cleanup import correct_invalid_value
+from retriever.lib.converters import column_converter
+from retriever.lib.downloader import ConnectionPool, DownloadManager, fetch_url
 from retriever.lib.engine_tools import getmd5
+from retriever.lib.load_plan import TableLoadPlan
+from retriever.lib.parallel import map_chunks, record_chunks
+from retriever.lib.remote_zip import RemoteZip
+from retriever.lib.schema_cache import load_schema, save_schema, schema_cache_path
+from retriever.lib.streaming import ZipMemberReader
+from retriever.lib.tools import CSVRowStream, file_digest
 from retriever.lib.engine_tools import xml2csv
 from retriever.lib.engine_tools import json2csv
 from retriever.lib.engine_tools import sort_file
@@ -26,6 +51,7 @@ from retriever.lib.engine_tools import sort_csv
 from retriever.lib.engine_tools import create_file
 from retriever.lib.engine_tools import file_2list
 from retriever.lib.datapackage import clean_input, is_empty
+from retriever.lib.dummy import DummyConnection, DummyCursor
 from retriever.lib.cleanup import Cleanup
 
 
@@ -73,6 +99,80 @@ def test_auto_get_datatypes():
            [101, 102, 104]
 
 
+def test_auto_get_datatypes_sample():
+    """Test that batch validation of sampled types promotes columns."""
+    engine = Engine()
+    engine.table = TabularDataset(name="test")
+    engine.infer_sample_size = 2
+    engine.auto_get_datatypes(None,
+                              [['1', '1', 'a'], ['2', '', 'b'],
+                               ['3', '1.5', 'ccc'], ['4', '0.123456789012', '']],
+                              [['a', None], ['b', None], ['c', None]],
+                              {'a': [], 'b': [], 'c': []})
+    assert [column[1] for column in engine.table.columns] == \
+           [('int',), ('decimal', '50,30'), ('char', 103)]
+
+
+def test_auto_get_datatypes_parallel():
+    """Test that types detected for chunks of a file are merged."""
+    engine = Engine()
+    engine.table = TabularDataset(name="test", delimiter=",")
+    engine.parallel_workers = 2
+    engine.parallel_chunk_size = 8
+    data_file = create_file(['a,b,c', '1,2,x', '2,2.5,y', '3,3,"z\nz"', '4,4,w'])
+    engine.auto_get_datatypes(None, [], [['a', None], ['b', None], ['c', None]],
+                              {'a': [], 'b': [], 'c': []}, data_file)
+    assert [column[1] for column in engine.table.columns] == \
+           [('int',), ('double',), ('char', 103)]
+
+
+def test_load_data_archive_member():
+    """Test that data files are read from archives without extracting them."""
+    data_file = create_file(['a,b', '1,"x,y"', '2,z'], 'member.csv')
+    with zipfile.ZipFile('members.zip', 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.write(data_file, 'data/member.csv')
+    with tarfile.open('members.tar', 'w') as archive:
+        archive.add(data_file, 'member.csv')
+    zip_source = member_source('members.zip', 'data/member.csv', 'zip')
+    tar_source = member_source('members.tar', 'member.csv', 'tar')
+    assert source_path(zip_source) == os.path.abspath('members.zip')
+    for source in (zip_source, tar_source):
+        engine = Engine()
+        engine.table = TabularDataset(name="member")
+        assert list(engine.load_data(source)) == [['a', 'b'], ['1', 'x,y'], ['2', 'z']]
+        assert engine.table.delimiter == ','
+    member_file = open_member(tar_source)
+    tar_file = member_file.raw.streams[0]
+    assert member_file.read() == b'a,b\n1,"x,y"\n2,z\n'
+    member_file.close()
+    assert tar_file.closed
+    for path in (data_file, 'members.zip', 'members.tar'):
+        os.remove(path)
+
+
+def test_archive_session():
+    """Test that members are extracted from an archive opened once."""
+    names = ['member%d.csv' % i for i in range(5)]
+    for i, name in enumerate(names):
+        create_file(['a,b'] + ['%d,%d' % (i, j) for j in range(100)], name)
+    with zipfile.ZipFile('session.zip', 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name in names:
+            archive.write(name)
+    with tarfile.open('session.tar.gz', 'w:gz') as archive:
+        for name in names:
+            archive.add(name)
+    digests = [file_digest(name) for name in names]
+    for archive, filetype in (('session.zip', 'zip'), ('session.tar.gz', 'tar')):
+        paths = ['extracted_' + name for name in names[::-1]]
+        with ArchiveSession(archive, filetype, verify=True, workers=3) as session:
+            assert session.extract(names[::-1], paths) == digests[::-1]
+        assert [file_digest(path) for path in paths] == digests[::-1]
+        for path in paths:
+            os.remove(path)
+    for path in names + ['session.zip', 'session.tar.gz']:
+        os.remove(path)
+
+
 def test_auto_get_columns_extra_whitespace():
     """Test getting column labels from header with extra whitespace."""
     test_engine.table.delimiter = ","
@@ -127,6 +227,25 @@ def test_correct_invalid_value_exception():
     assert correct_invalid_value(-999, {}) == -999
 
 
+def test_column_converter_int():
+    """Test converting a column of integers with missing and bad values."""
+    errors = {}
+    convert = column_converter('int')
+    assert convert(['1', ' 2', '3'], errors) == [1, 2, 3]
+    assert convert(['1', '2.7', '"3"', 'NULL', '', None, 'x'], errors) == \
+           [1, 2, 3, None, None, None, None]
+    assert list(errors) == [6]
+
+
+def test_column_converter_double():
+    """Test converting a column of doubles matches format_insert_value."""
+    values = ['1.5', "'2.5'", 'none', 'abc', None]
+    errors = {}
+    assert column_converter('double')(values, errors) == \
+           [test_engine.format_insert_value(value, 'double') for value in values]
+    assert errors == {}
+
+
 def test_create_db_statement():
     """Test creating the create database SQL statement."""
     assert test_engine.create_db_statement() == 'CREATE DATABASE test_abc'
@@ -205,6 +324,714 @@ def test_format_insert_value_string_complex():
     assert test_engine.format_insert_value(test_str, 'char') == test_str
 
 
+def test_get_progress():
+    """Test that progress is read from the byte offset of the data file."""
+    test_engine.table.delimiter = ","
+    test_engine.table.fixed_width = False
+    data_file = create_file(['a,b,c', '1,2,3', '4,5,6'])
+    rows = list(test_engine.load_data(data_file))
+    assert rows[-1] == ['4', '5', '6']
+    assert test_engine.get_progress() == 100
+
+
+def test_load_plan_values_from_line():
+    """Test projection of raw values onto skip and combine columns."""
+    table = TabularDataset(name="test", columns=[("a", ("int",)),
+                                                 ("b", ("skip",)),
+                                                 ("c", ("char", 20)),
+                                                 ("d", ("combine",)),
+                                                 ("e", ("int",))])
+    plan = TableLoadPlan(test_engine, table)
+    assert plan.values_from_line(['1', 'x', 'ab', 'cd', '2']) == ['1', 'ab cd', '2']
+    assert plan.values_from_line(['1', 'x', 'ab']) == ['1', 'ab', None]
+
+
+def test_load_plan_insert_statement():
+    """Test that the insert statement is compiled once for the table."""
+    engine = Engine()
+    engine.placeholder = "?"
+    engine.opts = {'database_name': 'db', 'table_name': '{db}_{table}'}
+    engine.table = TabularDataset(name="test", columns=[("record_id", ("pk-auto",)),
+                                                        ("a", ("int",)),
+                                                        ("b", ("char", 20))])
+    plan = engine.get_load_plan()
+    assert plan.insert_stmt == "INSERT INTO db_test (a, b) VALUES (?, ?)"
+    assert plan.header == ['record_id', 'a', 'b']
+    assert engine.get_load_plan() is plan
+
+
+def test_load_plan_unpivot():
+    """Test that cross-tab lines are unpivoted into long format rows."""
+    table = TabularDataset(name="test", columns=[("record_id", ("pk-auto",)),
+                                                 ("site", ("char", 10)),
+                                                 ("species", ("char", 10)),
+                                                 ("count", ("ct-int",))],
+                           ct_names=['x', 'y'])
+    plan = TableLoadPlan(test_engine, table)
+    assert plan.crosstab
+    assert list(plan.unpivot([['s1', '1', '2'], ['s2', '3', '']])) == \
+           [('s1', 'x', '1'), ('s1', 'y', '2'), ('s2', 'x', '3'), ('s2', 'y', '')]
+
+
+def test_csv_row_stream():
+    """Test that rows are streamed as CSV text in pieces of any size."""
+    stream = CSVRowStream([(1, 'a,b', None), ('x"y', 2.5, '')] * 3)
+    pieces = iter(lambda: stream.read(5), '')
+    assert ''.join(pieces) == '1,"a,b",\n"x""y",2.5,""\n' * 3
+
+
+def test_postgres_copy_from_stdin():
+    """Test that cleaned tables are streamed to PostgreSQL as converted CSV rows."""
+    from retriever.engines.postgres import engine as Postgres
+    copied = []
+
+    class CopyCursor(DummyCursor):
+        def copy_expert(self, statement, data_file):
+            copied.append((statement, data_file.read()))
+
+    engine = Postgres()
+    engine.script = test_engine.script
+    engine.opts = {'database_name': 'db', 'table_name': '{db}_{table}'}
+    engine._connection = DummyConnection()
+    engine._cursor = CopyCursor()
+    engine.table = TabularDataset(name="copy", delimiter=";", header_rows=2,
+                                  cleanup=Cleanup(correct_invalid_value, missingValues=['-999']),
+                                  columns=[("record_id", ("pk-auto",)),
+                                           ("a", ("int",)),
+                                           ("b", ("bool",))])
+    data_file = create_file(['a;b', 'units;flag', '1;1', '-999;0', '3;1'])
+    engine.insert_data_from_file(data_file)
+    assert copied == [("COPY db_copy (a, b) FROM STDIN WITH CSV",
+                       '1,TRUE\n,FALSE\n3,TRUE\n')]
+    assert engine.table.record_id == 3
+
+
+def test_postgres_parallel_copy():
+    """Test that a large file is copied over several connections and merged at once."""
+    from retriever.engines.postgres import engine as Postgres
+    copied = []
+    executed = []
+    connections = []
+
+    class CopyCursor(DummyCursor):
+        def execute(self, statement):
+            executed.append(statement)
+
+        def copy_expert(self, statement, data_file):
+            data = data_file.read()
+            if b'fail' in data:
+                raise IOError("bad chunk")
+            copied.append((statement.split()[1], data))
+
+    class CopyConnection(DummyConnection):
+        def __init__(self):
+            self.closed = []
+            connections.append(self)
+
+        def cursor(self):
+            return CopyCursor()
+
+        def commit(self):
+            self.closed.append('commit')
+
+        def rollback(self):
+            self.closed.append('rollback')
+
+    engine = Postgres()
+    engine.script = test_engine.script
+    engine.opts = {'database_name': 'db', 'table_name': '{db}_{table}'}
+    engine._connection = DummyConnection()
+    engine._cursor = CopyCursor()
+    engine.get_connection = CopyConnection
+    engine.copy_workers = 3
+    engine.parallel_chunk_size = 16
+    engine.table = TabularDataset(name="parallel", delimiter=",", columns=[("a", ("int",))])
+    stages = ['db_parallel_copy0', 'db_parallel_copy1', 'db_parallel_copy2']
+    lines = [str(i) for i in range(40)]
+    engine.insert_data_from_file(create_file(['a'] + lines))
+    assert sorted(b''.join(data for _, data in copied).split()) == \
+           sorted(line.encode() for line in lines)
+    assert len(copied) > 3
+    assert set(stage for stage, _ in copied) <= set(stages)
+    assert [connection.closed for connection in connections] == [['commit']] * 3
+    assert ("INSERT INTO db_parallel (a) SELECT a FROM db_parallel_copy0 UNION ALL "
+            "SELECT a FROM db_parallel_copy1 UNION ALL SELECT a FROM db_parallel_copy2") in executed
+    assert executed[-3:] == ["DROP TABLE IF EXISTS " + stage + " CASCADE;" for stage in stages]
+
+    del connections[:]
+    del executed[:]
+    inserted = []
+    engine.insert_batch = inserted.extend
+    engine.insert_data_from_file(create_file(['a'] + lines + ['fail']))
+    assert [connection.closed for connection in connections] == [['rollback']] * 3
+    assert not [statement for statement in executed if statement.startswith("INSERT")]
+    assert len(inserted) == 40
+
+    # Errors of the parsing processes also fall back to one connection
+    del connections[:]
+    del executed[:]
+    fallback = []
+
+    def load_chunk(filename, begin, end):
+        raise ValueError("bad chunk")
+
+    engine.load_chunk = load_chunk
+    engine.add_to_table_in_chunks = fallback.append
+    engine.parallel_workers = 2
+    engine.table.cleanup = Cleanup(correct_invalid_value, missingValues=['-999'])
+    data_file = create_file(['a'] + lines)
+    engine.insert_data_from_file(data_file)
+    assert fallback == [data_file]
+    assert not [statement for statement in executed if statement.startswith("INSERT")]
+
+
+def test_binary_row_stream():
+    """Test that typed rows are encoded in PostgreSQL's binary COPY format."""
+    encoders = column_encoders(["integer", "double precision", "boolean", "varchar"], "utf-8")
+    stream = BinaryRowStream([[1, 0.5, "TRUE", u'\xe9'], [None, None, "FALSE", None]], encoders)
+    pieces = iter(lambda: stream.read(7), b'')
+    assert b''.join(pieces) == (
+        b'PGCOPY\n\xff\r\n\x00' + b'\x00' * 8 +
+        b'\x00\x04' + b'\x00\x00\x00\x04\x00\x00\x00\x01' +
+        b'\x00\x00\x00\x08?\xe0\x00\x00\x00\x00\x00\x00' +
+        b'\x00\x00\x00\x01\x01' + b'\x00\x00\x00\x02\xc3\xa9' +
+        b'\x00\x04' + b'\xff\xff\xff\xff' * 2 + b'\x00\x00\x00\x01\x00' +
+        b'\xff\xff\xff\xff' + b'\xff\xff')
+    assert column_encoders(["integer", "decimal"], "utf-8") is None
+    with pytest.raises(ValueError):
+        BinaryRowStream([[1, 0.5, "no", None]], encoders).read()
+
+
+def test_batch_sizer():
+    """Test that batch sizes follow throughput within the memory bounds."""
+    sizer = BatchSizer(1000, max_bytes=100000)
+    sizer.record(1000, 10000, 1.0)
+    assert sizer.size == 2000
+    sizer.record(2000, 20000, 1.0)
+    assert sizer.size == 4000
+    sizer.record(4000, 40000, 4.0)
+    assert sizer.size == 2000
+    sizer.record(2000, 20000, 0.1)
+    assert sizer.size == 1000
+    sizer = BatchSizer(1000, max_bytes=100000)
+    sizer.record(1000, 80000, 0.5)
+    assert sizer.size == 1250
+    assert BatchSizer(1000, rows=50).size == 50
+    sizer = BatchSizer(1000, batch_bytes=5000)
+    sizer.record(1000, 10000, 1.0)
+    assert sizer.size == 500
+
+
+def test_commit_policy():
+    """Test that commits are due once any limit is reached."""
+    policy = CommitPolicy(rows=100, nbytes=1000)
+    policy.add(50, 500)
+    assert not policy.due()
+    policy.add(50, 10)
+    assert policy.due()
+    policy.commit(DummyConnection())
+    assert not policy.due() and len(policy.latencies) == 1
+    policy.add(1, 2000)
+    assert policy.due()
+    assert not CommitPolicy().limited()
+
+
+def test_download_manager():
+    """Test that background downloads respect the per host limit."""
+    lock = threading.Lock()
+    running = {}
+    peaks = {}
+    fetched = []
+
+    def fetch(url, path):
+        host = url.split('/')[2]
+        with lock:
+            running[host] = running.get(host, 0) + 1
+            peaks[host] = max(peaks.get(host, 0), running[host])
+        time.sleep(0.01)
+        with lock:
+            running[host] -= 1
+            fetched.append(path)
+
+    manager = DownloadManager(fetch, workers=4, per_host=2)
+    for i in range(8):
+        manager.submit('http://a.org/%d' % i, 'a%d' % i)
+        manager.submit('http://b.org/%d' % i, 'b%d' % i)
+    assert manager.wait('a7') and manager.wait('b7')
+    assert not manager.wait('c0')
+    manager.close()
+    assert sorted(fetched) == sorted(['a%d' % i for i in range(8)] + ['b%d' % i for i in range(8)])
+    assert max(peaks.values()) <= 2
+
+
+def test_download_manager_failure():
+    """Test that a failed download can be submitted again."""
+    attempts = []
+
+    def fetch(url, path):
+        attempts.append(path)
+        if len(attempts) == 1:
+            raise IOError("connection reset")
+        return True
+
+    manager = DownloadManager(fetch)
+    with pytest.raises(IOError):
+        manager.submit('http://a.org/0', 'a0').wait()
+    assert not manager.submitted('a0')
+    assert manager.submit('http://a.org/0', 'a0').wait()
+    assert manager.wait('a0').result
+    manager.close()
+    assert attempts == ['a0', 'a0']
+
+
+def test_fetch_url_resume():
+    """Test that an interrupted download is resumed with a Range request."""
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    data = b''.join(b'%d\n' % i for i in range(20000))
+    ranges = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            ranges.append(self.headers.get('Range'))
+            if len(ranges) == 1:
+                # Drop the connection half way through the first response
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data[:len(data) // 2])
+                self.close_connection = True
+                return
+            start = int(ranges[-1][len('bytes='):-1])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(data) - 1, len(data)))
+            self.send_header('Content-Length', str(len(data) - start))
+            self.end_headers()
+            self.wfile.write(data[start:])
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    path = os.path.join(os.getcwd(), 'fetch_url_resume.txt')
+    try:
+        fetch_url('http://127.0.0.1:%d/data.txt' % server.server_address[1], path, backoff=0)
+    finally:
+        server.shutdown()
+        server.server_close()
+    with open(path, 'rb') as fetched:
+        assert fetched.read() == data
+    os.remove(path)
+    assert ranges[0] is None and ranges[1].startswith('bytes=')
+    assert not os.path.exists(path + '.part')
+
+
+def test_fetch_url_resume_part_file():
+    """Test that a .part file left by an earlier run is resumed with a report hook."""
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    import retriever.lib.engine as engine_module
+    data = b''.join(b'%d\n' % i for i in range(20000))
+    ranges = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            ranges.append(self.headers.get('Range'))
+            start = int(ranges[-1][len('bytes='):-1])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(data) - 1, len(data)))
+            self.send_header('Content-Length', str(len(data) - start))
+            self.end_headers()
+            self.wfile.write(data[start:])
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    path = os.path.join(os.getcwd(), 'fetch_url_resume_part.txt')
+    with open(path + '.part', 'wb') as part:
+        part.write(data[:len(data) // 2])
+    # A new run has not started the progress clock yet
+    vars(engine_module).pop('start_time', None)
+    try:
+        fetch_url('http://127.0.0.1:%d/data.txt' % server.server_address[1], path,
+                  reporthook=engine_module.reporthook, retries=0)
+    finally:
+        server.shutdown()
+        server.server_close()
+    with open(path, 'rb') as fetched:
+        assert fetched.read() == data
+    os.remove(path)
+    assert ranges == ['bytes=%d-' % (len(data) // 2)]
+
+
+def test_connection_pool():
+    """Test that downloads from one host reuse a kept alive connection."""
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    ports = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            ports.append(self.client_address[1])
+            if self.path == '/moved':
+                self.send_response(301)
+                self.send_header('Location', '/file0')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = self.path.encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    url = 'http://127.0.0.1:%d/' % server.server_address[1]
+    pool = ConnectionPool()
+    paths = [os.path.join(os.getcwd(), 'pooled%d.txt' % i) for i in range(4)]
+    try:
+        for i, name in enumerate(['file0', 'file1', 'file2', 'moved']):
+            fetch_url(url + name, paths[i], pool=pool)
+    finally:
+        pool.close()
+        server.shutdown()
+        server.server_close()
+    contents = []
+    for path in paths:
+        with open(path, 'rb') as fetched:
+            contents.append(fetched.read())
+        os.remove(path)
+    assert contents == [b'/file0', b'/file1', b'/file2', b'/file0']
+    assert len(ports) == 5 and len(set(ports)) == 1
+
+
+def test_fetch_file_revalidate():
+    """Test that revalidation downloads a cached file only if it changed."""
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    served = {'etag': '"v1"', 'data': b'a,b\n1,2\n'}
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append(self.headers.get('If-None-Match'))
+            if self.headers.get('If-None-Match') == served['etag']:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', served['etag'])
+            self.send_header('Content-Length', str(len(served['data'])))
+            self.end_headers()
+            self.wfile.write(served['data'])
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    url = 'http://127.0.0.1:%d/data.csv' % server.server_address[1]
+    path = os.path.join(os.getcwd(), 'fetch_file_revalidate.csv')
+    engine = Engine()
+    engine.revalidate = True
+    try:
+        assert engine.fetch_file(url, path)
+        assert load_entry(path)['etag'] == '"v1"'
+        assert not engine.fetch_file(url, path)
+        served.update({'etag': '"v2"', 'data': b'a,b\n3,4\n'})
+        assert engine.fetch_file(url, path)
+    finally:
+        server.shutdown()
+        server.server_close()
+    with open(path, 'rb') as fetched:
+        assert fetched.read() == b'a,b\n3,4\n'
+    assert requests == [None, '"v1"', '"v1"']
+    remove_blob(load_entry(path)['md5'])
+    assert not os.path.exists(path)
+
+
+def test_fetch_file_checksum():
+    """Test that downloads are verified against declared checksums."""
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    data = b'a,b\n1,2\n'
+    responses = [b'a,b\n1,3\n', data]
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = responses.pop(0) if responses else data
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    url = 'http://127.0.0.1:%d/data.csv' % server.server_address[1]
+    path = os.path.join(os.getcwd(), 'fetch_file_checksum.csv')
+    engine = Engine()
+    engine.script = BasicTextTemplate(
+        name="checksum", urls={"data": Url(url, hash="sha256:" + hashlib.sha256(data).hexdigest())})
+    try:
+        fetch_url(url, path, backoff=0, checksum=engine.get_checksum(url))
+        assert not responses
+        assert engine.fetch_file(url, path)
+    finally:
+        server.shutdown()
+        server.server_close()
+    with open(path, 'rb') as fetched:
+        assert fetched.read() == data
+    assert load_entry(path)['verified'] == engine.get_checksum(url).declaration()
+    assert engine.verify_cached_file(url, path)
+    engine.script.urls["data"] = Url(url, bytes=len(data) + 1)
+    assert not engine.verify_cached_file(url, path)
+    remove_blob(load_entry(path)['md5'])
+
+
+def test_fetch_archive_members():
+    """Test that zip members are fetched with range requests when supported."""
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    members = dict(('member%d.csv' % i, b''.join(b'%d,%d\n' % (i, j) for j in range(2000)))
+                   for i in range(3))
+    zip_data = io.BytesIO()
+    with zipfile.ZipFile(zip_data, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('padding.bin', os.urandom(200000))
+        for name, data in sorted(members.items()):
+            archive.writestr(name, data)
+    zip_data = zip_data.getvalue()
+    served = {'ranges': True, 'bytes': 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            byte_range = self.headers.get('Range')
+            if served['ranges'] and byte_range:
+                start, end = byte_range[len('bytes='):].split('-')
+                if not start:
+                    start, end = max(0, len(zip_data) - int(end)), ''
+                start, end = int(start), int(end or len(zip_data) - 1)
+                body = zip_data[start:end + 1]
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(zip_data)))
+            else:
+                body = zip_data
+                self.send_response(200)
+            served['bytes'] += len(body)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    url = 'http://127.0.0.1:%d/members.zip' % server.server_address[1]
+    engine = Engine()
+    engine.script = BasicTextTemplate(name="members")
+    names = ['member2.csv', 'member0.csv']
+    try:
+        engine.download_files_from_archive(url, names)
+        assert served['bytes'] < len(zip_data) // 2
+        assert not engine.find_file('members.zip')
+        for name in names:
+            with open(engine.find_file(name), 'rb') as member_file:
+                assert member_file.read() == members[name]
+            remove_blob(load_entry(engine.find_file(name))['md5'])
+        served['ranges'] = False
+        engine.download_files_from_archive(url, names[:1])
+        assert engine.find_file('members.zip')
+    finally:
+        engine.stop_downloads()
+        server.shutdown()
+        server.server_close()
+    for name in ('members.zip', 'member2.csv'):
+        remove_blob(load_entry(engine.find_file(name))['md5'])
+    shutil.rmtree(engine.format_data_dir())
+
+
+def test_stream_remote_sources():
+    """Test that urls and members of remote archives are read as streams."""
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    data = b'a,b\n' + b''.join(b'%d,x%d\n' % (i, i) for i in range(5000))
+    zip_data = io.BytesIO()
+    with zipfile.ZipFile(zip_data, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('skipped.csv', b'c\n' * 1000)
+        archive.writestr('data.csv', data)
+    gz_data = io.BytesIO()
+    with gzip.GzipFile(fileobj=gz_data, mode='wb') as gz_file:
+        gz_file.write(data)
+    served = {'/data.csv': data, '/data.zip': zip_data.getvalue(),
+              '/data.csv.gz': gz_data.getvalue()}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(served[self.path])))
+            self.end_headers()
+            self.wfile.write(served[self.path])
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    url = 'http://127.0.0.1:%d/' % server.server_address[1]
+    expected = [['a', 'b']] + [[str(i), 'x%d' % i] for i in range(5000)]
+    try:
+        for source in (url + 'data.csv', member_source(url + 'data.zip', 'data.csv'),
+                       member_source(url + 'data.csv.gz', 'data.csv', 'gz')):
+            engine = Engine()
+            engine.table = TabularDataset(name="stream")
+            assert list(engine.load_data(source)) == expected
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_zip_member_reader_descriptor():
+    """Test that a deflated member of unknown size is read up to the end of its stream."""
+    data = b''.join(b'%d,x%d\n' % (i, i) for i in range(5000))
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    descriptor = b'PK\x07\x08' + b'\x00' * 12
+    # The deflate stream ends inside a block, and at the end of one
+    for buffer_size in (8192, len(compressed)):
+        stream = io.BufferedReader(io.BytesIO(compressed + descriptor), buffer_size)
+        reader = ZipMemberReader(stream, zipfile.ZIP_DEFLATED)
+        assert reader.read() == data
+        assert stream.read() == descriptor
+
+
+def test_remote_zip_extract():
+    """Test that deflated and stored members are extracted from a remote zip with range requests."""
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    data = b'a,b\n' + b''.join(b'%d,x%d\n' % (i, i) for i in range(5000))
+    zip_data = io.BytesIO()
+    with zipfile.ZipFile(zip_data, 'w') as archive:
+        archive.writestr('skipped.csv', b'c\n' * 1000, zipfile.ZIP_DEFLATED)
+        archive.writestr('deflated.csv', data, zipfile.ZIP_DEFLATED)
+        archive.writestr('stored.csv', data, zipfile.ZIP_STORED)
+    served = zip_data.getvalue()
+    ranges = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            start, end = self.headers.get('Range')[len('bytes='):].split('-')
+            ranges.append((start, end))
+            if not start:
+                start = len(served) - min(int(end), len(served))
+                end = len(served) - 1
+            start, end = int(start), min(int(end or len(served) - 1), len(served) - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(served)))
+            self.send_header('Content-Length', str(end - start + 1))
+            self.end_headers()
+            self.wfile.write(served[start:end + 1])
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    path = os.path.join(os.getcwd(), 'remote_zip_member.csv')
+    try:
+        remote_zip = RemoteZip('http://127.0.0.1:%d/data.zip' % server.server_address[1])
+        for name in ('deflated.csv', 'stored.csv'):
+            assert remote_zip.extract(name, path) == hashlib.md5(data).hexdigest()
+            with open(path, 'rb') as extracted:
+                assert extracted.read() == data
+    finally:
+        server.shutdown()
+        server.server_close()
+    os.remove(path)
+    # The skipped member is never requested
+    assert len(ranges) == 3
+
+
+def test_postgres_copy_with_commits():
+    """Test that PostgreSQL copies chunks with commits and checkpoints when a commit policy is set."""
+    from retriever.engines.postgres import engine as Postgres
+    copied = []
+    commits = []
+
+    class CopyCursor(DummyCursor):
+        def copy_expert(self, statement, data_file):
+            data = data_file.read()
+            if b'fail' in data:
+                raise IOError("bad chunk")
+            copied.append(data)
+
+    class CopyConnection(DummyConnection):
+        def commit(self):
+            commits.append(len(copied))
+
+    engine = Postgres()
+    engine.script = test_engine.script
+    engine.opts = {'database_name': 'db', 'table_name': '{db}_{table}'}
+    engine._connection = CopyConnection()
+    engine._cursor = CopyCursor()
+    engine.parallel_chunk_size = 16
+    engine.commit_rows = 10
+    engine.table = TabularDataset(name="commits", delimiter=",", columns=[("a", ("int",))])
+    lines = [str(i) for i in range(40)]
+    engine.insert_data_from_file(create_file(['a'] + lines))
+    assert b''.join(copied).split() == [line.encode() for line in lines]
+    assert 1 < len(commits) < len(copied) + 1
+    assert load_checkpoint(engine.checkpoint_key(), engine.table.columns)['file'] is None
+
+    del copied[:]
+    inserted = []
+    engine.insert_batch = inserted.extend
+    engine.insert_data_from_file(create_file(['a'] + lines[:20] + ['fail'] + lines[20:]))
+    resumed = inserted[0][0]
+    assert resumed > 0
+    assert b''.join(copied).split()[:resumed] == [line.encode() for line in lines[:resumed]]
+    assert [row[0] for row in inserted] == list(range(resumed, 40))
+    remove_checkpoint(engine.checkpoint_key())
+
+
+def test_statement_pages():
+    """Test that batches are split into statements of a bounded size."""
+    rows = [[1, 'ab'], [22, None], [333, 'c'], ['x' * 50, 4]]
+    pages = list(statement_pages(rows, 25))
+    assert pages == [rows[:2], rows[2:3], rows[3:]]
+    assert list(statement_pages(rows, 1000)) == [rows]
+    assert list(statement_pages([], 20)) == []
+
+
+def test_blob_store():
+    """Test that identical raw data files share a blob until evicted."""
+    first = create_file(['a,b', '1,2'], 'blob_first.csv')
+    second = create_file(['a,b', '1,2'], 'blob_second.csv')
+    digest = file_digest(first)
+    assert add_blob(first, digest) and add_blob(second, digest)
+    assert os.path.samefile(first, second)
+    assert os.path.samefile(first, blob_path(digest))
+    pin_blob(digest)
+    assert digest not in prune_blobs(0)
+    pin_blob(digest, False)
+    assert digest in prune_blobs(0)
+    assert not os.path.exists(first) and not os.path.exists(second)
+    assert digest not in [stored for stored, info in list_blobs()]
+
+
 def test_getmd5_lines():
     """Test md5 sum calculation given a line."""
     lines = ['a,b,c', '1,2,3', '4,5,6']
@@ -263,6 +1090,169 @@ def test_xml2csv():
     assert obs_out == ['User,Country,Age', 'Alex,US,25', 'Ben,US,24']
 
 
+def test_record_chunks():
+    """Test that chunks end on record boundaries outside quoted fields."""
+    data_file = create_file(['a,b', '1,"x', 'y"', '2,z', '3,w'])
+    chunks = list(record_chunks(data_file, 3, skip=1))
+    with open(data_file, 'rb') as raw:
+        data = raw.read()
+    assert [data[begin:end] for begin, end in chunks] == [b'1,"x\ny"\n', b'2,z\n', b'3,w\n']
+
+
+def test_map_chunks():
+    """Test that parallel parsing returns the same rows in file order."""
+    engine = Engine()
+    engine.table = TabularDataset(name="test", delimiter=",",
+                                  columns=[("a", ("int",)), ("b", ("char", 10))])
+    data_file = create_file(['a,b'] + ['%d,"x%d"' % (i, i) for i in range(50)])
+    results = list(map_chunks(engine, data_file, record_chunks(data_file, 32, skip=1), 3))
+    assert sum(count for count, rows, warnings in results) == 50
+    assert [row for count, rows, warnings in results for row in rows] == \
+           [[i, 'x%d' % i] for i in range(50)]
+
+
+def test_schema_cache():
+    """Test that cached schemas are dropped when the data file changes."""
+    data_file = create_file(['a,b', '1,x'])
+    key = {'test': 'test_schema_cache'}
+    save_schema(key, data_file, ',', [('a', ('int',)), ('b', ('char', 101))], True)
+    assert load_schema(key, data_file) == (',', [('a', ('int',)), ('b', ('char', 101))], True)
+    os.utime(data_file, (0, 0))
+    assert load_schema(key, data_file) is not None
+    with open(data_file, 'a') as data:
+        data.write('2,y\n')
+    assert load_schema(key, data_file) is None
+    os.remove(schema_cache_path(key))
+
+
+def test_large_file_single_pass():
+    """Test that large files are only loaded in chunks when that is asked for."""
+    engine = Engine()
+    engine.script = test_engine.script
+    engine.opts = {'database_name': 'db', 'table_name': '{db}_{table}'}
+    engine._connection = DummyConnection()
+    engine.insert_limit = 5
+    engine.parallel_chunk_size = 16
+    engine.table = TabularDataset(name="single", delimiter=",", columns=[("a", ("int",))])
+    data_file = create_file(['a'] + [str(i) for i in range(20)])
+    chunked = []
+    engine.add_to_table_in_chunks = chunked.append
+    engine.insert_batch = lambda rows: None
+    engine.insert_data_from_file(data_file)
+    assert chunked == []
+    engine.commit_rows = 10
+    engine.insert_data_from_file(data_file)
+    assert chunked == [data_file]
+
+
+def test_resume_from_checkpoint():
+    """Test that a chunked load continues after its last checkpoint."""
+    engine = Engine()
+    engine.script = test_engine.script
+    engine.opts = {'database_name': 'db', 'table_name': '{db}_{table}'}
+    engine._connection = DummyConnection()
+    engine.insert_limit = 5
+    engine.parallel_chunk_size = 16
+    engine.table = TabularDataset(name="resume", delimiter=",", columns=[("a", ("int",))])
+    data_file = create_file(['a'] + [str(i) for i in range(20)])
+    key = engine.checkpoint_key()
+    checkpoint = new_checkpoint(engine.table.columns)
+    checkpoint.update({'file': source_fingerprint(data_file), 'offset': 22, 'record_id': 10})
+    save_checkpoint(key, checkpoint)
+    inserted = []
+    engine.insert_batch = inserted.extend
+    engine.resume = True
+    engine.create_table()
+    engine.insert_data_from_file(data_file)
+    assert inserted == [[i] for i in range(10, 20)]
+    assert engine.table.record_id == 20
+    assert load_checkpoint(key, engine.table.columns)['loaded'][0]['record_id'] == 20
+    engine.final_cleanup()
+    assert load_checkpoint(key, engine.table.columns) is None
+
+
+def test_resume_multiple_files():
+    """Test that a table loaded from several files resumes in the file it was interrupted in."""
+    import sqlite3
+    from retriever.engines.sqlite import engine as SQLite
+    db_file = os.path.join(HOMEDIR, ".retriever", "resume.db")
+    data_files = [create_file(['a'] + [str(i) for i in range(20)], 'resume_first.csv'),
+                  create_file(['a'] + [str(i) for i in range(20, 40)], 'resume_second.csv')]
+
+    def load(stop=None):
+        engine = SQLite()
+        engine.script = test_engine.script
+        engine.opts = {'table_name': '{db}_{table}'}
+        engine._connection = sqlite3.connect(db_file)
+        engine.parallel_chunk_size = 16
+        engine.resume = True
+        engine.table = TabularDataset(name="resume_files", delimiter=",", columns=[("a", ("int",))])
+        insert_batch = engine.insert_batch
+
+        def insert(rows):
+            if stop is not None and rows[-1][0] >= stop:
+                raise IOError("interrupted")
+            insert_batch(rows)
+
+        engine.insert_batch = insert
+        engine.create_table()
+        try:
+            for data_file in data_files:
+                engine.insert_data_from_file(data_file)
+        except IOError:
+            checkpoint = load_checkpoint(engine.checkpoint_key(), engine.table.columns)
+            assert len(checkpoint['loaded']) == 1
+            assert checkpoint['file']['source'] == os.path.abspath(data_files[1])
+            engine.disconnect()
+            raise
+        return engine
+
+    def loaded(engine):
+        cursor = engine.connection.execute("SELECT a FROM " + engine.table_name())
+        return [row[0] for row in cursor]
+
+    with pytest.raises(IOError):
+        load(stop=30)
+    engine = load()
+    assert loaded(engine) == list(range(40))
+    assert engine.table.record_id == 40
+    engine.final_cleanup()
+    assert load_checkpoint(engine.checkpoint_key(), engine.table.columns) is None
+    os.remove(db_file)
+    for data_file in data_files:
+        os.remove(data_file)
+
+
+def test_load_profile_fast():
+    """Test that the fast load profile tunes SQLite while loading and restores it."""
+    import sqlite3
+    from retriever.engines.sqlite import engine as SQLite
+    engine = SQLite()
+    engine.script = test_engine.script
+    engine.opts = {'table_name': '{db}_{table}'}
+    engine._connection = sqlite3.connect(os.path.join(HOMEDIR, ".retriever", "profile.db"))
+    engine.load_profile = "fast"
+    engine.table = TabularDataset(name="profile", columns=[("a", ("int",))])
+
+    def pragma(name):
+        return engine.connection.execute("PRAGMA " + name).fetchone()[0]
+
+    synchronous = pragma("synchronous")
+    engine.create_table()
+    assert (pragma("synchronous"), pragma("journal_mode")) == (0, "memory")
+    engine.end_bulk_load(session=True)
+    assert (pragma("synchronous"), pragma("journal_mode")) == (synchronous, "delete")
+    # A table kept to resume its load is tuned too
+    checkpoint = new_checkpoint(engine.table.columns)
+    save_checkpoint(engine.checkpoint_key(), checkpoint)
+    engine.resume = True
+    engine.create_table()
+    assert (pragma("synchronous"), pragma("journal_mode")) == (0, "memory")
+    engine.final_cleanup()
+    engine.disconnect()
+    os.remove(os.path.join(HOMEDIR, ".retriever", "profile.db"))
+
+
 def test_sort_file():
     """Test md5 sum calculation."""
     data_file = create_file(['Ben,US,24', 'Alex,US,25', 'Alex,PT,25'])